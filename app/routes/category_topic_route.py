@@ -1,7 +1,11 @@
-from fastapi import APIRouter, Query, HTTPException
+from fastapi import APIRouter, Query, HTTPException, Header, Response
 from pydantic import BaseModel
 from datetime import datetime
 from pathlib import Path
+from typing import Optional, List
+from app.utilities.etags import bump_version, not_modified, set_cache_headers
+from app.utilities.reference_snapshot import get_reference_data, refresh_snapshot
+from app.utilities.csv_io import atomic_write_csv, read_csv_rows
 import csv
 
 router = APIRouter()
@@ -16,6 +20,24 @@ class TopicCreate(BaseModel):
     title: str
     description: str
 
+class CategoryIds(BaseModel):
+    category_ids: List[str]
+
+class TopicIds(BaseModel):
+    topic_ids: List[str]
+
+class TopicFields(BaseModel):
+    category_id: Optional[str] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+
+class TopicUpdate(BaseModel):
+    topic_id: str
+    data: TopicFields
+
+class BatchTopicUpdate(BaseModel):
+    updates: List[TopicUpdate]
+
 # ------------------ PATHS ------------------
 
 CATEGORY_ROOT = Path("app/Data/categories")
@@ -40,24 +62,16 @@ def generate_topic_id() -> str:
     return f"TOP-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}"
 
 def category_exists(category_id: str) -> bool:
-    ensure_csv(CATEGORY_CSV, ["category_id", "category_name"])
-    with CATEGORY_CSV.open() as f:
-        reader = csv.reader(f)
-        next(reader, None)
-        for row in reader:
-            if row and row[0].strip() == category_id.strip():
-                return True
-    return False
+    return any(
+        (row["category_id"] or "").strip() == category_id.strip()
+        for row in get_reference_data()["categories"]
+    )
 
 def category_name_exists(category_name: str) -> bool:
-    ensure_csv(CATEGORY_CSV, ["category_id", "category_name"])
-    with CATEGORY_CSV.open() as f:
-        reader = csv.reader(f)
-        next(reader, None)
-        for row in reader:
-            if row and row[1].strip().lower() == category_name.strip().lower():
-                return True
-    return False
+    return any(
+        (row["category_name"] or "").strip().lower() == category_name.strip().lower()
+        for row in get_reference_data()["categories"]
+    )
 
 # ------------------ ENDPOINTS ------------------
 
@@ -72,6 +86,8 @@ def create_category(payload: CategoryCreate):
     with CATEGORY_CSV.open("a", newline="") as f:
         writer = csv.writer(f)
         writer.writerow([category_id, payload.category_name])
+    bump_version("categories")
+    refresh_snapshot()
 
     return {"category_id": category_id, "status": "Category created successfully"}
 
@@ -87,56 +103,54 @@ def create_topic(payload: TopicCreate):
     with TOPIC_CSV.open("a", newline="") as f:
         writer = csv.writer(f)
         writer.writerow([topic_id, payload.category_id.strip(), payload.title, payload.description])
+    bump_version("topics")
+    refresh_snapshot()
 
     return {"topic_id": topic_id, "status": "Topic created successfully"}
 
 
 @router.get("/search-topics")
 def search_topics(category_id: str = Query(...)):
-    ensure_csv(TOPIC_CSV, ["topic_id", "category_id", "title", "description"])
     topics = []
 
-    with TOPIC_CSV.open() as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row["category_id"].strip() == category_id.strip():
-                topics.append({
-                    "topic_id": row["topic_id"],
-                    "title": row["title"],
-                    "description": row["description"]
-                })
+    for row in get_reference_data()["topics"]:
+        if row["category_id"].strip() == category_id.strip():
+            topics.append({
+                "topic_id": row["topic_id"],
+                "title": row["title"],
+                "description": row["description"]
+            })
 
     return {"topics": topics}
 
 @router.get("/get-all-categories")
-def get_all_categories():
-    ensure_csv(CATEGORY_CSV, ["category_id", "category_name"])
+def get_all_categories(response: Response, if_none_match: Optional[str] = Header(None)):
+    cached = not_modified("categories", if_none_match)
+    if cached:
+        return cached
+    set_cache_headers(response, "categories")
+
     categories = []
 
-    with CATEGORY_CSV.open() as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row["category_id"] and row["category_name"]:
-                categories.append({
-                    "category_id": row["category_id"].strip(),
-                    "category_name": row["category_name"].strip()
-                })
+    for row in get_reference_data()["categories"]:
+        if row["category_id"] and row["category_name"]:
+            categories.append({
+                "category_id": row["category_id"].strip(),
+                "category_name": row["category_name"].strip()
+            })
 
     return {"categories": categories}
 
 
 
 @router.get("/get-all-topics")
-def get_all_topics():
-    ensure_csv(TOPIC_CSV, ["topic_id", "category_id", "title", "description"])
-    topics = []
+def get_all_topics(response: Response, if_none_match: Optional[str] = Header(None)):
+    cached = not_modified("topics", if_none_match)
+    if cached:
+        return cached
+    set_cache_headers(response, "topics")
 
-    with TOPIC_CSV.open() as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            topics.append(row)
-
-    return {"topics": topics}
+    return {"topics": get_reference_data()["topics"]}
 
 
 @router.delete("/remove-topic")
@@ -152,6 +166,8 @@ def remove_topic(topic_id: str = Query(...)):
 
     with TOPIC_CSV.open("w", newline="") as f:
         csv.writer(f).writerows([header] + updated)
+    bump_version("topics")
+    refresh_snapshot()
 
     return {"status": "Topic removed successfully"}
 
@@ -178,5 +194,91 @@ def remove_category(category_id: str = Query(...)):
 
     with TOPIC_CSV.open("w", newline="") as f:
         csv.writer(f).writerows([topic_header] + topic_updated)
+    bump_version("categories", "topics")
+    refresh_snapshot()
 
     return {"status": "Category and all topics removed successfully"}
+
+
+# ------------------ BATCH ENDPOINTS ------------------
+# One read and one atomic rewrite per registry file, whatever the batch size.
+
+@router.post("/batch/remove-topics")
+def batch_remove_topics(payload: TopicIds):
+    ensure_csv(TOPIC_CSV, ["topic_id", "category_id", "title", "description"])
+    fieldnames, rows = read_csv_rows(TOPIC_CSV)
+    wanted = {tid.strip() for tid in payload.topic_ids}
+
+    kept = [r for r in rows if r["topic_id"].strip() not in wanted]
+    removed = {r["topic_id"].strip() for r in rows} & wanted
+
+    if removed:
+        atomic_write_csv(TOPIC_CSV, fieldnames, kept)
+        bump_version("topics")
+        refresh_snapshot()
+
+    return {
+        "removed": len(removed),
+        "results": [
+            {"topic_id": tid, "status": "removed" if tid.strip() in removed else "not_found"}
+            for tid in payload.topic_ids
+        ]
+    }
+
+
+@router.post("/batch/update-topics")
+def batch_update_topics(payload: BatchTopicUpdate):
+    ensure_csv(TOPIC_CSV, ["topic_id", "category_id", "title", "description"])
+    fieldnames, rows = read_csv_rows(TOPIC_CSV)
+    changes = {u.topic_id.strip(): u.data.model_dump(exclude_none=True) for u in payload.updates}
+    status = {}
+
+    for row in rows:
+        fields = changes.get(row["topic_id"].strip())
+        if fields is None:
+            continue
+        if "category_id" in fields and not category_exists(fields["category_id"]):
+            status[row["topic_id"].strip()] = "category_not_found"
+            continue
+        row.update({k: v.strip() if k == "category_id" else v for k, v in fields.items()})
+        status[row["topic_id"].strip()] = "updated"
+
+    if "updated" in status.values():
+        atomic_write_csv(TOPIC_CSV, fieldnames, rows)
+        bump_version("topics")
+        refresh_snapshot()
+
+    return {
+        "updated": sum(1 for s in status.values() if s == "updated"),
+        "results": [
+            {"topic_id": u.topic_id, "status": status.get(u.topic_id.strip(), "not_found")}
+            for u in payload.updates
+        ]
+    }
+
+
+@router.post("/batch/remove-categories")
+def batch_remove_categories(payload: CategoryIds):
+    ensure_csv(CATEGORY_CSV, ["category_id", "category_name"])
+    ensure_csv(TOPIC_CSV, ["topic_id", "category_id", "title", "description"])
+    wanted = {cid.strip() for cid in payload.category_ids}
+
+    cat_fields, categories = read_csv_rows(CATEGORY_CSV)
+    removed = {r["category_id"].strip() for r in categories} & wanted
+
+    if removed:
+        atomic_write_csv(CATEGORY_CSV, cat_fields, [r for r in categories if r["category_id"].strip() not in removed])
+
+        topic_fields, topics = read_csv_rows(TOPIC_CSV)
+        atomic_write_csv(TOPIC_CSV, topic_fields, [r for r in topics if r["category_id"].strip() not in removed])
+
+        bump_version("categories", "topics")
+        refresh_snapshot()
+
+    return {
+        "removed": len(removed),
+        "results": [
+            {"category_id": cid, "status": "removed" if cid.strip() in removed else "not_found"}
+            for cid in payload.category_ids
+        ]
+    }
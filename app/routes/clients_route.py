@@ -1,7 +1,11 @@
-from fastapi import APIRouter, Query, HTTPException
+from fastapi import APIRouter, Query, HTTPException, Header, Response
 from pydantic import BaseModel, Field
 from datetime import datetime
 from pathlib import Path
+from typing import Optional, List
+from app.utilities.etags import bump_version, not_modified, set_cache_headers
+from app.utilities.reference_snapshot import get_reference_data, find_client, refresh_snapshot
+from app.utilities.csv_io import atomic_write_csv, read_csv_rows
 import json, csv, shutil
 
 router = APIRouter()
@@ -38,6 +42,15 @@ class RemoveClientField(BaseModel):
     field_name: str
 
 
+class BatchRemoveClients(BaseModel):
+    client_ids: List[str]
+    delete_all_data: bool = False
+
+
+class BatchUpdateClients(BaseModel):
+    updates: List[UpdateClientData]
+
+
 # ------------------ HELPERS ------------------
 
 CLIENT_ROOT = Path("app/Data/clients")
@@ -57,23 +70,15 @@ def ensure_csv_header():
 
 
 def client_name_exists(name: str) -> bool:
-    if not CLIENT_REG.exists():
-        return False
-    with CLIENT_REG.open() as f:
-        rows = csv.reader(f)
-        next(rows, None)  # skip header
-        return any(row and row[1].strip().lower() == name.lower() for row in rows)
+    return any(
+        (row["client_name"] or "").strip().lower() == name.lower()
+        for row in get_reference_data()["clients"]
+    )
 
 
 def find_client_folder(client_id: str) -> Path | None:
-    if not CLIENT_ROOT.exists():
-        return None
-    for folder in CLIENT_ROOT.iterdir():
-        profile = folder / "profile.json"
-        if profile.exists():
-            if json.loads(profile.read_text()).get("client_id") == client_id:
-                return folder
-    return None
+    entry = find_client(client_id)
+    return CLIENT_ROOT / entry["folder"] if entry else None
 
 
 # ------------------ ENDPOINTS ------------------
@@ -100,6 +105,8 @@ def create_client(payload: ClientCreate):
     with CLIENT_REG.open("a", newline="") as f:
         writer = csv.writer(f)
         writer.writerow([client_id, payload.client_name, payload.tagline, payload.focus, payload.logo_urls])
+    bump_version("clients")
+    refresh_snapshot()
 
     return {"client_id": client_id, "status": "Client created successfully"}
 
@@ -123,6 +130,8 @@ def remove_client(client_id: str = Query(...), delete_all_data: bool = Query(Fal
         folder = find_client_folder(client_id)
         if folder:
             shutil.rmtree(folder, ignore_errors=True)
+    bump_version("clients")
+    refresh_snapshot()
 
     return {"status": "Client and all data removed successfully"}
 
@@ -137,6 +146,8 @@ def add_client_data(payload: UpdateClientData):
     profile = json.loads(profile_path.read_text())
     profile.update(payload.data)
     profile_path.write_text(json.dumps(profile, indent=4))
+    bump_version("clients")
+    refresh_snapshot()
 
     return {"status": "Data added successfully"}
 
@@ -155,35 +166,96 @@ def remove_client_data(payload: RemoveClientField):
 
     del profile[payload.field_name]
     profile_path.write_text(json.dumps(profile, indent=4))
+    bump_version("clients")
+    refresh_snapshot()
     return {"status": "Field removed successfully"}
 
 
 
 @router.get("/all-clients")
-def get_all_clients():
+def get_all_clients(response: Response, if_none_match: Optional[str] = Header(None)):
+    cached = not_modified("clients", if_none_match)
+    if cached:
+        return cached
+    set_cache_headers(response, "clients")
+
     if not CLIENT_ROOT.exists():
         raise HTTPException(404, "No clients found")
 
     clients_list = []
 
-    for folder in CLIENT_ROOT.iterdir():
-        profile_path = folder / "profile.json"
-        if profile_path.exists():
-            profile = json.loads(profile_path.read_text())
-            client_data = {
-                "id": profile.get("client_id"),
-                "name": profile.get("client_name"),
-                "focus": profile.get("focus"),
-                "services": profile.get("services"),
-                "business_description": profile.get("business_description"),
-                "contact_info": profile.get("contact_info"),
-                "website": profile.get("website"),
-                "number": profile.get("number"),
-                "mail": profile.get("mail")
-            }
-            clients_list.append(client_data)
+    for entry in get_reference_data()["profiles"].values():
+        profile = entry["profile"]
+        client_data = {
+            "id": profile.get("client_id"),
+            "name": profile.get("client_name"),
+            "focus": profile.get("focus"),
+            "services": profile.get("services"),
+            "business_description": profile.get("business_description"),
+            "contact_info": profile.get("contact_info"),
+            "website": profile.get("website"),
+            "number": profile.get("number"),
+            "mail": profile.get("mail")
+        }
+        clients_list.append(client_data)
 
     if not clients_list:
         raise HTTPException(404, "No client data found")
 
-    return {"clients": clients_list}
\ No newline at end of file
+    return {"clients": clients_list}
+
+
+# ------------------ BATCH ENDPOINTS ------------------
+
+@router.post("/batch/remove")
+def batch_remove_clients(payload: BatchRemoveClients):
+    if not CLIENT_REG.exists():
+        raise HTTPException(404, "Client registry not found")
+
+    fieldnames, rows = read_csv_rows(CLIENT_REG)
+    wanted = set(payload.client_ids)
+    removed = {r["client_id"] for r in rows} & wanted
+
+    if removed:
+        atomic_write_csv(CLIENT_REG, fieldnames, [r for r in rows if r["client_id"] not in removed])
+
+        if payload.delete_all_data:
+            for client_id in removed:
+                folder = find_client_folder(client_id)
+                if folder:
+                    shutil.rmtree(folder, ignore_errors=True)
+
+        bump_version("clients")
+        refresh_snapshot()
+
+    return {
+        "removed": len(removed),
+        "results": [
+            {"client_id": cid, "status": "removed" if cid in removed else "not_found"}
+            for cid in payload.client_ids
+        ]
+    }
+
+
+@router.post("/batch/update")
+def batch_update_clients(payload: BatchUpdateClients):
+    results = []
+
+    for update in payload.updates:
+        folder = find_client_folder(update.client_id)
+        if not folder:
+            results.append({"client_id": update.client_id, "status": "not_found"})
+            continue
+
+        profile_path = folder / "profile.json"
+        profile = json.loads(profile_path.read_text())
+        profile.update(update.data)
+        profile_path.write_text(json.dumps(profile, indent=4))
+        results.append({"client_id": update.client_id, "status": "updated"})
+
+    updated = sum(1 for r in results if r["status"] == "updated")
+    if updated:
+        bump_version("clients")
+        refresh_snapshot()
+
+    return {"updated": updated, "results": results}
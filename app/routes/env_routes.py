@@ -1,13 +1,11 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header, Response
 from pydantic import BaseModel
-import os
-from dotenv import load_dotenv, dotenv_values, set_key
+from typing import Optional
+from app.utilities.etags import not_modified, set_cache_headers
+from app.utilities import config
 
 router = APIRouter()
 
-load_dotenv()
-ENV_PATH = ".env"
-
 class EnvKeys(BaseModel):
     openai_api_key: str
     imgbb_api_key: str
@@ -16,9 +14,12 @@ class EnvKeys(BaseModel):
 @router.post("/set")
 def set_env_keys(keys: EnvKeys):
     try:
-        set_key(ENV_PATH, "OPENAI_API_KEY", keys.openai_api_key)
-        set_key(ENV_PATH, "IMGBB_API_KEY", keys.imgbb_api_key)
-        set_key(ENV_PATH, "MAIL_API_KEY", keys.mail_api_key)
+        # One atomic write; subscribers rebuild their clients with the new keys
+        config.update({
+            "OPENAI_API_KEY": keys.openai_api_key,
+            "IMGBB_API_KEY": keys.imgbb_api_key,
+            "MAIL_API_KEY": keys.mail_api_key,
+        })
 
         return {"status": "success", "message": "API keys saved securely ✅"}
     
@@ -33,11 +34,14 @@ def mask_key(key: str):
 
 
 @router.get("/get")
-def get_env_keys():
-    env_vars = dotenv_values(ENV_PATH)
+def get_env_keys(response: Response, if_none_match: Optional[str] = Header(None)):
+    cached = not_modified("env", if_none_match)
+    if cached:
+        return cached
+    set_cache_headers(response, "env")
 
     return {
-        "openai_api_key": mask_key(env_vars.get("OPENAI_API_KEY")),
-        "imgbb_api_key": mask_key(env_vars.get("IMGBB_API_KEY")),
-        "mail_api_key": mask_key(env_vars.get("MAIL_API_KEY")),
+        "openai_api_key": mask_key(config.get("OPENAI_API_KEY")),
+        "imgbb_api_key": mask_key(config.get("IMGBB_API_KEY")),
+        "mail_api_key": mask_key(config.get("MAIL_API_KEY")),
     }
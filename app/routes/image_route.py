@@ -1,17 +1,36 @@
-from fastapi import APIRouter, UploadFile, File, Form, Query, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, Query, Header, HTTPException
+from fastapi.responses import FileResponse, Response
+from pydantic import BaseModel
 from pathlib import Path
+from typing import List, Optional
 from datetime import datetime
-import csv, os, requests
-from dotenv import load_dotenv
-
-load_dotenv()
-IMGBB_API_KEY = os.getenv("IMGBB_API_KEY")
+import csv, requests
+from app.utilities.reference_snapshot import get_reference_data, get_client_name, refresh_snapshot
+from app.utilities.csv_io import atomic_write_csv
+from app.utilities.image_proxy import get_cached_image, release_image, cache_stats, ProxyError
+from app.utilities import config
 
 router = APIRouter()
 
+# ------------------ SCHEMAS ------------------
+class ImageIds(BaseModel):
+    image_ids: List[str]
+
+class ImageFields(BaseModel):
+    image_name: Optional[str] = None
+    client_id: Optional[str] = None
+
+class ImageUpdate(BaseModel):
+    image_id: str
+    data: ImageFields
+
+class BatchImageUpdate(BaseModel):
+    updates: List[ImageUpdate]
+
 # ------------------ PATHS ------------------
 IMAGE_ROOT = Path("app/Data/images")
 IMAGE_CSV = IMAGE_ROOT / "management.csv"
+IMAGE_FIELDS = ["image_id", "image_name", "url", "client_id"]
 CLIENT_CSV = Path("app/Data/clients/management.csv")
 IMAGE_ROOT.mkdir(parents=True, exist_ok=True)
 
@@ -41,24 +60,22 @@ def write_csv(path: Path, rows: list[dict]):
         writer.writerows(rows)
 
 def client_exists(client_id: str) -> bool:
-    if not CLIENT_CSV.exists():
-        return False
-    with CLIENT_CSV.open("r", newline="") as f:
-        reader = csv.DictReader(f)
-        return any(row["client_id"] == client_id for row in reader)
+    return get_client_name(client_id) is not None
 
 # ------------------ ENDPOINTS ------------------
 
 @router.post("/upload")
-async def upload_image(
+def upload_image(
     file: UploadFile = File(...),
     image_name: str = Form(...),
     client_id: str = Form(...)
 ):
     """
-    Uploads image to ImgBB, saves record in CSV, returns URL.
+    Uploads image to ImgBB, saves record in CSV, returns URL. A plain def:
+    the upload and the CSV write block, so FastAPI runs it in a worker thread.
     """
-    if not IMGBB_API_KEY:
+    imgbb_api_key = config.get("IMGBB_API_KEY")
+    if not imgbb_api_key:
         raise HTTPException(500, "ImgBB API key not found")
 
     if not client_exists(client_id):
@@ -67,7 +84,7 @@ async def upload_image(
     # Upload to ImgBB
     response = requests.post(
         "https://api.imgbb.com/1/upload",
-        params={"key": IMGBB_API_KEY, "name": image_name},
+        params={"key": imgbb_api_key, "name": image_name},
         files={"image": file.file}
     )
 
@@ -86,6 +103,7 @@ async def upload_image(
     with IMAGE_CSV.open("a", newline="") as f:
         writer = csv.writer(f)
         writer.writerow([image_id, image_name, image_url, client_id])
+    refresh_snapshot()
 
     return {
         "image_id": image_id,
@@ -94,6 +112,39 @@ async def upload_image(
     }
 
 
+class PinnedFileResponse(FileResponse):
+    """Unpins a cached image once it has been sent, or the client went away."""
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            release_image(Path(self.path))
+
+
+@router.get("/proxy")
+async def proxy_image(url: str = Query(...), if_none_match: Optional[str] = Header(None)):
+    """
+    Serves a remote image from the local cache, fetching it once on a miss.
+    Supports conditional requests (ETag) and byte ranges.
+    """
+    try:
+        path, meta = await get_cached_image(url)
+    except ProxyError as e:
+        raise HTTPException(e.status_code, e.detail)
+
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": meta["etag"]}
+    if if_none_match and meta["etag"] in [t.strip() for t in if_none_match.split(",")]:
+        release_image(path)
+        return Response(status_code=304, headers=headers)
+
+    return PinnedFileResponse(path, media_type=meta["content_type"], headers=headers)
+
+
+@router.get("/proxy/stats")
+def proxy_stats():
+    return cache_stats()
+
+
 @router.get("/search")
 def search_image(image_id: str = Query(None), image_name: str = Query(None)):
     """
@@ -102,7 +153,7 @@ def search_image(image_id: str = Query(None), image_name: str = Query(None)):
     if not image_id and not image_name:
         raise HTTPException(400, "Provide at least image_id or image_name for search")
 
-    records = read_csv(IMAGE_CSV)
+    records = get_reference_data()["images"]
     results = []
 
     for r in records:
@@ -128,5 +179,60 @@ def remove_image(image_id: str = Query(...)):
     # Remove from CSV
     updated = [r for r in records if r["image_id"] != image_id]
     write_csv(IMAGE_CSV, updated)
+    refresh_snapshot()
 
     return {"status": "Image deleted successfully"}
+
+
+@router.post("/batch/remove")
+def batch_remove_images(payload: ImageIds):
+    """
+    Delete many image records in a single rewrite of the registry
+    """
+    records = read_csv(IMAGE_CSV)
+    wanted = set(payload.image_ids)
+
+    removed = {r["image_id"] for r in records} & wanted
+    if removed:
+        atomic_write_csv(IMAGE_CSV, IMAGE_FIELDS, [r for r in records if r["image_id"] not in removed])
+        refresh_snapshot()
+
+    return {
+        "removed": len(removed),
+        "results": [
+            {"image_id": iid, "status": "removed" if iid in removed else "not_found"}
+            for iid in payload.image_ids
+        ]
+    }
+
+
+@router.post("/batch/update")
+def batch_update_images(payload: BatchImageUpdate):
+    """
+    Rename or reassign many image records in a single rewrite of the registry
+    """
+    records = read_csv(IMAGE_CSV)
+    changes = {u.image_id: u.data.model_dump(exclude_none=True) for u in payload.updates}
+    status = {}
+
+    for r in records:
+        fields = changes.get(r["image_id"])
+        if fields is None:
+            continue
+        if "client_id" in fields and not client_exists(fields["client_id"]):
+            status[r["image_id"]] = "client_not_found"
+            continue
+        r.update(fields)
+        status[r["image_id"]] = "updated"
+
+    if "updated" in status.values():
+        atomic_write_csv(IMAGE_CSV, IMAGE_FIELDS, records)
+        refresh_snapshot()
+
+    return {
+        "updated": sum(1 for s in status.values() if s == "updated"),
+        "results": [
+            {"image_id": u.image_id, "status": status.get(u.image_id, "not_found")}
+            for u in payload.updates
+        ]
+    }
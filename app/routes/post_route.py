@@ -1,21 +1,36 @@
 # app/routers/posts.py
-from fastapi import APIRouter,HTTPException
-from app.utilities.generate_posts import generate_posts
-from typing import List, Optional
+from fastapi import APIRouter,HTTPException, Header, Response, Query
+from fastapi.responses import StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
+from app.utilities.generate_posts import generate_posts, resume_run
+from typing import List, Optional, Literal
+from datetime import date
 from pydantic import BaseModel
 from app.utilities.generate_posts import PostResponse
 from pathlib import Path
 from app.utilities.format_prompt import get_client_profile
-import csv
+from app.utilities.etags import bump_version, not_modified, set_cache_headers
+from app.utilities.export_posts import EXPORT_MEDIA_TYPES, stream_ndjson, stream_csv, write_columnar
+from app.utilities.post_store import iter_post_rows, rewrite_posts, has_posts
+from app.utilities.post_stats import record_finalized, record_changes
+from app.utilities.hashtag_engine import suggest_hashtags, history_size, index_changes
+from app.utilities.caption_dedup import index_changes as index_caption_changes
+from app.utilities.post_writer import exclusive_posts, flush_posts
+from app.utilities.model_router import routing_report
+from app.utilities.generation_runs import new_run_id, load_run
+from app.utilities.caption_batches import submit_batch, refresh_batch, list_batches
+from app.utilities.single_flight import generation_flight, request_key
+from app.utilities.idempotency import IdempotencyConflict, IdempotencyInProgress, fingerprint, arun_idempotent
+import os, tempfile
+import anyio
 
 router = APIRouter()
 
-POSTS_CSV = Path("app/Data/posts/management.csv")
-
 # ---------- MODELS ----------
 
 class RemovePostModel(BaseModel):
     post_id: str
+    client_id: Optional[str] = None  # limits the lookup to this client's shards
 
 
 class FinalizePostModel(BaseModel):
@@ -23,6 +38,29 @@ class FinalizePostModel(BaseModel):
     post_ids: List[str]
 
 
+class PostIdsModel(BaseModel):
+    post_ids: List[str]
+    client_id: Optional[str] = None
+
+
+class PostFields(BaseModel):
+    caption: Optional[str] = None
+    hashtags: Optional[List[str]] = None
+    topics: Optional[List[str]] = None
+    category_id: Optional[str] = None
+    image_url: Optional[str] = None
+
+
+class PostUpdate(BaseModel):
+    post_id: str
+    data: PostFields
+
+
+class BatchUpdatePostsModel(BaseModel):
+    updates: List[PostUpdate]
+    client_id: Optional[str] = None
+
+
 class CreatePostRequest(BaseModel):
     client_id: str
     category_id: Optional[str] = None
@@ -34,6 +72,12 @@ class CreatePostRequest(BaseModel):
 
 class CreatePostResponse(BaseModel):
     posts: List[PostResponse]
+    usage: Optional[dict] = None  # prompt token report + API token usage
+    run_id: Optional[str] = None  # checkpointed run, see /posts/runs/{run_id}
+
+class CaptionBatchRequest(BaseModel):
+    requests: List[CreatePostRequest]
+    provider: Optional[Literal["openai", "local"]] = None  # default CAPTION_BATCH_PROVIDER
 
 def send_email(to_email: str, subject: str, body: str):
     print("\n📧 Sending Email To:", to_email)
@@ -42,94 +86,364 @@ def send_email(to_email: str, subject: str, body: str):
     print("✅ Email sent simulation complete\n")
 
 
+def _generation_key(request: CreatePostRequest) -> str:
+    return request_key({
+        "client_id": request.client_id.strip(),
+        "category_id": (request.category_id or "").strip(),
+        "topics": sorted({t.strip() for t in request.topics}),
+        "number_of_posts": request.number_of_posts,
+        "custom_prompt": (request.custom_prompt or "").strip(),
+        "visual_style": request.visual_style.strip(),
+        "reference_image": [u.strip() for u in request.reference_image or []],
+    })
+
+
 @router.post("/create", response_model=CreatePostResponse)
-def create_post(request: CreatePostRequest):
-    posts = generate_posts(
-        client_id=request.client_id,
-        category_id=request.category_id,
-        topic_ids=request.topics,
-        visual_style=request.visual_style,
-        number_of_posts=request.number_of_posts,
-        reference_image=request.reference_image,
-        custom_prompt=request.custom_prompt
-    )
-    return CreatePostResponse(posts=posts)
+async def create_post(
+    request: CreatePostRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None),
+):
+    async def generate(run_id: str) -> dict:
+        usage = {}
+        try:
+            if await anyio.to_thread.run_sync(load_run, run_id):
+                # A retry of a failed idempotent request continues its run
+                posts = await resume_run(run_id, usage=usage)
+            else:
+                posts = await generate_posts(
+                    client_id=request.client_id,
+                    category_id=request.category_id,
+                    topic_ids=request.topics,
+                    visual_style=request.visual_style,
+                    number_of_posts=request.number_of_posts,
+                    reference_image=request.reference_image,
+                    custom_prompt=request.custom_prompt,
+                    usage=usage,
+                    run_id=run_id
+                )
+        finally:
+            # Every post saved by this request is on disk before we answer
+            await anyio.to_thread.run_sync(flush_posts)
+        return CreatePostResponse(posts=posts, usage=usage, run_id=run_id).model_dump()
+
+    async def run(context: dict) -> dict:
+        # Identical requests already running share that generation
+        return await generation_flight.ado(_generation_key(request), lambda: generate(context["run_id"]))
+
+    if not idempotency_key:
+        return await run({"run_id": new_run_id()})
+
+    try:
+        # The run id is stored with the key, so a retry after a failure
+        # resumes that run instead of paying for a new one
+        result, replayed = await arun_idempotent(
+            idempotency_key, fingerprint(request.model_dump_json()), run,
+            context={"run_id": new_run_id()},
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(422, str(e))
+    except IdempotencyInProgress as e:
+        raise HTTPException(409, str(e))
+
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+@router.get("/runs/{run_id}")
+def get_run(run_id: str):
+    """Checkpoint of a generation run: its request, captions and per-post image status."""
+    run = load_run(run_id)
+    if not run:
+        raise HTTPException(404, "Run not found")
+    return run
+
+
+@router.post("/runs/{run_id}/resume", response_model=CreatePostResponse)
+async def resume_generation_run(run_id: str):
+    """Finishes a failed run, redoing only the steps that did not complete."""
+    async def resume() -> dict:
+        usage = {}
+        try:
+            posts = await resume_run(run_id, usage=usage)
+        finally:
+            await anyio.to_thread.run_sync(flush_posts)
+        return CreatePostResponse(posts=posts, usage=usage, run_id=run_id).model_dump()
+
+    return await generation_flight.ado(f"resume:{run_id}", resume)
+
+# ---------- BULK CAPTIONS ----------
+# Non-urgent generations go through a provider batch instead of /create.
+# Each finished request becomes a run with captions and pending images;
+# POST /runs/{run_id}/resume generates the images.
+
+@router.post("/batches", status_code=202)
+async def create_caption_batch(data: CaptionBatchRequest):
+    items = [
+        {
+            "client_id": r.client_id,
+            "category_id": r.category_id,
+            "topic_ids": r.topics,
+            "visual_style": r.visual_style,
+            "reference_image": r.reference_image or [],
+            "number_of_posts": r.number_of_posts,
+            "custom_prompt": r.custom_prompt,
+        }
+        for r in data.requests
+    ]
+    try:
+        job = await submit_batch(items, data.provider)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except RuntimeError as e:
+        raise HTTPException(502, str(e))
+    return job
+
+
+@router.get("/batches")
+def get_caption_batches():
+    return {"batches": list_batches()}
+
+
+@router.get("/batches/{batch_id}")
+async def get_caption_batch(batch_id: str):
+    """The job record, refreshed from the provider while it is unfinished."""
+    job = await refresh_batch(batch_id)
+    if not job:
+        raise HTTPException(404, "Batch not found")
+    return job
 
 @router.delete("/remove")
+@exclusive_posts
 def remove_post(data: RemovePostModel):
-    if not POSTS_CSV.exists():
+    if not has_posts():
         raise HTTPException(404, "Post database not found")
 
-    with open(POSTS_CSV, "r", encoding="utf-8") as f:
-        rows = list(csv.DictReader(f))
-
-    new_rows = [row for row in rows if row["post_id"] != data.post_id]
+    changes, found = rewrite_posts(lambda row: None, [data.post_id], client_id=data.client_id)
 
-    if len(new_rows) == len(rows):
+    if not found:
         raise HTTPException(404, "Post ID not found")
 
-    with open(POSTS_CSV, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-        writer.writeheader()
-        writer.writerows(new_rows)
+    bump_version("posts")
+    record_changes(removed=[old for old, _ in changes])
+    index_changes(removed=[old for old, _ in changes])
+    index_caption_changes(removed=[old for old, _ in changes])
 
     return {"status": "Post deleted successfully"}
 
 
+def _mark_finalized(row: dict) -> dict:
+    row["finalized"] = "True"
+    return row
+
+
 @router.post("/finalize-post")
+@exclusive_posts
 def finalize_post(data: FinalizePostModel):
-    if not POSTS_CSV.exists():
+    if not has_posts():
         raise HTTPException(404, "Post database not found")
 
-    with open(POSTS_CSV, "r", encoding="utf-8") as f:
-        rows = list(csv.DictReader(f))
+    changes, found = rewrite_posts(_mark_finalized, data.post_ids, client_id=data.client_id)
 
-    updated_rows = []
-    posts_to_send = []
+    posts_to_send = [
+        {
+            "caption": row["caption"],
+            "hashtags": row.get("hashtags", ""),
+            "image_url": row["image_url"]
+        }
+        for row in found.values()
+    ]
 
-    for row in rows:
-        if row["post_id"] in data.post_ids:
-            row["finalized"] = "True"
-            posts_to_send.append({
-                "caption": row["caption"],
-                "hashtags": row.get("hashtags", ""),
-                "image_url": row["image_url"]
-            })
-        updated_rows.append(row)
-
-    with open(POSTS_CSV, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=rows[0].keys())
-        writer.writeheader()
-        writer.writerows(updated_rows)
+    if changes:
+        bump_version("posts")
+        record_finalized([old for old, _ in changes])
 
     if not posts_to_send:
         raise HTTPException(404, "No matching post IDs found")
 
 
 @router.get("/get-all-posts")
-def get_all_posts():
-    if not POSTS_CSV.exists():
+def get_all_posts(
+    response: Response,
+    client_id: Optional[str] = Query(None),
+    if_none_match: Optional[str] = Header(None)
+):
+    # Rows still buffered in this process belong in the listing and its ETag
+    flush_posts()
+    cached = not_modified("posts", if_none_match)
+    if cached:
+        return cached
+    set_cache_headers(response, "posts")
+
+    if not has_posts():
         raise HTTPException(404, "No posts found")
 
     posts = []
-    with open(POSTS_CSV, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            # return all post fields, including finalized status if present
-            posts.append({
-                "post_id": row.get("post_id"),
-                "client_id": row.get("client_id"),
-                "category_id": row.get("category_id"),
-                "topics": row.get("topics").split(",") if row.get("topics") else [],
-                "caption": row.get("caption"),
-                "hashtags": row.get("hashtags", ""),
-                "image_url": row.get("image_url"),
-                "visual_style": row.get("visual_style"),
-                "finalized": row.get("finalized", "False")
-            })
+    for row in iter_post_rows(client_id=client_id):
+        # return all post fields, including finalized status if present
+        posts.append({
+            "post_id": row.get("post_id"),
+            "client_id": row.get("client_id"),
+            "category_id": row.get("category_id"),
+            "topics": row.get("topics").split(",") if row.get("topics") else [],
+            "caption": row.get("caption"),
+            "hashtags": row.get("hashtags", ""),
+            "image_url": row.get("image_url"),
+            "visual_style": row.get("visual_style"),
+            "finalized": row.get("finalized", "False")
+        })
 
     if not posts:
         raise HTTPException(404, "No posts found")
 
     return {"posts": posts}
 
+
+@router.get("/routing")
+def get_routing_stats():
+    """
+    Rolling per-model latency, failure and cost statistics, plus the most
+    recent caption routing decisions.
+    """
+    return routing_report()
+
+
+@router.get("/coalescing")
+def get_coalescing_stats():
+    """How many /create calls shared an identical in-flight generation."""
+    return generation_flight.stats()
+
+
+@router.get("/hashtags/suggest")
+def suggest_post_hashtags(
+    client_id: str = Query(...),
+    topic_ids: List[str] = Query([]),
+    seed: List[str] = Query([], description="Hashtags the post already has"),
+    prefix: str = Query("", description="Complete hashtags starting with this"),
+    caption: str = Query(""),
+    limit: int = Query(10, ge=1, le=50)
+):
+    """
+    Ranks the client's past hashtags for the given topics, from the
+    co-occurrence statistics of its post history.
+    """
+    return {
+        "client_id": client_id,
+        "history_posts": history_size(client_id),
+        "suggestions": suggest_hashtags(client_id, topic_ids, seed, prefix, caption, limit),
+    }
+
+
+@router.get("/export")
+def export_posts(
+    format: Literal["ndjson", "csv", "parquet", "arrow"] = Query("ndjson"),
+    client_id: Optional[str] = Query(None),
+    date_from: Optional[date] = Query(None),
+    date_to: Optional[date] = Query(None),
+    finalized: Optional[bool] = Query(None),
+):
+    """
+    Streams every matching post without loading the dataset into memory.
+    An empty store or an empty selection yields an empty export, not a 404.
+    """
+    flush_posts()
+    rows = iter_post_rows(client_id=client_id, date_from=date_from, date_to=date_to, finalized=finalized)
+    filename = f"posts-export.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+    if format == "ndjson":
+        return StreamingResponse(stream_ndjson(rows), media_type=EXPORT_MEDIA_TYPES[format], headers=headers)
+    if format == "csv":
+        return StreamingResponse(stream_csv(rows), media_type=EXPORT_MEDIA_TYPES[format], headers=headers)
+
+    # Columnar files need their footer/schema written before they can be
+    # sent, so they are built batch by batch in a temp file and streamed back.
+    fd, tmp_path = tempfile.mkstemp(suffix=f".{format}")
+    os.close(fd)
+    try:
+        write_columnar(rows, format, Path(tmp_path))
+    except ImportError:
+        os.unlink(tmp_path)
+        raise HTTPException(501, "Columnar export requires pyarrow to be installed")
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+    return FileResponse(
+        tmp_path,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        filename=filename,
+        background=BackgroundTask(os.unlink, tmp_path),
+    )
+
+
+# ---------- BATCH MUTATIONS ----------
+# Each batch reads the affected shards once, applies every id in memory and
+# writes each changed shard back atomically, returning a status per id.
+
+@router.post("/batch/remove")
+@exclusive_posts
+def batch_remove_posts(data: PostIdsModel):
+    changes, found = rewrite_posts(lambda row: None, data.post_ids, client_id=data.client_id)
+
+    if changes:
+        bump_version("posts")
+        record_changes(removed=[old for old, _ in changes])
+        index_changes(removed=[old for old, _ in changes])
+        index_caption_changes(removed=[old for old, _ in changes])
+
+    return {
+        "removed": len(found),
+        "results": [
+            {"post_id": pid, "status": "removed" if pid in found else "not_found"}
+            for pid in data.post_ids
+        ]
+    }
+
+
+@router.post("/batch/finalize")
+@exclusive_posts
+def batch_finalize_posts(data: PostIdsModel):
+    changes, found = rewrite_posts(_mark_finalized, data.post_ids, client_id=data.client_id)
+    newly_finalized = {old["post_id"] for old, _ in changes}
+
+    if changes:
+        bump_version("posts")
+        record_finalized([old for old, _ in changes])
+
+    def status(pid: str) -> str:
+        if pid in newly_finalized:
+            return "finalized"
+        return "already_finalized" if pid in found else "not_found"
+
+    return {
+        "finalized": len(newly_finalized),
+        "results": [{"post_id": pid, "status": status(pid)} for pid in data.post_ids]
+    }
+
+
+@router.post("/batch/update")
+@exclusive_posts
+def batch_update_posts(data: BatchUpdatePostsModel):
+    fields_by_id = {u.post_id: u.data.model_dump(exclude_none=True) for u in data.updates}
+
+    def apply_update(row: dict) -> dict:
+        for key, value in fields_by_id[row["post_id"]].items():
+            row[key] = ",".join(value) if isinstance(value, list) else value
+        return row
+
+    changes, found = rewrite_posts(apply_update, list(fields_by_id), client_id=data.client_id)
+
+    if changes:
+        bump_version("posts")
+        record_changes(added=[new for _, new in changes], removed=[old for old, _ in changes])
+        index_changes(added=[new for _, new in changes], removed=[old for old, _ in changes])
+        index_caption_changes(added=[new for _, new in changes], removed=[old for old, _ in changes])
+
+    return {
+        "updated": len(found),
+        "results": [
+            {"post_id": u.post_id, "status": "updated" if u.post_id in found else "not_found"}
+            for u in data.updates
+        ]
+    }
@@ -0,0 +1,42 @@
+from fastapi import APIRouter, HTTPException, Header, Query
+from fastapi.responses import FileResponse
+from typing import Optional
+import json
+from app.utilities.profiling import ADMIN_TOKEN, token_matches, list_profiles, profile_paths
+
+router = APIRouter()
+
+
+def _require_admin(x_profile: Optional[str], profile: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(404, "Profiling is not enabled")
+    if not token_matches(x_profile or profile):
+        raise HTTPException(403, "Invalid profile token")
+
+
+# ------------------ ENDPOINTS ------------------
+
+@router.get("")
+def get_profiles(x_profile: Optional[str] = Header(None), profile: Optional[str] = Query(None)):
+    _require_admin(x_profile, profile)
+    return {"profiles": list_profiles()}
+
+
+@router.get("/{profile_id}")
+def get_profile(profile_id: str, x_profile: Optional[str] = Header(None), profile: Optional[str] = Query(None)):
+    """Request details and the most sampled functions."""
+    _require_admin(x_profile, profile)
+    paths = profile_paths(profile_id)
+    if not paths:
+        raise HTTPException(404, "Profile not found")
+    return json.loads(paths[0].read_text())
+
+
+@router.get("/{profile_id}/download")
+def download_profile(profile_id: str, x_profile: Optional[str] = Header(None), profile: Optional[str] = Query(None)):
+    """Folded stacks, loadable in speedscope or flamegraph.pl."""
+    _require_admin(x_profile, profile)
+    paths = profile_paths(profile_id)
+    if not paths:
+        raise HTTPException(404, "Profile not found")
+    return FileResponse(paths[1], media_type="text/plain", filename=f"{profile_id}.folded")
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, HTTPException, Query
+from app.utilities.post_stats import get_all_stats, get_client_stats, rebuild_stats
+
+router = APIRouter()
+
+
+# ------------------ ENDPOINTS ------------------
+
+@router.get("")
+def all_client_stats():
+    return {"clients": get_all_stats()}
+
+
+@router.get("/{client_id}")
+def client_stats(client_id: str, top_n: int = Query(10, ge=1, le=100)):
+    stats = get_client_stats(client_id, top_n=top_n)
+    if not stats:
+        raise HTTPException(404, "No posts found for this client")
+    return stats
+
+
+@router.post("/rebuild")
+def rebuild():
+    scanned = rebuild_stats()
+    return {"status": "Stats rebuilt successfully", "posts_scanned": scanned}
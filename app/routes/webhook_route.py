@@ -0,0 +1,22 @@
+from fastapi import APIRouter, HTTPException, Request
+from app.utilities.replicate_predictions import verify_signature, resolve_prediction
+
+router = APIRouter()
+
+
+# ------------------ ENDPOINTS ------------------
+
+@router.post("/replicate")
+async def replicate_webhook(request: Request):
+    """Called by Replicate when a prediction created with a webhook finishes."""
+    body = await request.body()
+    if not verify_signature(request.headers, body):
+        raise HTTPException(401, "Invalid webhook signature")
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(400, "Invalid JSON body")
+
+    resolved = resolve_prediction(payload)
+    return {"status": "ok", "resolved": resolved}
@@ -0,0 +1,383 @@
+import asyncio
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+import anyio
+from app.utilities import prompting_ai
+from app.utilities.format_prompt import build_prompt
+from app.utilities.model_router import CAPTION_MODELS, MODEL_CATALOGUE
+from app.utilities.reference_snapshot import get_topic_map, get_client_name
+from app.utilities.caption_dedup import split_near_duplicates
+from app.utilities.hashtag_engine import hashtag_plan, fill_hashtags
+from app.utilities.generation_runs import create_run, save_run, load_run
+from app.utilities.generate_posts import caption_posts
+from app.utilities.single_flight import SingleFlight
+from app.utilities.csv_io import atomic_write_text
+
+# -------------------- Settings --------------------
+# Bulk caption jobs: many prompts are written to one JSONL file and sent
+# through a provider's batch interface, which runs them off the interactive
+# path (OpenAI's Batch API has its own rate limits and half the price).
+# When the batch completes, every item's captions are checkpointed as a
+# generation run (generation_runs) with its images still pending; POST
+# /posts/runs/{run_id}/resume then generates the images.
+#
+# CAPTION_BATCH_PROVIDER:
+#   "openai" - the OpenAI Batch API (default)
+#   "local"  - runs the file through the chat API in-process at low
+#              concurrency; a stand-in for testing and development
+
+BATCHES_PATH = Path("app/Data/batches")
+DEFAULT_PROVIDER = os.getenv("CAPTION_BATCH_PROVIDER", "openai").lower()
+BATCH_MODEL = os.getenv("CAPTION_BATCH_MODEL", "").strip() or CAPTION_MODELS[0]
+POLL_SEC = float(os.getenv("CAPTION_BATCH_POLL_SEC", "60"))
+LOCAL_CONCURRENCY = int(os.getenv("CAPTION_BATCH_LOCAL_CONCURRENCY", "2"))
+MAX_ITEMS = 50_000  # OpenAI's per-batch request limit
+
+TERMINAL = {"completed", "failed"}
+
+if BATCH_MODEL not in MODEL_CATALOGUE:
+    raise ValueError(f"CAPTION_BATCH_MODEL={BATCH_MODEL!r} is invalid; choose one of: {', '.join(MODEL_CATALOGUE)}")
+
+_trackers: set[asyncio.Task] = set()
+batch_flight = SingleFlight("caption_batches")
+
+
+def new_batch_id() -> str:
+    return f"BATCH-{datetime.now().strftime('%Y%m%d')}-{uuid.uuid4().hex[:8].upper()}"
+
+
+def _batch_path(batch_id: str, suffix: str = ".json") -> Optional[Path]:
+    if not batch_id.replace("-", "").isalnum():
+        return None
+    return BATCHES_PATH / f"{batch_id}{suffix}"
+
+
+def save_batch(job: dict):
+    BATCHES_PATH.mkdir(parents=True, exist_ok=True)
+    job["updated_at"] = datetime.now().isoformat()
+    path = _batch_path(job["batch_id"])
+    atomic_write_text(path, json.dumps(job, indent=2, default=str))
+
+
+def load_batch(batch_id: str) -> Optional[dict]:
+    path = _batch_path(batch_id)
+    if path is None or not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+def list_batches() -> list[dict]:
+    if not BATCHES_PATH.exists():
+        return []
+    jobs = [json.loads(p.read_text()) for p in BATCHES_PATH.glob("BATCH-*.json")]
+    return [
+        {k: job[k] for k in ("batch_id", "provider", "status", "created_at", "completed_at", "counts")}
+        for job in sorted(jobs, key=lambda j: j["created_at"], reverse=True)
+    ]
+
+
+# -------------------- Providers --------------------
+
+class OpenAIBatchProvider:
+    name = "openai"
+
+    async def submit(self, input_path: Path, batch_id: str) -> str:
+        client = prompting_ai.openai_client()
+        uploaded = await client.files.create(file=input_path, purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"batch_id": batch_id},
+        )
+        return batch.id
+
+    async def poll(self, provider_batch_id: str) -> tuple[str, Optional[str]]:
+        """Returns (provider status, JSONL results once the batch has ended)."""
+        client = prompting_ai.openai_client()
+        batch = await client.batches.retrieve(provider_batch_id)
+        if batch.status not in ("completed", "failed", "expired", "cancelled"):
+            return batch.status, None
+
+        # Requests that errored are written to a separate error file
+        results = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = await client.files.content(file_id)
+                results.append(content.text)
+        return batch.status, "\n".join(results)
+
+
+class LocalBatchProvider:
+    name = "local"
+
+    def __init__(self):
+        self.tasks: dict[str, asyncio.Task] = {}
+
+    async def submit(self, input_path: Path, batch_id: str) -> str:
+        provider_batch_id = f"local-{batch_id}"
+        self.tasks[provider_batch_id] = asyncio.create_task(self._run(input_path, provider_batch_id))
+        return provider_batch_id
+
+    async def _run(self, input_path: Path, provider_batch_id: str):
+        lines = [json.loads(l) for l in input_path.read_text().splitlines() if l.strip()]
+        self._output(provider_batch_id).parent.mkdir(parents=True, exist_ok=True)
+        client = prompting_ai.openai_client()
+        semaphore = asyncio.Semaphore(LOCAL_CONCURRENCY)
+
+        async def run_one(line: dict) -> dict:
+            result = {"id": uuid.uuid4().hex, "custom_id": line["custom_id"], "response": None, "error": None}
+            try:
+                async with semaphore:
+                    response = await client.chat.completions.create(**line["body"])
+            except Exception as e:
+                result["error"] = {"message": str(e)}
+                return result
+            usage = response.usage
+            result["response"] = {"status_code": 200, "body": {
+                "model": line["body"]["model"],
+                "choices": [{"message": {"content": response.choices[0].message.content}}],
+                "usage": {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens} if usage else {},
+            }}
+            return result
+
+        results = await asyncio.gather(*[run_one(line) for line in lines])
+        output = "\n".join(json.dumps(r) for r in results) + "\n"
+        await anyio.to_thread.run_sync(self._output(provider_batch_id).write_text, output)
+
+    def _output(self, provider_batch_id: str) -> Path:
+        return BATCHES_PATH / "local" / f"{provider_batch_id}.jsonl"
+
+    async def poll(self, provider_batch_id: str) -> tuple[str, Optional[str]]:
+        output = self._output(provider_batch_id)
+        if output.exists():
+            return "completed", output.read_text()
+        task = self.tasks.get(provider_batch_id)
+        if task is None:
+            return "expired", ""  # the process running it has gone
+        if task.done() and task.exception():
+            return "failed", ""
+        return "in_progress", None
+
+
+PROVIDERS = {"openai": OpenAIBatchProvider(), "local": LocalBatchProvider()}
+
+
+# -------------------- Submission --------------------
+
+def _prepare_items(items: list[dict]) -> list[dict]:
+    """Validates the requests and builds each prompt; raises ValueError."""
+    if not items:
+        raise ValueError("A batch needs at least one request")
+    if len(items) > MAX_ITEMS:
+        raise ValueError(f"A batch can hold at most {MAX_ITEMS} requests")
+
+    max_posts = MODEL_CATALOGUE[BATCH_MODEL]["max_posts"]
+    topic_map = get_topic_map()
+    prepared = []
+    for i, request in enumerate(items):
+        if not get_client_name(request["client_id"]):
+            raise ValueError(f"Request {i}: client ID {request['client_id']} not found")
+        missing = [t for t in request["topic_ids"] if t not in topic_map]
+        if missing:
+            raise ValueError(f"Request {i}: topic ID {missing[0]} not found")
+        if not 1 <= request["number_of_posts"] <= max_posts:
+            raise ValueError(f"Request {i}: number_of_posts must be between 1 and {max_posts}")
+
+        hashtag_mode, hashtags = hashtag_plan(request["client_id"], request["topic_ids"])
+        prompt, _ = build_prompt(
+            client_id=request["client_id"],
+            visual_style=request["visual_style"],
+            topic_titles=[topic_map[t] for t in request["topic_ids"]],
+            number_of_posts=request["number_of_posts"],
+            hashtag_mode=hashtag_mode,
+            hashtags=hashtags,
+        )
+        prepared.append({
+            "custom_id": f"item-{i}",
+            "request": request,
+            "prompt": prompt,
+            "hashtag_mode": hashtag_mode,
+            "run_id": None,
+            "status": "pending",
+            "error": None,
+        })
+    return prepared
+
+
+async def submit_batch(items: list[dict], provider: Optional[str] = None) -> dict:
+    """
+    Builds the prompt for every request (same shape as generate_posts'
+    request dict), writes them to app/Data/batches/<batch_id>.input.jsonl
+    and submits the file. Returns the job record; tracking continues in the
+    background.
+    """
+    provider = (provider or DEFAULT_PROVIDER).lower()
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown batch provider {provider}")
+
+    prepared = await anyio.to_thread.run_sync(_prepare_items, items)
+    batch_id = new_batch_id()
+    lines = [
+        prompting_ai.batch_request(item["custom_id"], item.pop("prompt"), item["request"]["number_of_posts"], BATCH_MODEL)
+        for item in prepared
+    ]
+
+    input_path = _batch_path(batch_id, ".input.jsonl")
+    BATCHES_PATH.mkdir(parents=True, exist_ok=True)
+    await anyio.to_thread.run_sync(input_path.write_text, "\n".join(json.dumps(l) for l in lines) + "\n")
+
+    now = datetime.now().isoformat()
+    job = {
+        "batch_id": batch_id,
+        "provider": provider,
+        "provider_batch_id": None,
+        "provider_status": None,
+        "model": BATCH_MODEL,
+        "status": "submitting",
+        "created_at": now,
+        "updated_at": now,
+        "completed_at": None,
+        "counts": {"total": len(prepared), "captioned": 0, "failed": 0},
+        "usage": {},
+        "error": None,
+        "items": prepared,
+    }
+    await anyio.to_thread.run_sync(save_batch, job)
+
+    try:
+        job["provider_batch_id"] = await PROVIDERS[provider].submit(input_path, batch_id)
+    except Exception as e:
+        job.update(status="failed", error=f"Submission failed: {e}")
+        await anyio.to_thread.run_sync(save_batch, job)
+        raise RuntimeError(job["error"])
+
+    job["status"] = "in_progress"
+    await anyio.to_thread.run_sync(save_batch, job)
+    print(f"Caption batch {batch_id} submitted to {provider} ({len(prepared)} requests)")
+
+    task = asyncio.create_task(_track(batch_id))
+    _trackers.add(task)
+    task.add_done_callback(_trackers.discard)
+    return job
+
+
+# -------------------- Tracking --------------------
+
+async def _track(batch_id: str):
+    while True:
+        await asyncio.sleep(POLL_SEC)
+        try:
+            job = await refresh_batch(batch_id)
+        except Exception as e:
+            print(f"Caption batch {batch_id} poll failed: {e}")
+            continue
+        if job is None or job["status"] in TERMINAL:
+            return
+
+
+async def refresh_batch(batch_id: str) -> Optional[dict]:
+    """
+    Polls the provider for an unfinished job and, once it has ended, fans
+    the results out into generation runs. Concurrent refreshes of the same
+    job share one poll.
+    """
+    async def refresh():
+        job = await anyio.to_thread.run_sync(load_batch, batch_id)
+        if job is None or job["status"] in TERMINAL or not job["provider_batch_id"]:
+            return job
+
+        status, results = await PROVIDERS[job["provider"]].poll(job["provider_batch_id"])
+        job["provider_status"] = status
+        if results is not None:
+            await anyio.to_thread.run_sync(_fan_out, job, results)
+        await anyio.to_thread.run_sync(save_batch, job)
+        return job
+
+    return await batch_flight.ado(batch_id, refresh)
+
+
+def _item_run_id(batch_id: str, custom_id: str) -> str:
+    # Derived from the item, so fanning out again after a crash finds the
+    # runs that were already created instead of duplicating them
+    digest = hashlib.sha256(f"{batch_id}:{custom_id}".encode()).hexdigest()[:8].upper()
+    return f"RUN-{batch_id.split('-')[1]}-{digest}"
+
+
+def _fan_out(job: dict, results: str):
+    """Checkpoints each item's parsed captions as a run awaiting images."""
+    _batch_path(job["batch_id"], ".output.jsonl").write_text(results)
+    lines = {}
+    for n, raw in enumerate(results.splitlines(), start=1):
+        if not raw.strip():
+            continue
+        try:
+            line = json.loads(raw)
+            lines[line["custom_id"]] = line
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Caption batch {job['batch_id']}: skipping malformed result line {n}: {e!r}")
+
+    usage = job["usage"]
+    # Captions accepted earlier in this batch, per client, so two items for
+    # the same client cannot come back with near-copies of each other
+    accepted: dict[str, list[dict]] = {}
+    for item in job["items"]:
+        request = item["request"]
+        run_id = _item_run_id(job["batch_id"], item["custom_id"])
+        existing = load_run(run_id)
+        if existing is not None and existing["captions"] is not None:
+            accepted.setdefault(request["client_id"], []).extend(existing["captions"])
+            if item["status"] == "pending":
+                item.update(status="captioned", run_id=run_id, dropped_duplicates=0)
+            continue
+        if item["status"] != "pending":
+            continue
+
+        line = lines.get(item["custom_id"])
+        try:
+            if line is None:
+                raise ValueError(f"No result (batch ended as {job['provider_status']})")
+            outputs, line_usage = prompting_ai.parse_batch_result(line, item["hashtag_mode"])
+            for key in ("prompt_tokens", "completion_tokens"):
+                usage[key] = usage.get(key, 0) + (line_usage.get(key) or 0)
+
+            outputs, dropped = split_near_duplicates(
+                request["client_id"], outputs, accepted=accepted.get(request["client_id"], [])
+            )
+            if not outputs:
+                raise ValueError("All generated captions duplicate existing posts or other items in this batch")
+            if item["hashtag_mode"] == "engine":
+                for output in outputs:
+                    output["hashtags"] = fill_hashtags(request["client_id"], request["topic_ids"], output.get("caption") or "")
+        except ValueError as e:
+            item.update(status="failed", error=str(e))
+            continue
+        except (KeyError, IndexError, TypeError, AttributeError) as e:
+            item.update(status="failed", error=f"Malformed batch result ({type(e).__name__}: {e})")
+            continue
+
+        accepted.setdefault(request["client_id"], []).extend(outputs)
+        run = create_run(run_id, request)
+        run.update(
+            status="captioned",
+            pid=None,
+            captions=outputs,
+            posts=caption_posts(outputs),
+            usage={"batch_id": job["batch_id"], "model": job["model"], **line_usage},
+        )
+        save_run(run)
+        item.update(status="captioned", run_id=run_id, dropped_duplicates=len(dropped))
+
+    job["counts"] = {
+        "total": len(job["items"]),
+        "captioned": sum(1 for i in job["items"] if i["status"] == "captioned"),
+        "failed": sum(1 for i in job["items"] if i["status"] == "failed"),
+    }
+    job["status"] = "completed" if job["counts"]["captioned"] else "failed"
+    job["completed_at"] = datetime.now().isoformat()
+    print(f"Caption batch {job['batch_id']} finished: {job['counts']}")
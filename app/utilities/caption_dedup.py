@@ -0,0 +1,142 @@
+import re
+import zlib
+import numpy as np
+from app.utilities.client_indexes import ClientIndexes
+
+# -------------------- MinHash Settings --------------------
+# 64 permutations split into 16 bands of 4 rows: captions with Jaccard
+# similarity around 0.5 and above collide in at least one band, and the
+# candidates are then confirmed against DUPLICATE_THRESHOLD.
+
+NUM_PERM = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+DUPLICATE_THRESHOLD = 0.7
+
+_PRIME = np.uint64(4294967311)  # first prime above 2**32
+_rng = np.random.default_rng(20251019)
+_A = _rng.integers(1, 2**31, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 2**32, size=NUM_PERM, dtype=np.uint64)
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _shingles(text: str) -> np.ndarray:
+    words = _WORD_RE.findall((text or "").lower())
+    if len(words) < SHINGLE_SIZE:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+    return np.fromiter((zlib.crc32(g.encode()) for g in set(grams)), dtype=np.uint64)
+
+
+def minhash(text: str) -> np.ndarray | None:
+    """Signature of a caption; None when it has no words (never a duplicate)."""
+    if not _WORD_RE.search(text or ""):
+        return None
+    x = _shingles(text)
+    return ((_A[:, None] * x[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def similarity(sig_a: np.ndarray | None, sig_b: np.ndarray | None) -> float:
+    if sig_a is None or sig_b is None:
+        return 0.0
+    return float(np.count_nonzero(sig_a == sig_b)) / NUM_PERM
+
+
+def _band_keys(sig: np.ndarray) -> list[bytes]:
+    return [sig[b * ROWS_PER_BAND:(b + 1) * ROWS_PER_BAND].tobytes() for b in range(BANDS)]
+
+
+# -------------------- Per-Client Index --------------------
+
+class ClientCaptionIndex:
+    def __init__(self):
+        self.signatures: dict[str, np.ndarray] = {}
+        self.buckets: list[dict[bytes, set[str]]] = [{} for _ in range(BANDS)]
+
+    def add(self, post_id: str, caption: str):
+        self.remove(post_id)
+        sig = minhash(caption)
+        if sig is None:
+            return
+        self.signatures[post_id] = sig
+        for band, key in enumerate(_band_keys(sig)):
+            self.buckets[band].setdefault(key, set()).add(post_id)
+
+    def remove(self, post_id: str):
+        sig = self.signatures.pop(post_id, None)
+        if sig is None:
+            return
+        for band, key in enumerate(_band_keys(sig)):
+            bucket = self.buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(post_id)
+                if not bucket:
+                    del self.buckets[band][key]
+
+    def add_row(self, row: dict):
+        self.add(row["post_id"], row.get("caption") or "")
+
+    def remove_row(self, row: dict):
+        self.remove(row["post_id"])
+
+    def best_match(self, sig: np.ndarray | None) -> tuple[str | None, float]:
+        if sig is None:
+            return None, 0.0
+        candidates = set()
+        for band, key in enumerate(_band_keys(sig)):
+            candidates.update(self.buckets[band].get(key, ()))
+
+        best_id, best_score = None, 0.0
+        for post_id in candidates:
+            score = similarity(sig, self.signatures[post_id])
+            if score > best_score:
+                best_id, best_score = post_id, score
+        return best_id, best_score
+
+
+# Built from each client's post history on first use in this process, then
+# kept current by index_caption() and index_changes() (see client_indexes)
+_indexes = ClientIndexes(ClientCaptionIndex)
+
+
+def index_caption(client_id: str, post_id: str, caption: str):
+    _indexes.apply(added=[{"client_id": client_id, "post_id": post_id, "caption": caption}])
+
+
+def index_changes(added: list[dict] = (), removed: list[dict] = ()):
+    """Keeps indexes current after posts are removed or their captions edited."""
+    _indexes.apply(added=added, removed=removed)
+
+
+# -------------------- Dedup Stage --------------------
+
+def split_near_duplicates(client_id: str, outputs: list[dict], accepted: list[dict] = None) -> tuple[list[dict], list[dict]]:
+    """
+    Splits AI outputs into (kept, dropped). A caption is dropped when it is a
+    near-copy of one of the client's past captions, of an output already in
+    `accepted`, or of an earlier output in the same list.
+    """
+    batch_sigs = [minhash(o.get("caption", "")) for o in (accepted or [])]
+    kept, dropped = [], []
+
+    with _indexes.use(client_id) as index:
+        matches = [index.best_match(minhash(o.get("caption", ""))) for o in outputs]
+
+    for output, (match_id, score) in zip(outputs, matches):
+        sig = minhash(output.get("caption", ""))
+
+        if score < DUPLICATE_THRESHOLD:
+            score = max((similarity(sig, s) for s in batch_sigs), default=0.0)
+            match_id = "current batch"
+
+        if score >= DUPLICATE_THRESHOLD:
+            print(f"Near-duplicate caption dropped (similarity {score:.2f} to {match_id})")
+            dropped.append(output)
+        else:
+            kept.append(output)
+            batch_sigs.append(sig)
+
+    return kept, dropped
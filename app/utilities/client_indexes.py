@@ -0,0 +1,78 @@
+import threading
+from contextlib import contextmanager
+from typing import Callable
+from app.utilities.post_store import iter_post_rows
+from app.utilities.post_writer import flush_posts
+
+# -------------------- Per-Client Post Indexes --------------------
+# caption_dedup and hashtag_engine keep an in-memory index per client. It is
+# built from the client's post history on first use and then kept current as
+# posts are saved, edited and removed. Index objects implement add_row(row)
+# and remove_row(row), both keyed by post_id, so a change applied twice
+# leaves the index as it was after the first.
+#
+# Lock order: a build holds the client's build lock while it flushes and
+# scans the shards, which takes POSTS_LOCK. The client's state lock is only
+# held briefly and never around post-store calls, so route handlers that
+# already hold POSTS_LOCK can apply changes at any time. Changes that arrive
+# while a build is scanning are queued and replayed onto the new index
+# before it is published.
+
+
+class ClientIndexes:
+    def __init__(self, factory: Callable[[], object]):
+        self.factory = factory
+        self.indexes: dict[str, object] = {}
+        self._queued: dict[str, list[tuple[str, dict]]] = {}
+        self._build_locks: dict[str, threading.Lock] = {}
+        self._state_locks: dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def _locks(self, client_id: str) -> tuple[threading.Lock, threading.Lock]:
+        with self._guard:
+            return (
+                self._build_locks.setdefault(client_id, threading.Lock()),
+                self._state_locks.setdefault(client_id, threading.Lock()),
+            )
+
+    @contextmanager
+    def use(self, client_id: str):
+        """Yields the client's index, building it first if needed, with its state lock held."""
+        build_lock, state_lock = self._locks(client_id)
+        if client_id not in self.indexes:
+            with build_lock:
+                if client_id not in self.indexes:
+                    self._build(client_id, state_lock)
+        with state_lock:
+            yield self.indexes[client_id]
+
+    def _build(self, client_id: str, state_lock: threading.Lock):
+        with state_lock:
+            self._queued[client_id] = []
+        try:
+            flush_posts()
+            index = self.factory()
+            for row in iter_post_rows(client_id=client_id):
+                index.add_row(row)
+        except BaseException:
+            with state_lock:
+                self._queued.pop(client_id, None)
+            raise
+
+        with state_lock:
+            for op, row in self._queued.pop(client_id):
+                getattr(index, op)(row)
+            self.indexes[client_id] = index
+
+    def apply(self, added: list[dict] = (), removed: list[dict] = ()):
+        """Applies post changes to the indexes of the clients they belong to."""
+        for op, rows in (("remove_row", removed), ("add_row", added)):
+            for row in rows:
+                client_id = row.get("client_id") or ""
+                _, state_lock = self._locks(client_id)
+                with state_lock:
+                    index = self.indexes.get(client_id)
+                    if index is not None:
+                        getattr(index, op)(row)
+                    elif client_id in self._queued:
+                        self._queued[client_id].append((op, row))
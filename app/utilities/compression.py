@@ -0,0 +1,23 @@
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# -------------------- Response Compression --------------------
+# JSON listings compress well; images do not, and gzipping a 206 partial
+# response leaves its Content-Range describing bytes the client never
+# receives. Requests under `exclude_paths` (the image proxy) and any
+# request carrying a Range header bypass compression entirely.
+
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    def __init__(self, app: ASGIApp, exclude_paths: tuple[str, ...] = (), **options) -> None:
+        super().__init__(app, **options)
+        self.exclude_paths = tuple(exclude_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and (
+            scope["path"].startswith(self.exclude_paths) or "range" in Headers(scope=scope)
+        ):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
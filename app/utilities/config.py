@@ -0,0 +1,154 @@
+import asyncio
+import atexit
+import os
+import threading
+import weakref
+from pathlib import Path
+from typing import Callable, Iterable
+from dotenv import dotenv_values
+import watchfiles
+from app.utilities.etags import bump_version
+from app.utilities.csv_io import atomic_write_text
+
+# -------------------- Settings Snapshot --------------------
+# Provider keys and other settings are read from an in-memory snapshot of
+# .env layered over the process environment (.env wins, so a rotated key
+# in the file takes effect). The snapshot is replaced whenever .env
+# changes: through update() here, or by any external edit picked up by the
+# file watcher. Subscribers are told which keys changed, so provider
+# clients can be rebuilt in place without a restart.
+
+ENV_PATH = Path(".env")
+
+_snapshot: dict[str, str] = {}
+_subscribers: list[tuple[frozenset[str] | None, Callable[[dict], None]]] = []
+_lock = threading.RLock()
+_watcher: threading.Thread | None = None
+_stop = threading.Event()
+
+
+def _read_settings() -> dict[str, str]:
+    settings = dict(os.environ)
+    if ENV_PATH.exists():
+        settings.update({k: v for k, v in dotenv_values(ENV_PATH).items() if v is not None})
+    return settings
+
+
+def reload() -> set[str]:
+    """Re-reads .env and notifies subscribers; returns the changed keys."""
+    global _snapshot
+    with _lock:
+        new = _read_settings()
+        changed = {k for k in new.keys() | _snapshot.keys() if new.get(k) != _snapshot.get(k)}
+        _snapshot = new
+        if not changed:
+            return changed
+        subscribers = list(_subscribers)
+
+    bump_version("env")
+    for keys, callback in subscribers:
+        if keys is None or keys & changed:
+            try:
+                callback(new)
+            except Exception as e:
+                print(f"Config subscriber {callback.__name__} failed: {e}")
+    print(f"Config reloaded, {len(changed)} setting(s) changed")
+    return changed
+
+
+def get(key: str, default: str | None = None) -> str | None:
+    return _snapshot.get(key, default)
+
+
+def subscribe(callback: Callable[[dict], None], keys: Iterable[str] | None = None):
+    """Calls `callback(settings)` whenever one of `keys` (or any key) changes."""
+    with _lock:
+        _subscribers.append((frozenset(keys) if keys else None, callback))
+
+
+# -------------------- Provider Clients --------------------
+# Async SDK clients keep connection pools bound to the event loop they were
+# first used on. Under Mangum each invocation may run on a fresh loop, so a
+# client is built per running loop and goes away with it; all of them are
+# rebuilt when one of their settings rotates.
+
+class LoopClients:
+    def __init__(self, name: str, factory: Callable[[], object], keys: Iterable[str] = ()):
+        self.name = name
+        self.factory = factory
+        self._clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        if keys:
+            subscribe(self._rotate, keys=keys)
+
+    def get(self):
+        """The client for the running event loop, built on first use there."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._clients.get(loop)
+        if client is None:
+            client = self.factory()
+            with self._lock:
+                client = self._clients.setdefault(loop, client)
+        return client
+
+    def _rotate(self, settings: dict):
+        # Calls already in flight finish on the old clients; new calls use new ones
+        with self._lock:
+            self._clients.clear()
+        print(f"{self.name} clients rebuilt for rotated settings")
+
+
+# -------------------- Writing --------------------
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def update(values: dict[str, str]) -> set[str]:
+    """
+    Sets several keys in .env with one atomic replace, keeping every other
+    line as it was, then reloads the snapshot.
+    """
+    with _lock:
+        lines = ENV_PATH.read_text().splitlines() if ENV_PATH.exists() else []
+        remaining = dict(values)
+        out = []
+        for line in lines:
+            name = line.split("=", 1)[0].strip().removeprefix("export ").strip()
+            if "=" in line and name in remaining:
+                out.append(f"{name}={_quote(remaining.pop(name))}")
+            else:
+                out.append(line)
+        out.extend(f"{name}={_quote(value)}" for name, value in remaining.items())
+
+        atomic_write_text(ENV_PATH, "\n".join(out) + "\n")
+        return reload()
+
+
+# -------------------- File Watcher --------------------
+
+def _watch():
+    # The directory is watched, not the file: atomic replaces swap the inode
+    directory = ENV_PATH.resolve().parent
+    only_env = lambda change, path: Path(path).name == ENV_PATH.name
+    for _ in watchfiles.watch(directory, watch_filter=only_env, recursive=False, debounce=200, stop_event=_stop):
+        reload()
+
+
+def start_watcher():
+    global _watcher
+    with _lock:
+        if _watcher is None:
+            _watcher = threading.Thread(target=_watch, name="config-watcher", daemon=True)
+            _watcher.start()
+            atexit.register(stop_watcher)
+
+
+def stop_watcher():
+    _stop.set()
+    if _watcher is not None:
+        _watcher.join(timeout=2)
+
+
+_snapshot = _read_settings()
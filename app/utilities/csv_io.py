@@ -0,0 +1,162 @@
+import csv
+import os
+import stat
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# -------------------- Atomic Writes --------------------
+# Every rewrite of a data file goes through atomic_open: the new content is
+# written to a uniquely named temp file in the same directory, which then
+# replaces the original. Writers of one path are serialized within the
+# process, and each writer has its own temp file, so concurrent threads or
+# processes never share one.
+
+_path_locks: dict[str, threading.Lock] = {}
+_path_locks_guard = threading.Lock()
+
+
+def path_lock(path: Path) -> threading.Lock:
+    key = os.path.abspath(path)
+    with _path_locks_guard:
+        return _path_locks.setdefault(key, threading.Lock())
+
+
+@contextmanager
+def atomic_open(path: Path, mode: str = "w", **kwargs):
+    """
+    Yields a file object for the new content of `path`. The original is
+    replaced only when the block exits cleanly; on error it is untouched.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path_lock(path):
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            # mkstemp creates 0600 files; keep the original's mode
+            os.chmod(tmp, stat.S_IMODE(os.stat(path).st_mode) if path.exists() else 0o644)
+            with os.fdopen(fd, mode, **kwargs) as f:
+                yield f
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+
+def atomic_write_text(path: Path, text: str):
+    with atomic_open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def atomic_write_bytes(path: Path, data: bytes):
+    with atomic_open(path, "wb") as f:
+        f.write(data)
+
+
+# -------------------- Cross-Process Locks --------------------
+# Advisory locks on open files, held until unlocked or the file is closed,
+# and dropped by the OS when the process dies. flock on POSIX; on Windows
+# msvcrt locks the first byte, which has no shared mode, so shared
+# requests are exclusive there.
+
+def lock_file(f, exclusive: bool = True, blocking: bool = True) -> bool:
+    """Locks `f`; with blocking=False returns False if another holder has it."""
+    if fcntl is not None:
+        flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        try:
+            fcntl.flock(f, flags if blocking else flags | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(0.05)
+
+
+def unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path: Path, exclusive: bool = True):
+    """Holds a cross-process lock on the lock file at `path` for the block."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        lock_file(f, exclusive)
+        try:
+            yield
+        finally:
+            unlock_file(f)
+
+
+def try_lock_path(path: Path):
+    """
+    Opens and locks the lock file at `path` without waiting. Returns the
+    open file, which holds the lock until release_lock_path(), or None if
+    another holder has it. A file unlinked by its previous holder while we
+    waited on it is detected and the new one locked instead.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    while True:
+        f = open(path, "a")
+        if not lock_file(f, blocking=False):
+            f.close()
+            return None
+        try:
+            if os.path.samestat(os.fstat(f.fileno()), os.stat(path)):
+                return f
+        except FileNotFoundError:
+            pass
+        f.close()
+
+
+def release_lock_path(f, path: Path):
+    """Removes the lock file, then releases it; see try_lock_path()."""
+    try:
+        Path(path).unlink(missing_ok=True)
+    finally:
+        f.close()
+
+
+# -------------------- CSV --------------------
+
+def atomic_write_csv(path: Path, fieldnames: list[str], rows: list[dict]):
+    """
+    Rewrites a registry CSV in one pass: rows go to a temp file in the same
+    directory which then replaces the original, so readers never observe a
+    half-written file and a crash leaves the previous version intact.
+    """
+    with atomic_open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def read_csv_rows(path: Path) -> tuple[list[str], list[dict]]:
+    if not path.exists():
+        return [], []
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+        return list(reader.fieldnames or []), rows
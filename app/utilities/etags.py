@@ -0,0 +1,60 @@
+import uuid
+from pathlib import Path
+from typing import Optional
+from fastapi import Response
+from app.utilities.csv_io import atomic_write_text
+
+# -------------------- Dataset Versions --------------------
+# Every dataset served by a polled listing endpoint has a version token in
+# app/Data/versions/<dataset>. Route handlers replace it after each write,
+# so a conditional GET is answered by reading one tiny file instead of the
+# CSV/JSON data. The token lives on disk, not in memory, so a write handled
+# by another worker or container sharing the volume invalidates every
+# process's ETag.
+
+DATASETS = ("posts", "categories", "topics", "clients", "env")
+VERSIONS_PATH = Path("app/Data/versions")
+
+
+def bump_version(*datasets: str):
+    for name in datasets:
+        # A fresh random token, so concurrent bumps never produce the same value
+        atomic_write_text(VERSIONS_PATH / name, uuid.uuid4().hex[:16])
+
+
+def _version(dataset: str) -> str:
+    try:
+        return (VERSIONS_PATH / dataset).read_text().strip() or "0"
+    except FileNotFoundError:
+        return "0"
+
+
+def get_etag(dataset: str) -> str:
+    return f'W/"{dataset}-{_version(dataset)}"'
+
+
+def etag_matches(dataset: str, if_none_match: Optional[str]) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etag = get_etag(dataset)
+    return any(tag.strip() == etag for tag in if_none_match.split(","))
+
+
+def not_modified(dataset: str, if_none_match: Optional[str]) -> Optional[Response]:
+    """
+    Returns a 304 response when the client's cached copy is still current,
+    otherwise None so the handler builds the full body.
+    """
+    if etag_matches(dataset, if_none_match):
+        return Response(status_code=304, headers=cache_headers(dataset))
+    return None
+
+
+def cache_headers(dataset: str) -> dict:
+    return {"ETag": get_etag(dataset), "Cache-Control": "no-cache"}
+
+
+def set_cache_headers(response: Response, dataset: str):
+    response.headers.update(cache_headers(dataset))
@@ -0,0 +1,98 @@
+import csv
+import io
+import json
+from pathlib import Path
+from typing import Iterator
+from app.utilities.post_store import POST_FIELDNAMES, is_finalized
+
+# Rows are read, filtered and written one at a time (columnar formats in
+# fixed-size record batches), so memory stays flat no matter how many posts
+# the store holds.
+
+COLUMNAR_BATCH_SIZE = 10_000
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+# -------------------- Row Formats --------------------
+
+def stream_ndjson(rows: Iterator[dict]) -> Iterator[str]:
+    for row in rows:
+        record = dict(row)
+        record["topics"] = row["topics"].split(",") if row["topics"] else []
+        record["hashtags"] = row["hashtags"].split(",") if row["hashtags"] else []
+        record["finalized"] = is_finalized(row)
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def stream_csv(rows: Iterator[dict]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=POST_FIELDNAMES)
+
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+# -------------------- Columnar Formats --------------------
+
+def _arrow_schema(pa):
+    return pa.schema([
+        (field, pa.bool_() if field == "finalized" else pa.string())
+        for field in POST_FIELDNAMES
+    ])
+
+
+def _record_batches(pa, schema, rows: Iterator[dict]):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= COLUMNAR_BATCH_SIZE:
+            yield _to_record_batch(pa, schema, batch)
+            batch = []
+    if batch:
+        yield _to_record_batch(pa, schema, batch)
+
+
+def _to_record_batch(pa, schema, batch: list[dict]):
+    columns = [
+        [is_finalized(r) for r in batch] if field == "finalized" else [r[field] for r in batch]
+        for field in POST_FIELDNAMES
+    ]
+    return pa.RecordBatch.from_arrays(
+        [pa.array(col, type=schema.field(i).type) for i, col in enumerate(columns)],
+        schema=schema,
+    )
+
+
+def write_columnar(rows: Iterator[dict], fmt: str, path: Path):
+    """
+    Writes rows to `path` as Parquet or an Arrow IPC stream, one record
+    batch at a time. pyarrow is imported lazily so the listing endpoints and
+    serverless cold starts do not pay for it.
+    """
+    import pyarrow as pa
+
+    schema = _arrow_schema(pa)
+
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        with pq.ParquetWriter(str(path), schema, compression="zstd") as writer:
+            for batch in _record_batches(pa, schema, rows):
+                writer.write_batch(batch)
+    elif fmt == "arrow":
+        with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_stream(sink, schema) as writer:
+            for batch in _record_batches(pa, schema, rows):
+                writer.write_batch(batch)
+    else:
+        raise ValueError(f"Unsupported columnar format: {fmt}")
@@ -0,0 +1,152 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import io
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+import httpx
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File
+from fastapi.responses import Response
+from PIL import Image
+
+# -------------------- Fake Replicate API --------------------
+# A stand-in for the parts of api.replicate.com that generate_posts uses:
+# model predictions (with webhooks), prediction polling and file uploads.
+# Run it with
+#   uvicorn app.utilities.fake_replicate:app --port 8787
+# and start the backend with REPLICATE_BASE_URL=http://127.0.0.1:8787.
+#
+# FAKE_REPLICATE_DELAY_SEC     - how long a prediction "runs" (default 2)
+# FAKE_REPLICATE_FAIL_RATE     - fraction of predictions that fail
+# FAKE_REPLICATE_DROP_WEBHOOKS - 1 to never send webhooks (tests polling)
+# REPLICATE_WEBHOOK_SECRET     - signs webhooks like Replicate does
+
+DELAY_SEC = float(os.getenv("FAKE_REPLICATE_DELAY_SEC", "2"))
+FAIL_RATE = float(os.getenv("FAKE_REPLICATE_FAIL_RATE", "0"))
+DROP_WEBHOOKS = os.getenv("FAKE_REPLICATE_DROP_WEBHOOKS", "0") == "1"
+WEBHOOK_SECRET = os.getenv("REPLICATE_WEBHOOK_SECRET", "")
+
+app = FastAPI(title="Fake Replicate")
+
+_predictions: dict[str, dict] = {}
+_files: dict[str, bytes] = {}
+_tasks: set[asyncio.Task] = set()
+_http: httpx.AsyncClient | None = None
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _signed_headers(body: bytes) -> dict:
+    headers = {"content-type": "application/json"}
+    if WEBHOOK_SECRET:
+        webhook_id = f"msg_{uuid.uuid4().hex}"
+        timestamp = str(int(time.time()))
+        key = base64.b64decode(WEBHOOK_SECRET.removeprefix("whsec_"))
+        signed = f"{webhook_id}.{timestamp}.".encode() + body
+        signature = base64.b64encode(hmac.new(key, signed, hashlib.sha256).digest()).decode()
+        headers.update({"webhook-id": webhook_id, "webhook-timestamp": timestamp, "webhook-signature": f"v1,{signature}"})
+    return headers
+
+
+async def _complete(prediction: dict, base_url: str, webhook: str | None):
+    await asyncio.sleep(DELAY_SEC)
+
+    digest = int(hashlib.md5(prediction["id"].encode()).hexdigest(), 16)
+    if digest % 1000 < FAIL_RATE * 1000:
+        prediction.update(status="failed", error="Fake prediction failure")
+    else:
+        prediction.update(status="succeeded", output=f"{base_url}/fake-outputs/{prediction['id']}.jpg")
+    prediction["completed_at"] = _now()
+
+    if webhook and not DROP_WEBHOOKS:
+        global _http
+        if _http is None:
+            _http = httpx.AsyncClient(timeout=10)
+        body = json.dumps(prediction).encode()
+        try:
+            await _http.post(webhook, content=body, headers=_signed_headers(body))
+        except httpx.HTTPError as e:
+            print(f"Fake webhook to {webhook} failed: {e}")
+
+
+# ------------------ ENDPOINTS ------------------
+
+@app.post("/v1/models/{owner}/{name}/predictions", status_code=201)
+async def create_prediction(owner: str, name: str, request: Request):
+    payload = await request.json()
+    prediction_id = uuid.uuid4().hex[:20]
+    base_url = str(request.base_url).rstrip("/")
+    prediction = {
+        "id": prediction_id,
+        "model": f"{owner}/{name}",
+        "version": "fake",
+        "status": "starting",
+        "input": payload.get("input", {}),
+        "output": None,
+        "error": None,
+        "logs": "",
+        "created_at": _now(),
+        "urls": {"get": f"{base_url}/v1/predictions/{prediction_id}"},
+    }
+    _predictions[prediction_id] = prediction
+
+    task = asyncio.create_task(_complete(prediction, base_url, payload.get("webhook")))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return prediction
+
+
+@app.get("/v1/predictions/{prediction_id}")
+def get_prediction(prediction_id: str):
+    if prediction_id not in _predictions:
+        raise HTTPException(404, "Prediction not found")
+    return _predictions[prediction_id]
+
+
+@app.post("/v1/files", status_code=201)
+async def upload_file(request: Request, content: UploadFile = File(...)):
+    data = await content.read()
+    file_id = uuid.uuid4().hex[:20]
+    _files[file_id] = data
+    base_url = str(request.base_url).rstrip("/")
+    return {
+        "id": file_id,
+        "name": content.filename,
+        "content_type": content.content_type,
+        "size": len(data),
+        "etag": hashlib.md5(data).hexdigest(),
+        "checksums": {"sha256": hashlib.sha256(data).hexdigest()},
+        "metadata": {},
+        "created_at": _now(),
+        "expires_at": None,
+        "urls": {"get": f"{base_url}/v1/files/{file_id}/download"},
+    }
+
+
+@app.get("/v1/files/{file_id}/download")
+def download_file(file_id: str):
+    if file_id not in _files:
+        raise HTTPException(404, "File not found")
+    return Response(_files[file_id], media_type="application/octet-stream")
+
+
+@app.delete("/v1/files/{file_id}", status_code=204)
+def delete_file(file_id: str):
+    if _files.pop(file_id, None) is None:
+        raise HTTPException(404, "File not found")
+
+
+@app.get("/fake-outputs/{name}")
+def fake_output(name: str):
+    # A flat-colour placeholder, so downstream code gets a real JPEG
+    shade = int(hashlib.md5(name.encode()).hexdigest()[:6], 16)
+    img = Image.new("RGB", (64, 80), ((shade >> 16) & 255, (shade >> 8) & 255, shade & 255))
+    out = io.BytesIO()
+    img.save(out, format="JPEG")
+    return Response(out.getvalue(), media_type="image/jpeg")
@@ -1,8 +1,10 @@
-import csv
+import hashlib
 import json
 from pathlib import Path
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+from app.utilities.reference_snapshot import get_client_name, find_client
+from app.utilities.prompt_budget import fit_sections
 
 # -------------------- Pydantic Models --------------------
 
@@ -35,6 +37,7 @@ class ClientCreate(BaseModel):
     design_guide: DesignGuide
     logo_urls: List[str]
     client_id: str
+    latency_slo_ms: Optional[int] = None  # caption generation target, see model_router
 
 
 # -------------------- Paths --------------------
@@ -42,37 +45,80 @@ class ClientCreate(BaseModel):
 BASE_PATH = Path("app/Data/clients")
 
 def get_client_name_from_csv(client_id: str) -> str:
-    csv_path = BASE_PATH / "management.csv"
-    with open(csv_path, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row["client_id"] == client_id:
-                return row["client_name"]
-    raise ValueError(f"Client ID {client_id} not found in management.csv")
+    client_name = get_client_name(client_id)
+    if client_name is None:
+        raise ValueError(f"Client ID {client_id} not found in management.csv")
+    return client_name
 
 def get_client_profile(client_id: str) -> ClientCreate:
     client_name = get_client_name_from_csv(client_id)
-    json_path = BASE_PATH / client_name / "profile.json"
-    if not json_path.exists():
+    entry = find_client(client_id)
+    if not entry:
         raise FileNotFoundError(f"profile.json not found for client: {client_name}")
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return ClientCreate(**data)
+    return ClientCreate(**entry["profile"])
 
 
 # -------------------- Prompt Builder --------------------
-
-def build_full_prompt(client_id: str, visual_style: str, topic_titles: list[str], number_of_posts: int = 1) -> str:
+# The prompt is assembled from sections. Required sections are always sent
+# whole; optional ones carry a priority and are trimmed, highest number
+# first, when the prompt would exceed PROMPT_TOKEN_BUDGET (prompt_budget).
+
+EXAMPLE_PRIORITY = 5
+WRITING_SAMPLES_PRIORITY = 4
+BUSINESS_DESCRIPTION_PRIORITY = 3
+DOS_DONTS_PRIORITY = 2
+
+
+def _profile_version(client_id: str) -> str:
+    entry = find_client(client_id) or {}
+    return hashlib.md5(json.dumps(entry.get("profile"), sort_keys=True).encode()).hexdigest()
+
+
+def build_prompt(
+    client_id: str,
+    visual_style: str,
+    topic_titles: list[str],
+    number_of_posts: int = 1,
+    budget: int = None,
+    hashtag_mode: str = "llm",
+    hashtags: list[str] = None,
+    avoid_captions: list[str] = None,
+) -> tuple[str, dict]:
+    """
+    Returns the prompt and its token report (see prompt_budget.fit_sections).
+
+    hashtag_mode (see hashtag_engine.hashtag_plan): "llm" asks the model for
+    hashtags, "refine" asks it to pick from `hashtags`, "engine" leaves them
+    out of the requested output entirely.
+
+    avoid_captions are captions already rejected as near-duplicates; the
+    model is told to write something clearly different from them.
+    """
     client: ClientCreate = get_client_profile(client_id)
     topics_formatted = ", ".join(topic_titles)
-
-    prompt = f"""
+    version = _profile_version(client_id)
+    samples = "\n".join(f"- {sample}" for sample in client.writing_samples if sample.strip())
+    avoid = "\n".join(f"- {' '.join(c.split())[:300]}" for c in (avoid_captions or []) if c and c.strip())
+
+    def profile_key(name):
+        # Profile sections only change with the profile, so count them once per version
+        return (client_id, version, name)
+
+    if hashtag_mode == "engine":
+        deliverables = "1. **caption**\n2. **image_prompt**"
+        output_keys = '"caption" and "image_prompt"'
+        example_hashtags = ""
+    else:
+        deliverables = "1. **caption**\n2. **hashtags**\n3. **image_prompt**"
+        output_keys = '"caption", "hashtags" (array of strings) and "image_prompt"'
+        example_hashtags = '  "hashtags": ["#DentalCare", "#HealthySmiles", "#KidsDentist"],\n'
+
+    sections = [
+        ("intro", None, f"""
 You are an AI expert in creating **social media content for businesses**.
 
 Generate **{number_of_posts} posts** for **{client.client_name}**, each containing:
-1. **caption**
-2. **hashtags**
-3. **image_prompt** fully actionable for nano-banana image generation.
+{deliverables} fully actionable for nano-banana image generation.
 
 ### CLIENT INFO
 - Services: {client.services}
@@ -81,9 +127,20 @@ Generate **{number_of_posts} posts** for **{client.client_name}**, each containi
 - Brand Colors: {', '.join(client.design_guide.brand_colors)}
 - Design Style: {client.design_guide.design_style}
 - Image Mood: {client.design_guide.image_mood}
-- Dos & Don'ts: {client.design_guide.dos_donts}
-- Contact Info: {client.contact_info}, {client.website}, {client.number}, {client.mail}
-
+""", None),
+        ("dos_donts", DOS_DONTS_PRIORITY, f"""- Dos & Don'ts: {client.design_guide.dos_donts}
+""", profile_key("dos_donts")),
+        ("contact", None, f"""- Contact Info: {client.contact_info}, {client.website}, {client.number}, {client.mail}
+""", profile_key("contact")),
+        ("business_description", BUSINESS_DESCRIPTION_PRIORITY, f"""
+### ABOUT THE BUSINESS
+{client.business_description}
+""" if client.business_description.strip() else "", profile_key("business_description")),
+        ("writing_samples", WRITING_SAMPLES_PRIORITY, f"""
+### WRITING SAMPLES (match this tone)
+{samples}
+""" if samples else "", profile_key("writing_samples")),
+        ("request", None, f"""
 ### TOPICS
 {topics_formatted}
 
@@ -101,16 +158,44 @@ it should strictly follow this framework:
 "generate social media post for x business which provide y services to z audience. Add contact details (website,number,mail). The visual style should be this. The design should incorporate these brand colors"
 
 ### OUTPUT FORMAT
-Respond **strictly in JSON array**:
-
+Respond **strictly in JSON array** of objects with the keys {output_keys}.
+""", None),
+        ("hashtags", None, f"""
+### HASHTAGS
+These hashtags worked for this client on these topics: {', '.join(hashtags)}
+Use 3-5 of them per post; add a new one only when none fit.
+""" if hashtag_mode == "refine" and hashtags else "", None),
+        ("avoid", None, f"""
+### ALREADY USED (do not repeat)
+These captions are too close to earlier posts. Write new angles, openings and wording:
+{avoid}
+""" if avoid else "", None),
+        ("example", EXAMPLE_PRIORITY, f"""Example:
 [
 {{
   "caption": "Brighten your child's smile today! Keep their teeth happy and healthy with our expert dental care.",
-  "hashtags": ["#DentalCare", "#HealthySmiles", "#KidsDentist"],
-  "image_prompt": "Generate a vibrant social media post for Zuhd Dental which provides teeth whitening services to audiences aged 25 seeking confident, healthy smiles. Add contact details (https://zuhddental.com, +1 (872) 258-9898, care@zuhddental.com).The design should incorporate brand colors #E9E6DF, #7DA89A, and #1C1C1C. Must follow the design of the reference image."
+{example_hashtags}  "image_prompt": "Generate a vibrant social media post for Zuhd Dental which provides teeth whitening services to audiences aged 25 seeking confident, healthy smiles. Add contact details (https://zuhddental.com, +1 (872) 258-9898, care@zuhddental.com).The design should incorporate brand colors #E9E6DF, #7DA89A, and #1C1C1C. Must follow the design of the reference image."
 }}
 ]
-
+""", ("example", hashtag_mode)),
+        ("closing", None, f"""
 Generate **{number_of_posts} unique posts**, visually consistent with the client’s identity and topics.
-"""
+""", None),
+    ]
+    return fit_sections(sections, budget)
+
+
+def build_full_prompt(
+    client_id: str,
+    visual_style: str,
+    topic_titles: list[str],
+    number_of_posts: int = 1,
+    hashtag_mode: str = "llm",
+    hashtags: list[str] = None,
+    avoid_captions: list[str] = None,
+) -> str:
+    prompt, _ = build_prompt(
+        client_id, visual_style, topic_titles, number_of_posts,
+        hashtag_mode=hashtag_mode, hashtags=hashtags, avoid_captions=avoid_captions,
+    )
     return prompt
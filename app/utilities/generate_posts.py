@@ -1,14 +1,28 @@
-import csv
-from pathlib import Path
 from datetime import datetime
+import asyncio
 import os
-import replicate
-from app.utilities.format_prompt import build_full_prompt
+import anyio
+from replicate.exceptions import ReplicateError
+from app.utilities.format_prompt import build_full_prompt, build_prompt
 from app.utilities.prompting_ai import generate_caption_and_image_prompt
+from app.utilities.reference_images import prepare_reference_images, upload_reference_images, delete_reference_uploads
+from app.utilities.post_writer import buffer_post, flush_posts
+from app.utilities.post_store import POSTS_LOCK, iter_post_rows
+from app.utilities.post_stats import record_post
+from app.utilities.caption_dedup import split_near_duplicates, index_caption
+from app.utilities.hashtag_engine import hashtag_plan, fill_hashtags, index_post
+from app.utilities.reference_snapshot import get_topic_map, get_client_name
+from app.utilities.replicate_predictions import replicate_client, run_prediction
+from app.utilities.generation_runs import new_run_id, create_run, save_run, load_run, pending_posts, claim_run, release_run
+from app.utilities.image_proxy import schedule_prefetch
+from app.utilities import config
 from typing import List, Optional
 from pydantic import BaseModel
 import uuid
 
+# Image generations run concurrently per request, at most this many at once
+IMAGE_CONCURRENCY = int(os.getenv("REPLICATE_CONCURRENCY", "4"))
+
 
 class PostResponse(BaseModel):
     post_id: str
@@ -17,10 +31,6 @@ class PostResponse(BaseModel):
     image_url: str
 
 
-POSTS_PATH = Path("app/Data/posts")
-POSTS_CSV = POSTS_PATH / "management.csv"
-
-
 
 def generate_post_id(index: int) -> str:
     date_str = datetime.now().strftime("%Y%m%d")
@@ -28,55 +38,133 @@ def generate_post_id(index: int) -> str:
     return f"POST-{date_str}-{unique_suffix}"
 
 
+def caption_posts(ai_outputs: list[dict]) -> list[dict]:
+    """Per-post checkpoint entries for a run's captions, images still pending."""
+    return [
+        {
+            "index": i,
+            "post_id": generate_post_id(i),
+            "caption": post_data.get("caption"),
+            "hashtags": post_data.get("hashtags") or [],
+            "image_prompt": post_data.get("image_prompt"),
+            "status": "pending",
+            "image_url": None,
+            "error": None,
+        }
+        for i, post_data in enumerate(ai_outputs, start=1)
+    ]
+
+
 def save_post_metadata(post_dict: dict):
-    POSTS_PATH.mkdir(parents=True, exist_ok=True)
-    file_exists = POSTS_CSV.exists()
-    with open(POSTS_CSV, "a", newline="", encoding="utf-8") as f:
-        fieldnames = [
-            "post_id", "client_id", "category_id", "topics", 
-            "caption", "hashtags", "image_url", "finalized", "created_at"
-        ]
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        if not file_exists:
-            writer.writeheader()
-        writer.writerow(post_dict)
+    # Journaled and written to the CSV in groups; the create route flushes
+    # synchronously before responding. Buffered and counted under POSTS_LOCK
+    # so a stats rebuild sees the post in both places or in neither.
+    with POSTS_LOCK:
+        buffer_post(post_dict)
+        record_post(post_dict)
+    index_caption(post_dict["client_id"], post_dict["post_id"], post_dict.get("caption") or "")
+    index_post(post_dict)
+
+
+def _post_saved(client_id: str, post_id: str) -> bool:
+    flush_posts()
+    return any(row["post_id"] == post_id for row in iter_post_rows(client_id=client_id))
 
 
 
-def generate_posts(
+async def generate_posts(
     client_id: str,
     category_id: str,
     topic_ids: list[str],
     visual_style: str,
     reference_image: list[str] = [],
     number_of_posts: int = 1,
-    custom_prompt: Optional[str] = None
+    custom_prompt: Optional[str] = None,
+    usage: Optional[dict] = None,
+    run_id: Optional[str] = None
 ) -> list[PostResponse]:
+    """
+    Runs the full pipeline as a checkpointed run and returns the saved
+    posts. If `usage` is given it is filled with the prompt's token report
+    and the prompt/completion tokens the caption calls used.
+    """
+    request = {
+        "client_id": client_id,
+        "category_id": category_id,
+        "topic_ids": topic_ids,
+        "visual_style": visual_style,
+        "reference_image": reference_image or [],
+        "number_of_posts": number_of_posts,
+        "custom_prompt": custom_prompt,
+    }
+    from fastapi import HTTPException
+
+    run_id = run_id or new_run_id()
+    claim = await anyio.to_thread.run_sync(claim_run, run_id)
+    if claim is None:
+        raise HTTPException(status_code=409, detail=f"Run {run_id} is still in progress")
+    try:
+        return await _execute_run(request, run_id, usage)
+    finally:
+        await anyio.to_thread.run_sync(release_run, run_id, claim)
+
+
+async def resume_run(run_id: str, usage: Optional[dict] = None) -> list[PostResponse]:
+    """
+    Continues a run from its checkpoint: the caption step is skipped if it
+    finished, and only posts without an image are generated again.
+    """
+    from fastapi import HTTPException
+
+    if await anyio.to_thread.run_sync(load_run, run_id) is None:
+        raise HTTPException(status_code=404, detail=f"Run {run_id} not found")
+
+    claim = await anyio.to_thread.run_sync(claim_run, run_id)
+    if claim is None:
+        raise HTTPException(status_code=409, detail=f"Run {run_id} is still in progress")
+    try:
+        # Re-read under the claim: the run may have finished meanwhile
+        run = await anyio.to_thread.run_sync(load_run, run_id)
+        if run["status"] == "completed":
+            return _run_posts(run)
+        run["attempts"] = run.get("attempts", 1) + 1
+        return await _execute_run(run["request"], run_id, usage, run=run)
+    finally:
+        await anyio.to_thread.run_sync(release_run, run_id, claim)
+
+
+def _run_posts(run: dict) -> list[PostResponse]:
+    return [
+        PostResponse(post_id=p["post_id"], caption=p["caption"], hashtags=p["hashtags"], image_url=p["image_url"])
+        for p in run["posts"] if p["status"] == "done"
+    ]
+
 
+async def _execute_run(request: dict, run_id: str, usage: Optional[dict], run: Optional[dict] = None) -> list[PostResponse]:
     from fastapi import HTTPException
 
+    client_id = request["client_id"]
+    topic_ids = request["topic_ids"]
+    reference_image = request["reference_image"]
+
     print("\n=================== PROCESS STARTED ===================")
 
     # ----- Load Topic Titles -----
     print("\n>>> CHECKPOINT 1: Loading Topics...")
 
     topic_titles = []
-    TOPICS_CSV = Path("app/Data/topics/management.csv")
-
-    if not TOPICS_CSV.exists():
-        raise HTTPException(status_code=500, detail=f"{TOPICS_CSV} does not exist")
+    topic_map = await anyio.to_thread.run_sync(get_topic_map)
 
-    with open(TOPICS_CSV, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        topic_map = {row["topic_id"]: row["title"] for row in reader}
+    if not topic_map:
+        raise HTTPException(status_code=500, detail="No topics have been created yet")
 
-        print("Loaded Topic Map:", topic_map)
+    print("Loaded Topic Map:", topic_map)
 
-        for tid in topic_ids:
-            if tid in topic_map:
-                topic_titles.append(topic_map[tid])
-            else:
-                raise HTTPException(status_code=400, detail=f"Topic ID {tid} not found")
+    for tid in topic_ids:
+        if tid in topic_map:
+            topic_titles.append(topic_map[tid])
+        else:
+            raise HTTPException(status_code=400, detail=f"Topic ID {tid} not found")
 
     print("Resolved Topics:", topic_titles)
 
@@ -85,15 +173,7 @@ def generate_posts(
     # ----- Load Client Name -----
     print("\n>>> CHECKPOINT 2: Loading Client Name...")
 
-    CLIENTS_CSV = Path("app/Data/clients/management.csv")
-    client_name = None
-
-    with open(CLIENTS_CSV, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row["client_id"] == client_id:
-                client_name = row["client_name"]
-                break
+    client_name = await anyio.to_thread.run_sync(get_client_name, client_id)
 
     print("Client Name Found:", client_name)
 
@@ -102,56 +182,187 @@ def generate_posts(
 
 
 
-    # ----- Build Prompt -----
-    print("\n>>> CHECKPOINT 3: Building AI Prompt...")
+    # ----- Prepare Reference Images -----
+    # Fetched, validated and downscaled once per request, before any paid
+    # call, so a dead URL fails fast instead of midway through the batch.
+    print("\n>>> Preparing Reference Images...")
+
+    try:
+        reference_paths = await anyio.to_thread.run_sync(prepare_reference_images, reference_image or [])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    print("Prepared References:", [p.name for p in reference_paths])
+
+
+
+    # ----- Checkpoint Run -----
+    # From here on every step is recorded in app/Data/runs/<run_id>.json, so
+    # a failure can be resumed without paying for finished steps again.
+    if run is None:
+        run = await anyio.to_thread.run_sync(create_run, run_id, request)
+    else:
+        run.update(status="running", pid=os.getpid(), error=None)
+        await anyio.to_thread.run_sync(save_run, run)
+    print("Run ID:", run_id)
+
+    usage = usage if usage is not None else {}
+    try:
+        final_posts = await _run_steps(run, topic_titles, reference_paths, usage)
+    except BaseException as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e) or type(e).__name__
+        run.update(status="failed", error=detail)
+        await anyio.to_thread.run_sync(save_run, run)
+        if not isinstance(e, Exception):
+            raise  # cancelled
+        print(f"Run {run_id} failed: {detail}")
+        status_code = e.status_code if isinstance(e, HTTPException) else 500
+        raise HTTPException(
+            status_code=status_code,
+            detail=f"{detail} (run {run_id} can be resumed via POST /posts/runs/{run_id}/resume)",
+            headers={"X-Run-Id": run_id},
+        )
+
+    run["status"] = "completed"
+    await anyio.to_thread.run_sync(save_run, run)
+    schedule_prefetch([p.image_url for p in final_posts])
+
+    print("\n=================== PROCESS COMPLETED ===================\n")
+    return final_posts
+
+
+async def _run_steps(run: dict, topic_titles: list[str], reference_paths: list, usage: dict) -> list[PostResponse]:
+    from fastapi import HTTPException
+
+    request = run["request"]
+    client_id = request["client_id"]
+    category_id = request["category_id"]
+    topic_ids = request["topic_ids"]
+    visual_style = request["visual_style"]
+    reference_image = request["reference_image"]
+    number_of_posts = request["number_of_posts"]
+    custom_prompt = request["custom_prompt"]
+
+    checkpoint_lock = asyncio.Lock()
+
+    async def checkpoint():
+        async with checkpoint_lock:
+            await anyio.to_thread.run_sync(save_run, run)
 
-    prompt = build_full_prompt(
-        client_id=client_id,
-        visual_style=visual_style,
-        topic_titles=topic_titles,
-        number_of_posts=number_of_posts,
-    )
+    if run["captions"] is not None:
+        print("\n>>> Reusing captions from checkpoint")
+    else:
+        # ----- Build Prompt -----
+        print("\n>>> CHECKPOINT 3: Building AI Prompt...")
 
-    print("\n----- BUILT PROMPT SENT TO AI -----")
-    print(prompt)
+        hashtag_mode, hashtag_candidates = await anyio.to_thread.run_sync(hashtag_plan, client_id, topic_ids)
+        print("Hashtag mode:", hashtag_mode)
 
+        prompt, prompt_report = await anyio.to_thread.run_sync(lambda: build_prompt(
+            client_id=client_id,
+            visual_style=visual_style,
+            topic_titles=topic_titles,
+            number_of_posts=number_of_posts,
+            hashtag_mode=hashtag_mode,
+            hashtags=hashtag_candidates,
+        ))
+        usage["prompt"] = prompt_report
+        usage["hashtag_mode"] = hashtag_mode
 
+        print("\n----- BUILT PROMPT SENT TO AI -----")
+        print(prompt)
+        print("Prompt tokens (est):", prompt_report["prompt_tokens_est"], "trimmed:", prompt_report["trimmed"] or "nothing")
 
-    # ----- Generate captions + hashtags + image_prompt -----
-    print("\n>>> CHECKPOINT 4: AI Generating Captions + Image Prompts...")
 
-    ai_outputs = generate_caption_and_image_prompt(prompt)
 
-    print("\n----- RAW AI OUTPUT -----")
-    print(ai_outputs)
+        # ----- Generate captions + hashtags + image_prompt -----
+        print("\n>>> CHECKPOINT 4: AI Generating Captions + Image Prompts...")
+
+        ai_outputs = await generate_caption_and_image_prompt(
+            prompt, number_of_posts=number_of_posts, client_id=client_id, usage=usage, hashtag_mode=hashtag_mode
+        )
+
+        print("\n----- RAW AI OUTPUT -----")
+        print(ai_outputs)
+
+
+
+        # ----- Drop Near-Duplicate Captions -----
+        # Runs before any Replicate call so we never pay for an image on a
+        # caption reviewers would reject as a copy of an earlier post.
+        print("\n>>> Checking Captions Against Client History...")
+
+        ai_outputs, dropped = await anyio.to_thread.run_sync(split_near_duplicates, client_id, ai_outputs)
+
+        if dropped:
+            print(f"Regenerating {len(dropped)} near-duplicate post(s)...")
+            retry_prompt = await anyio.to_thread.run_sync(lambda: build_full_prompt(
+                client_id=client_id,
+                visual_style=visual_style,
+                topic_titles=topic_titles,
+                number_of_posts=len(dropped),
+                hashtag_mode=hashtag_mode,
+                hashtags=hashtag_candidates,
+                avoid_captions=[o.get("caption", "") for o in dropped],
+            ))
+            retry_outputs = await generate_caption_and_image_prompt(
+                retry_prompt, number_of_posts=len(dropped), client_id=client_id, usage=usage, hashtag_mode=hashtag_mode
+            )
+            replacements, _ = await anyio.to_thread.run_sync(
+                lambda: split_near_duplicates(client_id, retry_outputs, accepted=ai_outputs)
+            )
+            ai_outputs += replacements[:len(dropped)]
+
+        if not ai_outputs:
+            raise HTTPException(status_code=409, detail="All generated captions duplicate existing posts for this client")
+
+        # ----- Fill Hashtags From History -----
+        if hashtag_mode == "engine":
+            def fill():
+                for output in ai_outputs:
+                    output["hashtags"] = fill_hashtags(client_id, topic_ids, output.get("caption") or "")
+            await anyio.to_thread.run_sync(fill)
+
+        # ----- Checkpoint Captions -----
+        run["captions"] = ai_outputs
+        run["usage"] = usage
+        run["posts"] = caption_posts(ai_outputs)
+        await checkpoint()
+
+
+
+    pending = pending_posts(run)
+    if not pending:
+        return _run_posts(run)
 
 
 
     # ----- Initialize Replicate -----
     print("\n>>> CHECKPOINT 5: Initializing Replicate...")
 
-    replicate_api_token = os.getenv("REPLICATE_API_TOKEN")
-
-    if not replicate_api_token:
+    if not config.get("REPLICATE_API_TOKEN"):
         raise HTTPException(status_code=500, detail="REPLICATE_API_TOKEN not set")
 
-    client = replicate.Client(api_token=replicate_api_token)
+    client = replicate_client()
     print("Replicate Client Initialized.")
 
+    reference_inputs, uploaded_ids = await anyio.to_thread.run_sync(upload_reference_images, client, reference_paths)
+
 
 
     # ----- Start Generating Posts -----
-    print("\n>>> CHECKPOINT 6: Generating Posts...")
+    print(f"\n>>> CHECKPOINT 6: Generating {len(pending)} of {len(run['posts'])} Posts...")
 
-    final_posts = []
+    semaphore = asyncio.Semaphore(IMAGE_CONCURRENCY)
 
-    for i, post_data in enumerate(ai_outputs, start=1):
+    async def generate_one(post: dict):
+        i = post["index"]
         print(f"\n\n================ POST {i} STARTED ================")
 
-        post_id = generate_post_id(i)
+        post_id = post["post_id"]
         print("Post ID:", post_id)
 
-        image_prompt = post_data.get("image_prompt")
+        image_prompt = post.get("image_prompt")
         print("AI Image Prompt:", image_prompt)
 
         if not image_prompt:
@@ -159,81 +370,116 @@ def generate_posts(
 
 
 
-        # ----- Image Generation -----
-        print("\n>>> CHECKPOINT 7: Sending Prompt to Nano Banana...")
+        # A post whose image finished on an earlier attempt keeps it; that
+        # attempt may also have saved the post before failing
+        retried = bool(post.get("image_url"))
+        if retried:
+            image_url = post["image_url"]
+            print("Reusing image from checkpoint:", image_url)
+        else:
+            # ----- Image Generation -----
+            print("\n>>> CHECKPOINT 7: Sending Prompt to Nano Banana...")
 
-        # Start with either custom prompt or AI-generated image prompt
-        final_prompt = custom_prompt or image_prompt
+            # Start with either custom prompt or AI-generated image prompt
+            final_prompt = custom_prompt or image_prompt
 
-        # If reference images are provided, append instruction
-        if reference_image:
-            final_prompt += " Must follow the design of the reference image."
+            # If reference images are provided, append instruction
+            if reference_image:
+                final_prompt += " Must follow the design of the reference image."
 
-        print("\n----- FINAL PROMPT SENT TO REPLICATE -----")
-        print(final_prompt)
+            print("\n----- FINAL PROMPT SENT TO REPLICATE -----")
+            print(final_prompt)
 
-        print("Reference Images Given:", reference_image)
+            print("Reference Images Given:", reference_image)
 
-        output = client.run(
-            "google/nano-banana",
-            input={
-                "prompt": final_prompt,
-                "image_input": reference_image,
-                "aspect_ratio": "4:5",
-                "output_format": "jpg"
-            }
-        )
+            # Created with a webhook; waiting is a suspended coroutine, not a poll loop
+            try:
+                async with semaphore:
+                    output = await run_prediction(
+                        client,
+                        "google/nano-banana",
+                        input={
+                            "prompt": final_prompt,
+                            "image_input": reference_inputs,
+                            "aspect_ratio": "4:5",
+                            "output_format": "jpg"
+                        }
+                    )
+            except (RuntimeError, ReplicateError) as e:
+                raise HTTPException(status_code=502, detail=f"Image generation failed for post {i}: {e}")
 
 
-        print("\n----- RAW REPLICATE OUTPUT -----")
-        print(output)
+            print("\n----- RAW REPLICATE OUTPUT -----")
+            print(output)
 
 
 
-        # ----- Extract Image URL -----
-        if isinstance(output, list):
-            image_url = output[0].url if hasattr(output[0], "url") else str(output[0])
-        elif hasattr(output, "url"):
-            image_url = output.url
-        else:
-            image_url = str(output)
+            # ----- Extract Image URL -----
+            if isinstance(output, list):
+                image_url = output[0].url if hasattr(output[0], "url") else str(output[0])
+            elif hasattr(output, "url"):
+                image_url = output.url
+            else:
+                image_url = str(output)
 
-        print("Final Image URL:", image_url)
+            print("Final Image URL:", image_url)
 
+            # Recorded before saving, so a resume after a failed save reuses it
+            post.update(status="saving", image_url=image_url)
+            await checkpoint()
 
 
-        hashtags = post_data.get("hashtags") or []
-        print("Hashtags:", hashtags)
 
-        # ----- Build Response -----
-        final_posts.append(
-            PostResponse(
-                post_id=post_id,
-                caption=post_data.get("caption"),
-                hashtags=hashtags,
-                image_url=image_url
-            )
-        )
+        hashtags = post["hashtags"]
+        print("Hashtags:", hashtags)
 
 
         # ----- Save Metadata -----
         print("\n>>> CHECKPOINT 8: Saving Metadata to CSV...")
 
-        save_post_metadata({
-            "post_id": post_id,
-            "client_id": client_id,
-            "category_id": category_id,
-            "topics": ",".join(topic_ids),
-            "caption": post_data.get("caption"),
-            "hashtags": ",".join(hashtags),
-            "image_url": image_url,
-            "finalized": False,
-            "created_at": datetime.now().isoformat()
-        })
+        if retried and await anyio.to_thread.run_sync(_post_saved, client_id, post_id):
+            print("Post already saved by an earlier attempt.")
+        else:
+            await anyio.to_thread.run_sync(save_post_metadata, {
+                "post_id": post_id,
+                "client_id": client_id,
+                "category_id": category_id,
+                "topics": ",".join(topic_ids),
+                "caption": post["caption"],
+                "hashtags": ",".join(hashtags),
+                "image_url": image_url,
+                "finalized": False,
+                "created_at": datetime.now().isoformat()
+            })
 
         print("Metadata Saved.")
 
+        post.update(status="done", image_url=image_url, error=None)
+        await checkpoint()
+
+    async def generate_checkpointed(post: dict):
+        try:
+            await generate_one(post)
+        except Exception as e:
+            post.update(status="failed", error=e.detail if isinstance(e, HTTPException) else str(e))
+            await checkpoint()
+            raise
+
+    # Every post runs to completion even if another fails, so the run keeps
+    # whatever was already paid for
+    try:
+        results = await asyncio.gather(*(generate_checkpointed(post) for post in pending), return_exceptions=True)
+    finally:
+        # A resume uploads its references again, so these are not needed past this run
+        await anyio.to_thread.run_sync(delete_reference_uploads, client, uploaded_ids)
+    failures = [r for r in results if isinstance(r, BaseException)]
+    if failures:
+        first = failures[0]
+        if len(failures) == 1 and isinstance(first, HTTPException):
+            raise first
+        raise HTTPException(
+            status_code=getattr(first, "status_code", 500),
+            detail=f"{len(failures)} of {len(run['posts'])} posts failed; first error: {getattr(first, 'detail', first)}",
+        )
 
-
-    print("\n=================== PROCESS COMPLETED ===================\n")
-    return final_posts
+    return _run_posts(run)
@@ -0,0 +1,96 @@
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from app.utilities.csv_io import atomic_write_text, try_lock_path, release_lock_path
+
+# -------------------- Paths --------------------
+# Every generation run is checkpointed to app/Data/runs/<run_id>.json: the
+# request, the caption step's outputs and, per post, its image status and
+# URL. A failed run can be resumed from the checkpoint, redoing only the
+# steps that did not finish. Finished runs are pruned after RUN_RETENTION_DAYS.
+#
+# Whoever executes a run holds a lock on <run_id>.lock (see claim_run), so
+# a run cannot be resumed while it is still executing in any process.
+
+RUNS_PATH = Path("app/Data/runs")
+RETENTION_DAYS = int(os.getenv("RUN_RETENTION_DAYS", "7"))
+PRUNE_EVERY = 50  # runs created between sweeps
+
+_created = 0
+
+
+def new_run_id() -> str:
+    return f"RUN-{datetime.now().strftime('%Y%m%d')}-{uuid.uuid4().hex[:8].upper()}"
+
+
+def _run_path(run_id: str) -> Optional[Path]:
+    if not run_id.replace("-", "").isalnum():
+        return None
+    return RUNS_PATH / f"{run_id}.json"
+
+
+def create_run(run_id: str, request: dict) -> dict:
+    global _created
+    now = datetime.now().isoformat()
+    run = {
+        "run_id": run_id,
+        "status": "running",
+        "pid": os.getpid(),
+        "created_at": now,
+        "updated_at": now,
+        "request": request,
+        "captions": None,  # list of AI outputs once the caption step is done
+        "posts": [],
+        "usage": {},
+        "error": None,
+        "attempts": 1,
+    }
+    save_run(run)
+
+    _created += 1
+    if _created % PRUNE_EVERY == 0:
+        prune_runs()
+    return run
+
+
+def save_run(run: dict):
+    run["updated_at"] = datetime.now().isoformat()
+    atomic_write_text(_run_path(run["run_id"]), json.dumps(run, indent=2, default=str))
+
+
+def claim_run(run_id: str):
+    """
+    Locks the run for execution. Returns the claim to pass to release_run(),
+    or None if the run is executing elsewhere. The lock is dropped by the OS
+    if the holder dies, so a crashed run can be claimed again.
+    """
+    path = _run_path(run_id)
+    return try_lock_path(path.with_suffix(".lock")) if path else None
+
+
+def release_run(run_id: str, claim):
+    release_lock_path(claim, _run_path(run_id).with_suffix(".lock"))
+
+
+def load_run(run_id: str) -> Optional[dict]:
+    path = _run_path(run_id)
+    if path is None or not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+def prune_runs():
+    if not RUNS_PATH.exists():
+        return
+    cutoff = time.time() - RETENTION_DAYS * 86400
+    for path in RUNS_PATH.glob("RUN-*.json"):
+        if path.stat().st_mtime < cutoff:
+            path.unlink(missing_ok=True)
+
+
+def pending_posts(run: dict) -> list[dict]:
+    return [p for p in run["posts"] if p["status"] != "done"]
@@ -0,0 +1,215 @@
+import os
+import numpy as np
+from app.utilities.client_indexes import ClientIndexes
+
+# -------------------- Settings --------------------
+# Hashtags are suggested from each client's own post history: how often a
+# tag was used, how often it was used on each topic, and which tags were
+# used together (a sparse tag x tag co-occurrence matrix). Scores are
+# computed with NumPy over the client's whole vocabulary at once.
+#
+# HASHTAG_MODE controls who writes the hashtags of generated posts:
+#   "llm"    - the caption model writes them (default)
+#   "refine" - the engine's suggestions go into the prompt and the model
+#              picks from them
+#   "engine" - the model writes none; the engine fills them in
+# Clients with fewer than HASHTAG_MIN_HISTORY posts fall back to "llm".
+
+HASHTAG_MODE = os.getenv("HASHTAG_MODE", "llm").lower()
+HASHTAGS_PER_POST = int(os.getenv("HASHTAGS_PER_POST", "5"))
+MIN_HISTORY = int(os.getenv("HASHTAG_MIN_HISTORY", "5"))
+REFINE_CANDIDATES = 12
+
+TOPIC_WEIGHT = 1.0
+COOCCURRENCE_WEIGHT = 1.0
+POPULARITY_WEIGHT = 0.25
+CAPTION_WEIGHT = 0.5
+
+
+def normalize_hashtag(tag: str) -> str:
+    body = "".join(str(tag).split()).lstrip("#")
+    return f"#{body}" if body else ""
+
+
+def _split(value) -> list[str]:
+    items = value if isinstance(value, list) else str(value or "").split(",")
+    return [v.strip() for v in items if v and v.strip()]
+
+
+# -------------------- Per-Client Index --------------------
+
+class ClientHashtagIndex:
+    def __init__(self):
+        self.tag_ids: dict[str, int] = {}  # lower-cased tag -> column
+        self.tags: list[str] = []  # display form, first spelling seen
+        self.counts = np.zeros(64)  # posts per tag
+        self.cooccurrence: dict[int, dict[int, int]] = {}
+        self.topic_tags: dict[str, dict[int, int]] = {}
+        self.topic_posts: dict[str, int] = {}
+        self.entries: dict[str, tuple] = {}  # post_id -> (hashtags, topics) counted
+        self.posts = 0
+        self._bodies: np.ndarray | None = None
+
+    def _column(self, tag: str, create: bool) -> int | None:
+        key = tag.lower()
+        column = self.tag_ids.get(key)
+        if column is None and create:
+            column = len(self.tags)
+            self.tag_ids[key] = column
+            self.tags.append(tag)
+            if column >= len(self.counts):
+                self.counts = np.concatenate([self.counts, np.zeros(len(self.counts))])
+            self._bodies = None
+        return column
+
+    def add_row(self, row: dict):
+        """
+        Counts a post row. Keyed by post_id: a post counted before (by the
+        history scan or an earlier save) has its old tags uncounted first, so
+        each post is counted once with its latest tags.
+        """
+        post_id = row.get("post_id")
+        entry = (row.get("hashtags"), row.get("topics"))
+        if post_id:
+            self.remove_row(row)
+            self.entries[post_id] = entry
+        self.add(*entry)
+
+    def remove_row(self, row: dict):
+        entry = self.entries.pop(row.get("post_id") or "", None)
+        if entry is not None:
+            self.add(*entry, delta=-1)
+
+    def add(self, hashtags, topics, delta: int = 1):
+        tags = {normalize_hashtag(t) for t in _split(hashtags)} - {""}
+        columns = {c for c in (self._column(t, create=delta > 0) for t in tags) if c is not None}
+        topics = set(_split(topics))
+
+        self.posts += delta
+        for column in columns:
+            self.counts[column] += delta
+            row = self.cooccurrence.setdefault(column, {})
+            for other in columns:
+                if other != column:
+                    _bump(row, other, delta)
+        for topic in topics:
+            self.topic_posts[topic] = self.topic_posts.get(topic, 0) + delta
+            row = self.topic_tags.setdefault(topic, {})
+            for column in columns:
+                _bump(row, column, delta)
+
+    def _dense(self, row: dict[int, int] | None) -> np.ndarray:
+        vector = np.zeros(len(self.tags))
+        if row:
+            vector[np.fromiter(row.keys(), np.int64, len(row))] = np.fromiter(row.values(), np.float64, len(row))
+        return vector
+
+    def _tag_bodies(self) -> np.ndarray:
+        if self._bodies is None:
+            self._bodies = np.array([t[1:].lower() for t in self.tags], dtype=str)
+        return self._bodies
+
+    def score(self, topics=(), seed=(), prefix: str = "", text: str = "") -> np.ndarray:
+        """
+        Scores every known tag for a post on `topics` that already has the
+        `seed` tags. Unusable tags (unused, already seeded, not matching the
+        prefix) score -inf.
+        """
+        n = len(self.tags)
+        counts = self.counts[:n]
+        scores = POPULARITY_WEIGHT * counts / max(self.posts, 1)
+
+        topics = [t for t in topics if self.topic_posts.get(t, 0) > 0]
+        if topics:
+            # P(tag | topic), averaged over the post's topics
+            topic_scores = sum(self._dense(self.topic_tags.get(t)) / self.topic_posts[t] for t in topics)
+            scores += TOPIC_WEIGHT * topic_scores / len(topics)
+
+        seed_columns = [c for c in (self._column(normalize_hashtag(t), create=False) for t in seed) if c is not None]
+        if seed_columns:
+            # P(tag | seed tag), averaged over the seed tags
+            seed_scores = sum(self._dense(self.cooccurrence.get(c)) / max(counts[c], 1) for c in seed_columns)
+            scores += COOCCURRENCE_WEIGHT * seed_scores / len(seed_columns)
+
+        if text:
+            words = set(text.lower().replace("#", " ").split())
+            mentioned = np.fromiter((body in words for body in self._tag_bodies()), bool, n)
+            scores += CAPTION_WEIGHT * mentioned
+
+        usable = counts > 0
+        usable[seed_columns] = False
+        prefix = normalize_hashtag(prefix)[1:].lower()
+        if prefix:
+            usable &= np.char.startswith(self._tag_bodies(), prefix)
+        return np.where(usable, scores, -np.inf)
+
+    def top(self, scores: np.ndarray, limit: int) -> list[dict]:
+        limit = min(limit, int(np.isfinite(scores).sum()))
+        if limit <= 0:
+            return []
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [
+            {"hashtag": self.tags[c], "score": round(float(scores[c]), 4), "count": int(self.counts[c])}
+            for c in best
+        ]
+
+
+def _bump(row: dict, key, delta: int):
+    row[key] = row.get(key, 0) + delta
+    if row[key] <= 0:
+        del row[key]
+
+
+# Built from each client's post history on first use in this process, then
+# kept current by index_post() and index_changes() (see client_indexes)
+_indexes = ClientIndexes(ClientHashtagIndex)
+
+
+def index_post(row: dict):
+    _indexes.apply(added=[row])
+
+
+def index_changes(added: list[dict] = (), removed: list[dict] = ()):
+    _indexes.apply(added=added, removed=removed)
+
+
+# -------------------- Suggestions --------------------
+
+def suggest_hashtags(
+    client_id: str,
+    topic_ids=(),
+    seed=(),
+    prefix: str = "",
+    text: str = "",
+    limit: int = HASHTAGS_PER_POST,
+) -> list[dict]:
+    """
+    Ranks the client's past hashtags for a post on `topic_ids`. `seed` are
+    tags the post already has (completion), `prefix` filters by how the tag
+    starts, and `text` (e.g. the caption) boosts tags it mentions.
+    """
+    with _indexes.use(client_id) as index:
+        return index.top(index.score(topic_ids, seed, prefix, text), limit)
+
+
+def history_size(client_id: str) -> int:
+    with _indexes.use(client_id) as index:
+        return index.posts
+
+
+def hashtag_plan(client_id: str, topic_ids: list[str]) -> tuple[str, list[str]]:
+    """
+    Returns the effective HASHTAG_MODE for a generation and, for "refine",
+    the candidate tags to offer the model.
+    """
+    if HASHTAG_MODE not in ("refine", "engine") or history_size(client_id) < MIN_HISTORY:
+        return "llm", []
+    if HASHTAG_MODE == "engine":
+        return "engine", []
+    candidates = [s["hashtag"] for s in suggest_hashtags(client_id, topic_ids, limit=REFINE_CANDIDATES)]
+    return ("refine", candidates) if candidates else ("llm", [])
+
+
+def fill_hashtags(client_id: str, topic_ids: list[str], caption: str) -> list[str]:
+    return [s["hashtag"] for s in suggest_hashtags(client_id, topic_ids, text=caption, limit=HASHTAGS_PER_POST)]
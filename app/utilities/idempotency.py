@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Awaitable, Callable
+import anyio
+from app.utilities.csv_io import atomic_write_text, try_lock_path, release_lock_path
+
+# -------------------- Settings --------------------
+# Each Idempotency-Key gets one small JSON record holding the request
+# fingerprint, its state and, once finished, the response body. Records
+# expire after IDEMPOTENCY_TTL_SECONDS. Retries that arrive while the first
+# run is still going wait on that run instead of starting another one.
+#
+# The process running a key holds a lock on <record>.lock until it writes
+# the outcome. The OS drops the lock if that process dies, so an
+# "in_progress" record whose lock can be taken was abandoned and is run
+# again; this holds across containers sharing the volume and PID reuse.
+
+IDEMPOTENCY_ROOT = Path("app/Data/idempotency")
+TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+PURGE_EVERY = 100  # calls between sweeps of expired records
+
+
+class IdempotencyConflict(Exception):
+    """Raised when a key is reused with a different request body (422)."""
+
+
+class IdempotencyInProgress(Exception):
+    """Raised when another process is still running this key (409)."""
+
+
+_running: dict[str, Future] = {}
+_held: dict[str, object] = {}  # record name -> its open, locked lock file
+_lock = threading.Lock()
+_calls = 0
+
+
+def fingerprint(payload: str) -> str:
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _record_path(key: str) -> Path:
+    return IDEMPOTENCY_ROOT / f"{hashlib.sha256(key.encode()).hexdigest()}.json"
+
+
+def _read(path: Path) -> dict | None:
+    try:
+        record = json.loads(path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if record.get("expires_at", 0) < time.time():
+        path.unlink(missing_ok=True)
+        return None
+    return record
+
+
+def _write(path: Path, record: dict):
+    atomic_write_text(path, json.dumps(record))
+
+
+def _lock_path(path: Path) -> Path:
+    return path.with_suffix(".lock")
+
+
+def purge_expired():
+    if not IDEMPOTENCY_ROOT.exists():
+        return
+    for path in IDEMPOTENCY_ROOT.glob("*.json"):
+        _read(path)  # unlinks expired records
+
+
+# -------------------- Execution --------------------
+
+def _begin(key: str, request_fingerprint: str, context: dict) -> tuple[Path, dict | None, Future | None, bool]:
+    """
+    Decides what a call with this key does. Returns (path, record, future,
+    owner). An owner gets the in-progress `record` it must execute; its
+    "context" is the one stored by an earlier failed attempt, if any, else
+    `context`. Otherwise a completed `record` is replayed as is, or `future`
+    is the run in this process to wait on.
+    """
+    global _calls
+    path = _record_path(key)
+
+    with _lock:
+        _calls += 1
+        if _calls % PURGE_EVERY == 0:
+            purge_expired()
+
+        record = _read(path)
+        if record and record["fingerprint"] != request_fingerprint:
+            raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+
+        if record and record["status"] == "completed":
+            return path, record, None, False
+
+        running = _running.get(path.name)
+        if running is not None:
+            return path, None, running, False
+
+        lock = try_lock_path(_lock_path(path))
+        if lock is None:
+            raise IdempotencyInProgress("A request with this Idempotency-Key is still in progress")
+
+        # With the lock held, re-read: another process may have finished the
+        # key meanwhile. Anything else (no record, failed, or in progress
+        # with its owner gone) is ours to run.
+        previous = _read(path)
+        if previous and previous["fingerprint"] != request_fingerprint:
+            previous = None  # expired and reused by a different request meanwhile
+        if previous and previous["status"] == "completed":
+            release_lock_path(lock, _lock_path(path))
+            return path, previous, None, False
+
+        now = time.time()
+        record = {
+            "fingerprint": request_fingerprint,
+            "status": "in_progress",
+            "context": (previous or {}).get("context") or context,
+            "created_at": now,
+            "expires_at": now + TTL_SECONDS,
+        }
+        try:
+            _write(path, record)
+        except BaseException:
+            release_lock_path(lock, _lock_path(path))
+            raise
+        _held[path.name] = lock
+        future = Future()
+        _running[path.name] = future
+        return path, record, future, True
+
+
+async def arun_idempotent(
+    key: str,
+    request_fingerprint: str,
+    fn: Callable[[dict], Awaitable[dict]],
+    context: dict | None = None,
+) -> tuple[dict, bool]:
+    """
+    Runs the coroutine function `fn` at most once per key within the TTL and
+    returns (result, replayed). A completed run is replayed from the store,
+    a run in progress in this process is joined, one in progress in another
+    process raises IdempotencyInProgress, and a failed run may be retried.
+
+    `fn` is called with `context`, which is stored with the record; a retry
+    after a failure gets the first attempt's context back (e.g. its run id).
+    """
+    path, record, future, owner = await anyio.to_thread.run_sync(
+        _begin, key, request_fingerprint, context or {}
+    )
+    if not owner:
+        if record:
+            return record["result"], True
+        return await asyncio.shield(asyncio.wrap_future(future)), True
+
+    try:
+        result = await fn(record["context"])
+    except BaseException as e:
+        await anyio.to_thread.run_sync(_finish, path, {"status": "failed", "error": str(e)})
+        future.set_exception(e)
+        raise
+    await anyio.to_thread.run_sync(_finish, path, {"status": "completed", "result": result})
+    future.set_result(result)
+    return result, False
+
+
+def _finish(path: Path, update: dict):
+    with _lock:
+        record = _read(path) or {}
+        record.update(update)
+        record.setdefault("expires_at", time.time() + TTL_SECONDS)
+        try:
+            _write(path, record)
+        finally:
+            _running.pop(path.name, None)
+            lock = _held.pop(path.name, None)
+            if lock is not None:
+                release_lock_path(lock, _lock_path(path))
@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import urljoin, urlparse
+import anyio
+import httpx
+from app.utilities.single_flight import SingleFlight
+from app.utilities.csv_io import atomic_write_bytes, atomic_write_text
+from app.utilities import config
+
+# -------------------- Settings --------------------
+# Remote images (ImgBB uploads, Replicate deliveries) are fetched once and
+# kept in a size-bounded LRU cache on disk; /images/proxy serves them from
+# there. Only hosts in IMAGE_PROXY_HOSTS (and their subdomains) are
+# fetched, so the proxy cannot be pointed at arbitrary URLs; redirects are
+# followed by hand and every hop is checked against the same list.
+#
+# A cached file is pinned while a response streams it, and eviction skips
+# pinned files, so a busy cache never deletes an image mid-download.
+
+PROXY_CACHE = Path("app/Data/cache/image_proxy")
+MAX_CACHE_BYTES = int(os.getenv("IMAGE_PROXY_CACHE_MB", "512")) * 1024 * 1024
+MAX_IMAGE_BYTES = 25 * 1024 * 1024
+FETCH_TIMEOUT = 30
+MAX_REDIRECTS = 5
+ALLOWED_HOSTS = [
+    h.strip().lower() for h in
+    os.getenv("IMAGE_PROXY_HOSTS", "replicate.delivery,i.ibb.co").split(",")
+    if h.strip()
+]
+PREFETCH = os.getenv("IMAGE_PROXY_PREFETCH", "0") == "1"
+
+# key -> size in bytes, least recently used first
+_index: OrderedDict[str, int] | None = None
+_total = 0
+_pins: dict[str, int] = {}  # key -> responses currently streaming it
+_lock = threading.Lock()
+_http = config.LoopClients("Image proxy", lambda: httpx.AsyncClient(timeout=FETCH_TIMEOUT, follow_redirects=False))
+_prefetches: set[asyncio.Task] = set()
+
+proxy_flight = SingleFlight("image_proxy")
+
+
+class ProxyError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def cache_key(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def host_allowed(url: str) -> bool:
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    if parsed.scheme not in ("http", "https") or not host:
+        return False
+    return any(host == h or host.endswith("." + h) for h in ALLOWED_HOSTS)
+
+
+# -------------------- LRU Index --------------------
+
+def _load_index():
+    global _index, _total
+    if _index is None:
+        PROXY_CACHE.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for meta in PROXY_CACHE.glob("*.json"):
+            body = meta.with_suffix(".bin")
+            if body.exists():
+                stat = body.stat()
+                entries.append((stat.st_atime, meta.stem, stat.st_size))
+        _index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        _total = sum(_index.values())
+
+
+def _pin(key: str) -> bool:
+    """Marks a cached image as in use; False when it is no longer cached."""
+    with _lock:
+        _load_index()
+        if key not in _index or not (PROXY_CACHE / f"{key}.bin").exists():
+            return False
+        _index.move_to_end(key)
+        _pins[key] = _pins.get(key, 0) + 1
+        return True
+
+
+def release_image(path: Path):
+    """Unpins an image returned by get_cached_image() once it has been sent."""
+    key = path.stem
+    with _lock:
+        if _pins.get(key, 0) > 1:
+            _pins[key] -= 1
+        else:
+            _pins.pop(key, None)
+        _evict()
+
+
+def _evict(keep: str = None):
+    # Called with _lock held; pinned files and `keep` are never evicted
+    global _total
+    for old in list(_index):
+        if _total <= MAX_CACHE_BYTES:
+            break
+        if old == keep or old in _pins:
+            continue
+        _total -= _index.pop(old)
+        (PROXY_CACHE / f"{old}.bin").unlink(missing_ok=True)
+        (PROXY_CACHE / f"{old}.json").unlink(missing_ok=True)
+
+
+def _add(key: str, size: int):
+    global _total
+    with _lock:
+        _load_index()
+        _total += size - _index.get(key, 0)
+        _index[key] = size
+        _index.move_to_end(key)
+        _evict(keep=key)
+
+
+def cache_stats() -> dict:
+    with _lock:
+        _load_index()
+        return {
+            "entries": len(_index),
+            "bytes": _total,
+            "max_bytes": MAX_CACHE_BYTES,
+            "fetches": proxy_flight.stats(),
+        }
+
+
+# -------------------- Fetching --------------------
+
+def _read_meta(key: str) -> dict | None:
+    meta = PROXY_CACHE / f"{key}.json"
+    if not meta.exists() or not (PROXY_CACHE / f"{key}.bin").exists():
+        return None
+    return json.loads(meta.read_text())
+
+
+async def _fetch(url: str, key: str) -> dict:
+    client = _http.get()
+    target = url
+
+    try:
+        for _ in range(MAX_REDIRECTS + 1):
+            response = await client.send(client.build_request("GET", target), stream=True)
+            try:
+                if response.is_redirect:
+                    target = urljoin(target, response.headers.get("location", ""))
+                    if not host_allowed(target):
+                        raise ProxyError(502, "Upstream redirected to a host that is not allowed")
+                    continue
+
+                if response.status_code != 200:
+                    raise ProxyError(502, f"Upstream returned HTTP {response.status_code}")
+                content_type = response.headers.get("content-type", "").split(";")[0].strip()
+                if not content_type.startswith("image/"):
+                    raise ProxyError(502, f"Upstream did not return an image ({content_type or 'no content type'})")
+
+                data = bytearray()
+                async for chunk in response.aiter_bytes(64 * 1024):
+                    data.extend(chunk)
+                    if len(data) > MAX_IMAGE_BYTES:
+                        raise ProxyError(502, "Image is larger than 25 MB")
+                break
+            finally:
+                await response.aclose()
+        else:
+            raise ProxyError(502, f"Upstream redirected more than {MAX_REDIRECTS} times")
+    except httpx.HTTPError as e:
+        raise ProxyError(502, f"Upstream fetch failed: {e}")
+
+    # The same bytes get the same ETag whichever URL they were fetched from
+    etag = f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+    meta = {"url": url, "content_type": content_type, "size": len(data), "etag": etag}
+
+    def store():
+        atomic_write_bytes(PROXY_CACHE / f"{key}.bin", bytes(data))
+        atomic_write_text(PROXY_CACHE / f"{key}.json", json.dumps(meta))
+        _add(key, len(data))
+
+    await anyio.to_thread.run_sync(store)
+    return meta
+
+
+async def get_cached_image(url: str) -> tuple[Path, dict]:
+    """
+    Returns (path, meta) for a proxied image, fetching it on a miss.
+    Concurrent misses for the same URL share one upstream fetch. The file
+    stays pinned until release_image(path) is called.
+    """
+    if not host_allowed(url):
+        raise ProxyError(400, "Host is not allowed for proxying")
+
+    key = cache_key(url)
+    for _ in range(3):
+        meta = await anyio.to_thread.run_sync(_read_meta, key)
+        if meta is None:
+            meta = await proxy_flight.ado(key, lambda: _fetch(url, key))
+        # Evicted again before we could pin it only when the cache is tiny
+        if _pin(key):
+            return PROXY_CACHE / f"{key}.bin", meta
+    raise ProxyError(503, "Image cache is too small to hold this image")
+
+
+# -------------------- Prefetch --------------------
+
+def schedule_prefetch(urls: list[str]):
+    """Warms the cache for freshly generated images in the background."""
+    if not PREFETCH:
+        return
+
+    async def prefetch(url):
+        try:
+            path, _ = await get_cached_image(url)
+            release_image(path)
+        except ProxyError as e:
+            print(f"Image prefetch skipped for {url}: {e.detail}")
+
+    for url in urls:
+        if url and host_allowed(url):
+            task = asyncio.create_task(prefetch(url))
+            _prefetches.add(task)
+            task.add_done_callback(_prefetches.discard)
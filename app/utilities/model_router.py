@@ -0,0 +1,197 @@
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from app.utilities.reference_snapshot import find_client
+from app.utilities.prompt_budget import count_tokens
+
+# -------------------- Model Catalogue --------------------
+# Prices are USD per 1M tokens. `sec_per_token` is the latency prior used
+# until a model has enough recent calls of its own; `max_posts` is the
+# largest batch the model returns as valid JSON reliably.
+
+MODEL_CATALOGUE = {
+    "gpt-4o-mini": {"context": 128_000, "max_output": 16_384, "input_cost": 0.15, "output_cost": 0.60, "sec_per_token": 0.012, "max_posts": 5},
+    "gpt-4o": {"context": 128_000, "max_output": 16_384, "input_cost": 2.50, "output_cost": 10.00, "sec_per_token": 0.020, "max_posts": 20},
+    "gpt-4": {"context": 8_192, "max_output": 8_192, "input_cost": 30.00, "output_cost": 60.00, "sec_per_token": 0.050, "max_posts": 8},
+}
+
+def _caption_models(value: str) -> list[str]:
+    models = [m.strip() for m in value.split(",") if m.strip()]
+    unknown = [m for m in models if m not in MODEL_CATALOGUE]
+    if unknown or not models:
+        raise ValueError(
+            f"CAPTION_MODELS={value!r} is invalid"
+            + (f" (unknown: {', '.join(unknown)})" if unknown else "")
+            + f"; choose one or more of: {', '.join(MODEL_CATALOGUE)}"
+        )
+    return models
+
+
+# Models allowed for caption generation, in order of preference
+CAPTION_MODELS = _caption_models(os.getenv("CAPTION_MODELS") or "gpt-4o-mini,gpt-4o,gpt-4")
+DEFAULT_SLO_MS = int(os.getenv("CAPTION_LATENCY_SLO_MS", "20000"))
+
+REQUEST_OVERHEAD_SEC = 0.8
+TOKENS_PER_POST = 180  # caption + hashtags + image_prompt
+WINDOW = 50            # calls kept per model
+MIN_SAMPLES = 5
+MAX_FAILURE_RATE = 0.5
+
+
+def estimate_tokens(text: str) -> int:
+    return count_tokens(text)
+
+
+def estimate_output_tokens(number_of_posts: int) -> int:
+    return 60 + TOKENS_PER_POST * number_of_posts
+
+
+# -------------------- Rolling Statistics --------------------
+
+class ModelStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = deque(maxlen=WINDOW)  # (latency_sec, ok, output_tokens, cost_usd)
+
+    def record(self, latency: float, ok: bool, output_tokens: int = 0, cost: float = 0.0):
+        self.calls.append((latency, ok, output_tokens, cost))
+
+    def failure_rate(self) -> float:
+        if not self.calls:
+            return 0.0
+        return sum(1 for c in self.calls if not c[1]) / len(self.calls)
+
+    def sec_per_token(self) -> float:
+        ok = [c for c in self.calls if c[1] and c[2]]
+        if len(ok) < MIN_SAMPLES:
+            return MODEL_CATALOGUE[self.name]["sec_per_token"]
+        return sum(max(c[0] - REQUEST_OVERHEAD_SEC, 0.0) for c in ok) / sum(c[2] for c in ok)
+
+    def predict_latency(self, output_tokens: int) -> float:
+        return REQUEST_OVERHEAD_SEC + self.sec_per_token() * output_tokens
+
+    def summary(self) -> dict:
+        latencies = sorted(c[0] for c in self.calls if c[1])
+        costs = [c[3] for c in self.calls if c[1]]
+        return {
+            "model": self.name,
+            "calls": len(self.calls),
+            "failure_rate": round(self.failure_rate(), 3),
+            "p50_latency_ms": round(latencies[len(latencies) // 2] * 1000) if latencies else None,
+            "p90_latency_ms": round(latencies[int(len(latencies) * 0.9)] * 1000) if latencies else None,
+            "avg_cost_usd": round(sum(costs) / len(costs), 6) if costs else None,
+        }
+
+
+_stats = {name: ModelStats(name) for name in MODEL_CATALOGUE}
+_decisions = deque(maxlen=100)
+_lock = threading.Lock()
+
+
+def estimate_cost(model: str, prompt_tokens: int, output_tokens: int) -> float:
+    spec = MODEL_CATALOGUE[model]
+    return (prompt_tokens * spec["input_cost"] + output_tokens * spec["output_cost"]) / 1_000_000
+
+
+# -------------------- Routing --------------------
+
+def _client_slo_ms(client_id: str | None) -> int:
+    entry = find_client(client_id) if client_id else None
+    slo = (entry or {}).get("profile", {}).get("latency_slo_ms")
+    return int(slo) if slo else DEFAULT_SLO_MS
+
+
+def plan_route(prompt: str, number_of_posts: int, client_id: str | None = None) -> dict:
+    """
+    Orders the configured models for one caption call. Models that cannot
+    fit the prompt and expected completion, or are not reliable for this
+    many posts, are left out. The rest are ordered so that models predicted
+    to meet the client's latency SLO come first, cheapest first; then the
+    others, fastest first. Models failing more than half of their recent
+    calls go last.
+    """
+    prompt_tokens = estimate_tokens(prompt)
+    output_tokens = estimate_output_tokens(number_of_posts)
+    slo_sec = _client_slo_ms(client_id) / 1000
+
+    candidates = []
+    with _lock:
+        for name in CAPTION_MODELS:
+            spec = MODEL_CATALOGUE[name]
+            if prompt_tokens + output_tokens > spec["context"] or output_tokens > spec["max_output"]:
+                continue
+            if number_of_posts > spec["max_posts"]:
+                continue
+            stats = _stats[name]
+            candidates.append({
+                "model": name,
+                "predicted_latency_ms": round(stats.predict_latency(output_tokens) * 1000),
+                "estimated_cost_usd": round(estimate_cost(name, prompt_tokens, output_tokens), 6),
+                "failure_rate": round(stats.failure_rate(), 3),
+            })
+
+    if not candidates:
+        # Nothing claims to handle this size; fall back to the largest-output model
+        name = max(CAPTION_MODELS, key=lambda m: MODEL_CATALOGUE[m]["max_posts"])
+        candidates.append({"model": name, "predicted_latency_ms": None, "estimated_cost_usd": None, "failure_rate": None})
+
+    def order(c):
+        unhealthy = (c["failure_rate"] or 0) > MAX_FAILURE_RATE
+        meets_slo = c["predicted_latency_ms"] is not None and c["predicted_latency_ms"] <= slo_sec * 1000
+        if meets_slo:
+            return (unhealthy, 0, c["estimated_cost_usd"])
+        return (unhealthy, 1, c["predicted_latency_ms"] or 0)
+
+    candidates.sort(key=order)
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "client_id": client_id,
+        "number_of_posts": number_of_posts,
+        "prompt_tokens_est": prompt_tokens,
+        "output_tokens_est": output_tokens,
+        "latency_slo_ms": int(slo_sec * 1000),
+        "candidates": candidates,
+        "attempts": [],
+    }
+
+
+def max_tokens_for(model: str, number_of_posts: int) -> int:
+    # Leave headroom over the estimate so long batches are not cut off mid-JSON
+    budget = max(600, int(estimate_output_tokens(number_of_posts) * 1.5))
+    return min(budget, MODEL_CATALOGUE[model]["max_output"])
+
+
+def record_attempt(decision: dict, model: str, started: float, ok: bool, usage=None, error: str = None):
+    latency = time.perf_counter() - started
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    cost = estimate_cost(model, prompt_tokens, completion_tokens) if usage else 0.0
+
+    with _lock:
+        _stats[model].record(latency, ok, completion_tokens, cost)
+        decision["attempts"].append({
+            "model": model,
+            "ok": ok,
+            "latency_ms": round(latency * 1000),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost_usd": round(cost, 6),
+            "error": error,
+        })
+
+
+def finish_decision(decision: dict):
+    ok = [a for a in decision["attempts"] if a["ok"]]
+    decision["chosen"] = ok[-1]["model"] if ok else None
+    with _lock:
+        _decisions.append(decision)
+
+
+def routing_report() -> dict:
+    with _lock:
+        return {
+            "models": [_stats[name].summary() for name in CAPTION_MODELS],
+            "recent_decisions": list(_decisions)[::-1],
+        }
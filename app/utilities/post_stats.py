@@ -0,0 +1,241 @@
+import copy
+import heapq
+import json
+import sys
+import threading
+from contextlib import contextmanager
+from app.utilities.post_store import POSTS_PATH, POSTS_LOCK, iter_post_rows, is_finalized
+from app.utilities.post_writer import flush_posts
+from app.utilities.csv_io import atomic_write_text, file_lock
+
+# -------------------- Storage --------------------
+# Per-client aggregates live in a compacted snapshot (stats.json) plus an
+# append-only log of changes since it (stats.log). A post write appends one
+# line, so its cost does not grow with the history; every COMPACT_EVERY
+# lines the log is folded into a new snapshot. Each process keeps the
+# aggregates in memory and replays only the log lines it has not seen.
+#
+# Writers from every worker sharing the volume are serialized with an
+# exclusive lock on stats.lock; readers take it shared. Log lines carry
+# the snapshot generation they apply to, so lines left over from an
+# interrupted compaction are ignored.
+
+STATS_JSON = POSTS_PATH / "stats.json"
+STATS_LOG = POSTS_PATH / "stats.log"
+STATS_LOCK_FILE = POSTS_PATH / "stats.lock"
+COMPACT_EVERY = 1000
+
+_lock = threading.Lock()
+_stats: dict | None = None
+_snapshot_mtime: int | None = None
+_log_offset = 0
+_log_lines = 0
+
+
+def _empty_client() -> dict:
+    return {
+        "total": 0,
+        "finalized": 0,
+        "hashtags": {},
+        "topics": {},
+        "posts_by_month": {},
+        "topics_by_month": {},
+    }
+
+
+@contextmanager
+def _locked(exclusive: bool):
+    """Thread lock plus a cross-process file lock; callers never nest it."""
+    with _lock, file_lock(STATS_LOCK_FILE, exclusive):
+        yield
+
+
+def _refresh() -> dict:
+    """
+    Brings the in-memory stats up to date: re-reads the snapshot when
+    another process compacted it, then replays unseen log lines.
+    """
+    global _stats, _snapshot_mtime, _log_offset, _log_lines
+    mtime = STATS_JSON.stat().st_mtime_ns if STATS_JSON.exists() else None
+    if _stats is None or mtime != _snapshot_mtime:
+        _stats = json.loads(STATS_JSON.read_text()) if mtime else {"clients": {}}
+        _stats.setdefault("generation", 0)
+        _snapshot_mtime, _log_offset, _log_lines = mtime, 0, 0
+
+    if not STATS_LOG.exists():
+        return _stats
+    with open(STATS_LOG, "rb") as f:
+        f.seek(_log_offset)
+        pending = f.read()
+    complete = pending[:pending.rfind(b"\n") + 1]
+    for raw in complete.splitlines():
+        _log_lines += 1
+        try:
+            entry = json.loads(raw)
+        except json.JSONDecodeError:
+            continue  # torn line from a crash
+        if entry.get("g") == _stats["generation"]:
+            _apply_ops(_stats, entry["ops"])
+    _log_offset += len(complete)
+    return _stats
+
+
+def _write_snapshot(stats: dict):
+    """Replaces the snapshot and starts an empty log for its generation."""
+    global _stats, _snapshot_mtime, _log_offset, _log_lines
+    stats["generation"] = stats.get("generation", 0) + 1
+    atomic_write_text(STATS_JSON, json.dumps(stats))
+    with open(STATS_LOG, "w"):
+        pass
+    _stats, _snapshot_mtime, _log_offset, _log_lines = stats, STATS_JSON.stat().st_mtime_ns, 0, 0
+
+
+def _record(ops: list):
+    """Applies ops in memory and appends them to the log as one line."""
+    global _log_offset, _log_lines
+    if not ops:
+        return
+    with _locked(exclusive=True):
+        stats = _refresh()
+        _apply_ops(stats, ops)
+        line = (json.dumps({"g": stats["generation"], "ops": ops}) + "\n").encode()
+        with open(STATS_LOG, "ab") as f:
+            f.write(line)
+        _log_offset += len(line)
+        _log_lines += 1
+        if _log_lines >= COMPACT_EVERY:
+            _write_snapshot(stats)
+
+
+# -------------------- Incremental Updates --------------------
+
+def _split(value) -> list[str]:
+    if isinstance(value, list):
+        return [v.strip() for v in value if v and v.strip()]
+    return [v.strip() for v in str(value or "").split(",") if v.strip()]
+
+
+def _bump(counter: dict, key: str, delta: int):
+    counter[key] = counter.get(key, 0) + delta
+    if counter[key] <= 0:
+        del counter[key]
+
+
+def _apply(stats: dict, row: dict, delta: int):
+    client = stats["clients"].setdefault(row.get("client_id") or "", _empty_client())
+    month = (row.get("created_at") or "")[:7] or "unknown"
+
+    client["total"] += delta
+    if is_finalized(row):
+        client["finalized"] += delta
+    _bump(client["posts_by_month"], month, delta)
+
+    for tag in _split(row.get("hashtags")):
+        _bump(client["hashtags"], tag, delta)
+
+    month_topics = client["topics_by_month"].setdefault(month, {})
+    for topic in _split(row.get("topics")):
+        _bump(client["topics"], topic, delta)
+        _bump(month_topics, topic, delta)
+    if not month_topics:
+        del client["topics_by_month"][month]
+
+
+_STAT_FIELDS = ("client_id", "created_at", "finalized", "hashtags", "topics")
+
+
+def _row_op(row: dict, delta: int) -> list:
+    return [delta, {k: row.get(k) for k in _STAT_FIELDS}]
+
+
+def _apply_ops(stats: dict, ops: list):
+    for kind, value in ops:
+        if kind == "finalized":
+            client = stats["clients"].setdefault(value or "", _empty_client())
+            client["finalized"] += 1
+        else:
+            _apply(stats, value, kind)
+
+
+def record_post(row: dict):
+    _record([_row_op(row, +1)])
+
+
+def record_changes(added: list[dict] = (), removed: list[dict] = ()):
+    """
+    Applies a whole batch of post writes (e.g. a batch delete or update)
+    as a single log line.
+    """
+    _record([_row_op(row, -1) for row in removed] + [_row_op(row, +1) for row in added])
+
+
+def record_finalized(rows: list[dict]):
+    """
+    Counts posts that just moved from draft to finalized. Callers pass only
+    the rows whose finalized flag actually changed.
+    """
+    _record([["finalized", row.get("client_id") or ""] for row in rows])
+
+
+# -------------------- Queries --------------------
+
+def _summary(client_id: str, client: dict) -> dict:
+    return {
+        "client_id": client_id,
+        "total_posts": client["total"],
+        "finalized_posts": client["finalized"],
+        "finalized_ratio": round(client["finalized"] / client["total"], 4) if client["total"] else 0.0,
+    }
+
+
+def get_all_stats() -> list[dict]:
+    with _locked(exclusive=False):
+        clients = _refresh()["clients"]
+        return [_summary(cid, c) for cid, c in clients.items() if c["total"] > 0]
+
+
+def get_client_stats(client_id: str, top_n: int = 10) -> dict | None:
+    # Built and deep-copied under the lock: the response is serialized after
+    # it is released, while other requests keep updating these counters
+    with _locked(exclusive=False):
+        client = _refresh()["clients"].get(client_id)
+        if not client or client["total"] <= 0:
+            return None
+        top_hashtags = heapq.nlargest(top_n, client["hashtags"].items(), key=lambda kv: kv[1])
+        return copy.deepcopy({
+            **_summary(client_id, client),
+            "top_hashtags": [{"hashtag": t, "count": n} for t, n in top_hashtags],
+            "topic_usage": client["topics"],
+            "posts_by_month": dict(sorted(client["posts_by_month"].items())),
+            "topics_by_month": dict(sorted(client["topics_by_month"].items())),
+        })
+
+
+# -------------------- Full Rebuild --------------------
+
+def rebuild_stats() -> int:
+    """
+    Recomputes every aggregate from the posts store. Used for backfills or
+    after the CSV was edited by hand. Returns the number of posts scanned.
+
+    Post writes in this process are held off for the duration (they record
+    stats under POSTS_LOCK too), and other workers' stat writes wait on the
+    stats lock, so nothing recorded during the scan is lost or counted twice.
+    """
+    with POSTS_LOCK, _locked(exclusive=True):
+        flush_posts()
+        rebuilt = {"clients": {}, "generation": (_refresh()).get("generation", 0)}
+        scanned = 0
+        for row in iter_post_rows():
+            _apply(rebuilt, row, +1)
+            scanned += 1
+        _write_snapshot(rebuilt)
+    return scanned
+
+
+if __name__ == "__main__":
+    # python -m app.utilities.post_stats rebuild
+    if sys.argv[1:] != ["rebuild"]:
+        print("usage: python -m app.utilities.post_stats rebuild")
+        sys.exit(1)
+    print(f"Rebuilt stats from {rebuild_stats()} posts -> {STATS_JSON}")
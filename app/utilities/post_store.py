@@ -0,0 +1,323 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+from app.utilities.csv_io import atomic_write_csv, atomic_write_text, file_lock
+
+# -------------------- Paths --------------------
+# Posts are partitioned by client_id (and, with POST_SHARD_BY_MONTH=1, by
+# the month they were created in). Each shard is a small CSV under
+#   <volume>/<client_id>/<shard_key>.csv
+# and manifest.json records which volume each client lives on and which
+# shards exist, so per-client work never touches another client's file.
+#
+# POST_SHARD_VOLUMES is a comma-separated list of root directories; new
+# clients are spread across them by hash. Defaults to app/Data/posts/shards.
+
+POSTS_PATH = Path("app/Data/posts")
+POSTS_CSV = POSTS_PATH / "management.csv"  # legacy single-file store
+MANIFEST_PATH = POSTS_PATH / "manifest.json"
+MANIFEST_LOCK = POSTS_PATH / "manifest.lock"
+
+POST_FIELDNAMES = [
+    "post_id", "client_id", "category_id", "topics",
+    "caption", "hashtags", "image_url", "finalized", "created_at"
+]
+
+SHARD_VOLUMES = [
+    Path(v.strip()) for v in os.getenv("POST_SHARD_VOLUMES", "").split(",") if v.strip()
+] or [POSTS_PATH / "shards"]
+SHARD_BY_MONTH = os.getenv("POST_SHARD_BY_MONTH", "0") == "1"
+ALL_KEY = "all"
+
+# Held by anything that appends to or rewrites post shards, so a group
+# flush can never land between another writer's read and its rewrite.
+# Shard and manifest writes also hold a lock on manifest.lock (see
+# _exclusive) so workers sharing the volume are serialized too.
+POSTS_LOCK = threading.RLock()
+_file_lock_depth = 0
+
+_manifest: dict | None = None
+_manifest_mtime: int | None = None
+
+
+# -------------------- Helpers --------------------
+
+def _mtime(path: Path) -> int | None:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _created_on(row: dict) -> Optional[date]:
+    try:
+        return datetime.fromisoformat(row.get("created_at") or "").date()
+    except ValueError:
+        return None
+
+
+def is_finalized(row: dict) -> bool:
+    return str(row.get("finalized", "False")).strip().lower() == "true"
+
+
+def _shard_key(row: dict) -> str:
+    if not SHARD_BY_MONTH:
+        return ALL_KEY
+    created = _created_on(row)
+    return created.strftime("%Y-%m") if created else "unknown"
+
+
+def _is_month_key(key: str) -> bool:
+    # Shards written before POST_SHARD_BY_MONTH was enabled are keyed "all",
+    # and rows without a usable created_at go to "unknown"
+    return re.fullmatch(r"\d{4}-\d{2}", key) is not None
+
+
+def _month_from_post_id(post_id: str) -> Optional[str]:
+    # POST-YYYYMMDD-XXXXXX ids carry their creation date
+    match = re.match(r"POST-(\d{4})(\d{2})\d{2}-", post_id or "")
+    return f"{match.group(1)}-{match.group(2)}" if match else None
+
+
+def _client_dir_name(client_id: str) -> str:
+    return re.sub(r"[^\w.-]", "_", client_id) or "_unassigned"
+
+
+def _pick_volume(client_id: str) -> Path:
+    digest = int(hashlib.md5(client_id.encode()).hexdigest(), 16)
+    return SHARD_VOLUMES[digest % len(SHARD_VOLUMES)]
+
+
+# -------------------- Manifest --------------------
+
+@contextmanager
+def _exclusive():
+    """
+    POSTS_LOCK plus the cross-process manifest lock. Re-entrant within the
+    thread holding it, like POSTS_LOCK itself.
+    """
+    global _file_lock_depth
+    with POSTS_LOCK, (nullcontext() if _file_lock_depth else file_lock(MANIFEST_LOCK)):
+        _file_lock_depth += 1
+        try:
+            yield
+        finally:
+            _file_lock_depth -= 1
+
+
+def _load_manifest() -> dict:
+    """
+    Returns the manifest, re-reading it only when another process rewrote
+    it. The first call after an upgrade splits the legacy management.csv.
+    """
+    global _manifest, _manifest_mtime
+    mtime = _mtime(MANIFEST_PATH)
+    if mtime is None and POSTS_CSV.exists():
+        with _exclusive():
+            if not MANIFEST_PATH.exists() and POSTS_CSV.exists():
+                _manifest = {"clients": {}}
+                _migrate_legacy_csv()
+        mtime = _mtime(MANIFEST_PATH)
+
+    if _manifest is None or mtime != _manifest_mtime:
+        if mtime:
+            _manifest = json.loads(MANIFEST_PATH.read_text())
+        else:
+            _manifest = {"clients": {}}
+        _manifest_mtime = mtime
+    return _manifest
+
+
+def _save_manifest():
+    global _manifest_mtime
+    atomic_write_text(MANIFEST_PATH, json.dumps(_manifest, indent=2))
+    _manifest_mtime = _mtime(MANIFEST_PATH)
+
+
+def _client_entry(client_id: str) -> dict:
+    clients = _manifest["clients"]
+    if client_id not in clients:
+        clients[client_id] = {"volume": str(_pick_volume(client_id)), "shards": {}}
+    return clients[client_id]
+
+
+def _shard_path(client_id: str, key: str) -> Path:
+    volume = Path(_manifest["clients"][client_id]["volume"])
+    return volume / _client_dir_name(client_id) / f"{key}.csv"
+
+
+def _migrate_legacy_csv():
+    with open(POSTS_CSV, "r", newline="", encoding="utf-8") as f:
+        _append_grouped(csv.DictReader(f), fsync=True)
+    _save_manifest()
+    POSTS_CSV.rename(POSTS_CSV.with_suffix(".csv.migrated"))
+    print(f"Migrated {POSTS_CSV} into per-client shards")
+
+
+# -------------------- Writing --------------------
+
+def _append_grouped(rows, fsync: bool):
+    groups: dict[tuple[str, str], list[dict]] = {}
+    for row in rows:
+        client_id = row.get("client_id") or ""
+        groups.setdefault((client_id, _shard_key(row)), []).append(row)
+
+    for (client_id, key), group in groups.items():
+        entry = _client_entry(client_id)
+        path = _shard_path(client_id, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=POST_FIELDNAMES, extrasaction="ignore")
+        if not path.exists():
+            writer.writeheader()
+        writer.writerows(group)
+
+        with open(path, "a", newline="", encoding="utf-8") as f:
+            f.write(buffer.getvalue())
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        entry["shards"][key] = entry["shards"].get(key, 0) + len(group)
+
+
+def append_rows(rows: list[dict], fsync: bool = True):
+    """
+    Appends rows to their client shards with one write per shard, then
+    records the new row counts in the manifest.
+    """
+    with _exclusive():
+        _load_manifest()
+        _append_grouped(rows, fsync)
+        _save_manifest()
+
+
+def rewrite_posts(
+    transform: Callable[[dict], Optional[dict]],
+    post_ids: list[str],
+    client_id: Optional[str] = None,
+) -> tuple[list[tuple[dict, Optional[dict]]], dict[str, dict]]:
+    """
+    Applies `transform` to every post in `post_ids` and atomically rewrites
+    only the shards that changed. `transform` returns the new row, or None to
+    delete it. With a client_id only that client's shards are read; month
+    shards older than the date in the post ids are skipped (a post's
+    created_at is never earlier than its id, but may fall in a later month).
+
+    Returns (changes, found): changes is a list of (old_row, new_row or None)
+    for rows that actually changed, found maps each matched post_id to its
+    resulting row.
+    """
+    wanted = set(post_ids)
+    months = [_month_from_post_id(pid) for pid in wanted]
+    first_month = None if None in months else min(months, default=None)
+    changes, found = [], {}
+
+    with _exclusive():
+        for cid, key, path in shard_files(client_id):
+            if first_month and _is_month_key(key) and key < first_month:
+                continue
+
+            with open(path, "r", newline="", encoding="utf-8") as f:
+                rows = list(csv.DictReader(f))
+            if not any(r["post_id"] in wanted for r in rows):
+                continue
+
+            kept, shard_changes = [], []
+            for row in rows:
+                if row["post_id"] not in wanted:
+                    kept.append(row)
+                    continue
+                new_row = transform(dict(row))
+                found[row["post_id"]] = new_row if new_row is not None else row
+                if new_row is not None:
+                    kept.append(new_row)
+                if new_row != row:
+                    shard_changes.append((row, new_row))
+
+            if shard_changes:
+                _atomic_write(path, kept)
+                _manifest["clients"][cid]["shards"][key] = len(kept)
+                changes.extend(shard_changes)
+
+        if changes:
+            _save_manifest()
+
+    return changes, found
+
+
+def _atomic_write(path: Path, rows: list[dict]):
+    atomic_write_csv(path, POST_FIELDNAMES, rows)
+
+
+# -------------------- Reading --------------------
+
+def shard_files(client_id: Optional[str] = None) -> list[tuple[str, str, Path]]:
+    """Lists (client_id, shard_key, path) for one client or for all clients."""
+    with POSTS_LOCK:
+        manifest = _load_manifest()
+        client_ids = [client_id] if client_id else list(manifest["clients"])
+        files = []
+        for cid in client_ids:
+            entry = manifest["clients"].get(cid)
+            if not entry:
+                continue
+            for key in sorted(entry["shards"]):
+                path = _shard_path(cid, key)
+                if path.exists():
+                    files.append((cid, key, path))
+        return files
+
+
+def has_posts() -> bool:
+    with POSTS_LOCK:
+        return any(
+            count > 0
+            for entry in _load_manifest()["clients"].values()
+            for count in entry["shards"].values()
+        )
+
+
+def iter_post_rows(
+    client_id: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    finalized: Optional[bool] = None,
+) -> Iterator[dict]:
+    """
+    Yields post rows that match every given filter. With a client_id only
+    that client's shards are opened; otherwise shards are read one after
+    another, so memory stays flat however many clients there are. Date
+    bounds are inclusive and compared against created_at.
+    """
+    first_month = date_from.strftime("%Y-%m") if date_from else None
+    last_month = date_to.strftime("%Y-%m") if date_to else None
+
+    for _, key, path in shard_files(client_id):
+        if _is_month_key(key):
+            if (first_month and key < first_month) or (last_month and key > last_month):
+                continue
+
+        with open(path, "r", newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                if client_id and row.get("client_id") != client_id:
+                    continue
+                if finalized is not None and is_finalized(row) != finalized:
+                    continue
+                if date_from or date_to:
+                    created = _created_on(row)
+                    if created is None:
+                        continue
+                    if date_from and created < date_from:
+                        continue
+                    if date_to and created > date_to:
+                        continue
+                yield {field: row.get(field) or "" for field in POST_FIELDNAMES}
@@ -0,0 +1,179 @@
+import functools
+import json
+import os
+import threading
+import uuid
+from pathlib import Path
+from app.utilities.csv_io import lock_file
+from app.utilities.etags import bump_version
+from app.utilities.post_store import POSTS_PATH, POST_FIELDNAMES, POSTS_LOCK, append_rows, iter_post_rows
+
+# -------------------- Settings --------------------
+# Post rows are buffered and appended to their shards in groups: when the
+# buffer reaches POST_WRITE_BATCH_SIZE, when POST_WRITE_MAX_DELAY_MS passes,
+# or when a request completes and calls flush_posts(). Every row is first
+# appended to a per-process journal so a crash before the group is written
+# loses nothing; recover_posts() replays orphaned journals on start-up.
+#
+# Each journal is named with a random id and holds an exclusive lock for
+# the life of its process. The kernel drops the lock when the process dies,
+# so a journal whose lock can be taken is orphaned. Unlike PID checks this
+# holds across containers sharing the data volume and across PID reuse.
+#
+# POST_WRITE_FSYNC:
+#   "batch"  - fsync the journal on every append and the CSV once per
+#              group (default)
+#   "always" - also write each row to its shard right away, not in groups
+#   "off"    - leave durability to the OS page cache
+
+BATCH_SIZE = int(os.getenv("POST_WRITE_BATCH_SIZE", "50"))
+MAX_DELAY = int(os.getenv("POST_WRITE_MAX_DELAY_MS", "200")) / 1000
+FSYNC_MODE = os.getenv("POST_WRITE_FSYNC", "batch").lower()
+
+JOURNAL_DIR = POSTS_PATH / "journal"
+
+
+class PostWriteBuffer:
+    def __init__(self, journal_dir: Path):
+        self.journal_dir = journal_dir
+        self.journal_path: Path | None = None
+        self.pending: list[dict] = []
+        self.timer: threading.Timer | None = None
+        self.lock = threading.Lock()
+        self.journal = None
+
+    # ---------- journal ----------
+
+    def _open_journal(self):
+        if self.journal is None:
+            # Opened lazily so forked workers each get their own journal.
+            # It is locked under a name recover() ignores and only then
+            # renamed into place, so it is never seen unlocked.
+            self.journal_dir.mkdir(parents=True, exist_ok=True)
+            name = f"journal-{uuid.uuid4().hex}.ndjson"
+            staging = self.journal_dir / f".{name}"
+            journal = open(staging, "a", encoding="utf-8")
+            lock_file(journal, blocking=False)
+            os.replace(staging, self.journal_dir / name)
+            self.journal, self.journal_path = journal, self.journal_dir / name
+
+    def _reset_journal(self):
+        if self.journal is not None:
+            self.journal.truncate(0)
+            self.journal.seek(0)
+
+    # ---------- public API ----------
+
+    def append(self, record: dict):
+        row = {field: record.get(field, "") for field in POST_FIELDNAMES}
+        with self.lock:
+            self._open_journal()
+            self.journal.write(json.dumps(row, default=str) + "\n")
+            self.journal.flush()
+            if FSYNC_MODE != "off":
+                os.fsync(self.journal.fileno())
+
+            self.pending.append(row)
+            if len(self.pending) < BATCH_SIZE and FSYNC_MODE != "always":
+                self._schedule()
+                return
+
+        self.flush()
+
+    def flush(self):
+        """
+        Writes every buffered row with a single append. Safe to call at any
+        time; a no-op when nothing is pending.
+        """
+        with POSTS_LOCK, self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.pending:
+                return
+
+            append_rows(self.pending, fsync=FSYNC_MODE != "off")
+            self.pending = []
+            self._reset_journal()
+
+        bump_version("posts")
+
+    def recover(self):
+        """
+        Replays journals whose process is gone (their lock is free), skipping
+        rows their shards already contain.
+        """
+        if not self.journal_dir.exists():
+            return
+
+        leftovers = []
+        stale = []
+        try:
+            for journal in self.journal_dir.glob("journal-*.ndjson"):
+                if journal == self.journal_path:
+                    continue  # our own live journal
+                try:
+                    f = open(journal, "r", encoding="utf-8")
+                except FileNotFoundError:
+                    continue  # another process recovered it first
+                if not lock_file(f, blocking=False):
+                    f.close()
+                    continue  # its process is still running
+                stale.append((journal, f))
+                for line in f.read().splitlines():
+                    try:
+                        leftovers.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        pass  # torn final line from the crash
+
+            with POSTS_LOCK:
+                if leftovers:
+                    existing = set()
+                    for client_id in {row.get("client_id") or "" for row in leftovers}:
+                        existing.update(row["post_id"] for row in iter_post_rows(client_id=client_id))
+                    missing = [row for row in leftovers if row.get("post_id") not in existing]
+                    if missing:
+                        append_rows(missing, fsync=FSYNC_MODE != "off")
+                        print(f"Recovered {len(missing)} post(s) from the write journal")
+                for journal, _ in stale:
+                    journal.unlink(missing_ok=True)
+        finally:
+            for _, f in stale:
+                f.close()
+
+    # ---------- internals ----------
+
+    def _schedule(self):
+        if self.timer is None:
+            self.timer = threading.Timer(MAX_DELAY, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+
+post_write_buffer = PostWriteBuffer(JOURNAL_DIR)
+
+
+def recover_posts():
+    """Replays orphaned write journals; called once at application start-up."""
+    post_write_buffer.recover()
+
+
+def buffer_post(record: dict):
+    post_write_buffer.append(record)
+
+
+def flush_posts():
+    post_write_buffer.flush()
+
+
+def exclusive_posts(handler):
+    """
+    Wraps a route that reads and rewrites post shards: pending rows are
+    flushed first and no group flush can interleave with the rewrite.
+    """
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        with POSTS_LOCK:
+            flush_posts()
+            return handler(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,191 @@
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import parse_qs
+import anyio
+
+# -------------------- Settings --------------------
+# A request is profiled when it carries the admin token in an X-Profile
+# header or a ?profile= query parameter, or when it falls in the
+# PROFILE_SAMPLE_RATE fraction of requests. With neither a token nor a
+# sample rate configured the middleware passes requests straight through.
+#
+# The profiler samples the Python stacks of every thread in the process
+# every PROFILE_INTERVAL_MS while the request runs, so time spent in
+# threadpool handlers and anyio.to_thread helpers is captured as well as
+# the event loop. Concurrent requests show up in the same samples.
+
+PROFILE_DIR = Path("app/Data/profiles")
+ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+INTERVAL = int(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+ENABLED = bool(ADMIN_TOKEN) or SAMPLE_RATE > 0
+
+EXCLUDED_PREFIXES = ("/profiles",)
+
+# Innermost frames of threads that are only waiting for work
+IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+}
+
+
+def token_matches(token: str | None) -> bool:
+    return bool(ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+# -------------------- Sampler --------------------
+
+class StackSampler(threading.Thread):
+    def __init__(self, interval: float):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def _top_functions(stacks: Counter, n: int = 25) -> list[dict]:
+    own, total = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    return [
+        {"function": name, "own_samples": own[name], "total_samples": total[name]}
+        for name, _ in total.most_common(n)
+    ]
+
+
+def save_profile(profile_id: str, meta: dict, sampler: StackSampler):
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    meta.update(
+        samples=sampler.samples,
+        interval_ms=int(sampler.interval * 1000),
+        top_functions=_top_functions(sampler.stacks),
+    )
+    # Folded stacks load directly into speedscope or flamegraph.pl
+    folded = "".join(f"{stack} {count}\n" for stack, count in sampler.stacks.most_common())
+    (PROFILE_DIR / f"{profile_id}.folded").write_text(folded)
+    (PROFILE_DIR / f"{profile_id}.json").write_text(json.dumps(meta, indent=2))
+    _enforce_retention()
+
+
+def _enforce_retention():
+    metas = sorted(PROFILE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in metas[KEEP:]:
+        old.unlink(missing_ok=True)
+        old.with_suffix(".folded").unlink(missing_ok=True)
+
+
+def list_profiles() -> list[dict]:
+    if not PROFILE_DIR.exists():
+        return []
+    metas = sorted(PROFILE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    profiles = []
+    for path in metas:
+        meta = json.loads(path.read_text())
+        meta.pop("top_functions", None)
+        profiles.append(meta)
+    return profiles
+
+
+def profile_paths(profile_id: str) -> tuple[Path, Path] | None:
+    if not profile_id.replace("-", "").isalnum():
+        return None
+    meta, folded = PROFILE_DIR / f"{profile_id}.json", PROFILE_DIR / f"{profile_id}.folded"
+    return (meta, folded) if meta.exists() and folded.exists() else None
+
+
+# -------------------- Middleware --------------------
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware, so responses are streamed through untouched."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _trigger(self, scope) -> str | None:
+        if scope["path"].startswith(EXCLUDED_PREFIXES):
+            return None
+        if ADMIN_TOKEN:
+            for name, value in scope["headers"]:
+                if name == b"x-profile":
+                    return "header" if token_matches(value.decode("latin-1")) else None
+            query = scope.get("query_string", b"")
+            if b"profile=" in query:
+                token = parse_qs(query.decode("latin-1")).get("profile", [None])[0]
+                return "query" if token_matches(token) else None
+        if SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if not ENABLED or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        trigger = self._trigger(scope)
+        if trigger is None:
+            return await self.app(scope, receive, send)
+
+        profile_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        status = {"code": None}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        sampler = StackSampler(INTERVAL)
+        started_at = datetime.now().isoformat()
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            sampler.stop()
+            meta = {
+                "id": profile_id,
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status["code"],
+                "trigger": trigger,
+                "started_at": started_at,
+                "wall_ms": round((time.perf_counter() - started) * 1000, 1),
+                "process_cpu_ms": round((time.process_time() - cpu_started) * 1000, 1),
+            }
+            await anyio.to_thread.run_sync(save_profile, profile_id, meta, sampler)
+            print(f"Profiled {scope['method']} {scope['path']} -> {profile_id}")
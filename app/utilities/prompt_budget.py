@@ -0,0 +1,115 @@
+import os
+import re
+import threading
+
+# -------------------- Settings --------------------
+# Prompts are measured with the model tokenizer (tiktoken, o200k_base as
+# used by the gpt-4o family). When tiktoken or its vocabulary file is not
+# available the count falls back to ~4 characters per token.
+#
+# PROMPT_TOKEN_BUDGET caps the input prompt; optional sections are trimmed,
+# lowest priority first, until the prompt fits.
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2500"))
+TOKENIZER_ENCODING = os.getenv("PROMPT_TOKENIZER", "o200k_base")
+MIN_SECTION_TOKENS = 24  # below this a trimmed section is dropped instead
+CACHE_SIZE = 2048
+
+_encoding = None
+_encoding_loaded = False
+_counts: dict = {}
+_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            print(f"tiktoken unavailable ({type(e).__name__}), estimating tokens from length")
+    return _encoding
+
+
+def count_tokens(text: str, cache_key=None) -> int:
+    """
+    Token count of `text`. With a cache_key (e.g. client, profile version and
+    section name) the count is computed once and reused.
+    """
+    if cache_key is not None and cache_key in _counts:
+        return _counts[cache_key]
+
+    encoding = _get_encoding()
+    count = len(encoding.encode(text)) if encoding else max(1, len(text) // 4)
+
+    if cache_key is not None:
+        with _lock:
+            if len(_counts) >= CACHE_SIZE:
+                _counts.pop(next(iter(_counts)))
+            _counts[cache_key] = count
+    return count
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """Cuts `text` to at most `max_tokens`, preferring a sentence or word end."""
+    encoding = _get_encoding()
+    if encoding:
+        tokens = encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        cut = encoding.decode(tokens[:max_tokens - 1])
+    else:
+        if len(text) // 4 <= max_tokens:
+            return text
+        cut = text[:(max_tokens - 1) * 4]
+
+    sentence_end = max(cut.rfind(". "), cut.rfind(".\n"), cut.rfind("\n"))
+    if sentence_end > len(cut) * 0.6:
+        cut = cut[:sentence_end + 1]
+    else:
+        cut = re.sub(r"\s+\S*$", "", cut)
+    return cut.rstrip() + " …"
+
+
+# -------------------- Fitting Sections --------------------
+
+def fit_sections(sections: list[tuple[str, int | None, str, object]], budget: int = None) -> tuple[str, dict]:
+    """
+    Joins prompt sections, trimming optional ones to fit the token budget.
+
+    Each section is (name, priority, text, cache_key). Priority None means
+    required; otherwise higher numbers are trimmed first. Returns the prompt
+    and a report of per-section token counts and what was trimmed.
+    """
+    budget = budget or PROMPT_TOKEN_BUDGET
+    texts = {name: text for name, _, text, _ in sections}
+    counts = {name: count_tokens(text, cache_key) for name, _, text, cache_key in sections}
+    trimmed = {}
+
+    overflow = sum(counts.values()) - budget
+    optional = sorted((s for s in sections if s[1] is not None), key=lambda s: -s[1])
+    for name, _, text, _ in optional:
+        if overflow <= 0:
+            break
+        allowance = counts[name] - overflow
+        original = counts[name]
+        if allowance < MIN_SECTION_TOKENS:
+            texts[name], counts[name] = "", 0
+        else:
+            texts[name] = trim_to_tokens(text, allowance) + ("\n" if text.endswith("\n") else "")
+            counts[name] = count_tokens(texts[name])
+        overflow -= original - counts[name]
+        trimmed[name] = {"from": original, "to": counts[name]}
+
+    prompt = "".join(texts[name] for name, _, _, _ in sections)
+    total = sum(counts.values())
+    return prompt, {
+        "prompt_tokens_est": total,
+        "budget": budget,
+        "over_budget": total > budget,
+        "sections": counts,
+        "trimmed": trimmed,
+        "tokenizer": TOKENIZER_ENCODING if _get_encoding() else "chars/4",
+    }
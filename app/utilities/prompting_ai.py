@@ -1,37 +1,35 @@
 import openai
 import json
-import os
-from openai import OpenAI
+import time
+import anyio
+from openai import AsyncOpenAI, OpenAIError
 from dotenv import load_dotenv
+from app.utilities.model_router import plan_route, max_tokens_for, record_attempt, finish_decision
+from app.utilities import config
 
 load_dotenv()
 
-openaiapikey = os.getenv("OPENAI_API_KEY")
-if not openaiapikey:
-    raise ValueError("OPENAI_API_KEY environment variable is not set")
+SYSTEM_MESSAGE = "You are a professional social media content and design assistant."
 
-def generate_caption_and_image_prompt(prompt: str) -> list[dict]:
-    """
-    Sends a prompt to OpenAI and expects an array of objects in JSON format.
-    Each object should contain:
-      - caption
-      - hashtags
-      - image_prompt
 
-    Returns a list of dicts.
-    """
-    client = OpenAI(api_key=openaiapikey)
+def _new_client() -> AsyncOpenAI:
+    api_key = config.get("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+    return AsyncOpenAI(api_key=api_key)
+
+
+# One client per event loop, so concurrent generations share its connection pool
+_clients = config.LoopClients("OpenAI", _new_client, keys=["OPENAI_API_KEY"])
+
 
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": "You are a professional social media content and design assistant."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=600  # increased to allow multiple posts
-    )
+def _get_client() -> AsyncOpenAI:
+    return _clients.get()
 
-    output_text = response.choices[0].message.content.strip()
+def _parse_ai_output(output_text: str, hashtag_mode: str = "llm") -> list[dict]:
+    # Smaller models like to wrap the array in a ```json fence
+    if output_text.startswith("```"):
+        output_text = output_text.strip("`").removeprefix("json").strip()
 
     try:
         data = json.loads(output_text)
@@ -43,13 +41,121 @@ def generate_caption_and_image_prompt(prompt: str) -> list[dict]:
             raise ValueError("Some items in the AI output array are not objects.")
         
         # Optional: check required keys in each dict
-        required_keys = {"caption", "hashtags", "image_prompt"}
+        # (hashtags are only left out when the hashtag engine supplies them)
+        required_keys = {"caption", "image_prompt"} if hashtag_mode == "engine" else {"caption", "hashtags", "image_prompt"}
         for i, item in enumerate(data):
             missing_keys = required_keys - item.keys()
             if missing_keys:
                 raise ValueError(f"Item {i} is missing keys: {missing_keys}")
+            item.setdefault("hashtags", [])
 
     except json.JSONDecodeError as e:
         raise ValueError(f"AI returned invalid JSON: {e}\nRaw output: {output_text}")
 
     return data
+
+
+async def generate_caption_and_image_prompt(
+    prompt: str,
+    number_of_posts: int = 1,
+    client_id: str = None,
+    usage: dict = None,
+    hashtag_mode: str = "llm",
+) -> list[dict]:
+    """
+    Sends a prompt to OpenAI and expects an array of objects in JSON format.
+    Each object should contain:
+      - caption
+      - hashtags (required unless hashtag_mode is "engine", where the
+        prompt did not ask for them)
+      - image_prompt
+
+    The model is picked per call by model_router from the batch size, the
+    prompt size and the client's latency SLO. API errors and unparseable
+    output fall through to the next candidate model.
+
+    If `usage` is given, the token usage the API reports for the successful
+    call is added to it.
+
+    Returns a list of dicts.
+    """
+    client = _get_client()
+    # Token counting and the client lookup are blocking; keep them off the loop
+    decision = await anyio.to_thread.run_sync(plan_route, prompt, number_of_posts, client_id)
+    last_error = None
+
+    try:
+        for candidate in decision["candidates"]:
+            model = candidate["model"]
+            started = time.perf_counter()
+            try:
+                response = await client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": SYSTEM_MESSAGE},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=max_tokens_for(model, number_of_posts)
+                )
+                output_text = response.choices[0].message.content.strip()
+                data = _parse_ai_output(output_text, hashtag_mode)
+            except (OpenAIError, ValueError) as e:
+                record_attempt(decision, model, started, ok=False, error=str(e)[:300])
+                print(f"Model {model} failed, falling back: {e}")
+                last_error = e
+                continue
+
+            record_attempt(decision, model, started, ok=True, usage=response.usage)
+            if usage is not None and response.usage:
+                usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + response.usage.prompt_tokens
+                usage["completion_tokens"] = usage.get("completion_tokens", 0) + response.usage.completion_tokens
+                usage.setdefault("models", []).append(model)
+            return data
+    finally:
+        finish_decision(decision)
+
+    raise ValueError(f"All caption models failed: {last_error}")
+
+
+# -------------------- Batch Requests --------------------
+# Bulk caption jobs (caption_batches) send the same chat request through a
+# provider's batch interface instead of calling the API directly.
+
+def openai_client() -> AsyncOpenAI:
+    """The shared client, for callers outside the chat path (batch jobs)."""
+    return _get_client()
+
+
+def batch_request(custom_id: str, prompt: str, number_of_posts: int, model: str) -> dict:
+    """One line of a batch input file, in the OpenAI Batch API format."""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": SYSTEM_MESSAGE},
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": max_tokens_for(model, number_of_posts)
+        }
+    }
+
+
+def parse_batch_result(line: dict, hashtag_mode: str = "llm") -> tuple[list[dict], dict]:
+    """
+    Parses one line of a batch output file into (outputs, usage). Raises
+    ValueError when the request failed or its output is not valid.
+    """
+    if line.get("error"):
+        raise ValueError(f"Batch request failed: {line['error'].get('message', line['error'])}")
+
+    response = line.get("response") or {}
+    body = response.get("body") or {}
+    if response.get("status_code") != 200:
+        message = (body.get("error") or {}).get("message", "no response")
+        raise ValueError(f"Batch request failed with HTTP {response.get('status_code')}: {message}")
+
+    data = _parse_ai_output(body["choices"][0]["message"]["content"].strip(), hashtag_mode)
+    return data, body.get("usage") or {}
@@ -0,0 +1,269 @@
+import base64
+import hashlib
+import io
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urljoin, urlparse
+import requests
+from PIL import Image, ImageOps, UnidentifiedImageError
+from app.utilities.csv_io import atomic_write_bytes, atomic_write_text
+
+# -------------------- Settings --------------------
+# Downscaled references are cached by content hash; a small per-URL record
+# (app/Data/cache/reference_images/urls) remembers which content a URL gave
+# and its ETag/Last-Modified, so a repeat reference is revalidated with a
+# conditional GET instead of downloaded again. URLs without validators are
+# reused for REFERENCE_URL_TTL_SEC. The cache is bounded by
+# REFERENCE_CACHE_MB, least recently used files going first.
+#
+# Reference URLs come from API callers, so only http(s) URLs whose host
+# resolves to public addresses are fetched. Redirects are followed by hand
+# and every hop is checked the same way.
+
+REFERENCE_CACHE = Path("app/Data/cache/reference_images")
+URL_INDEX = REFERENCE_CACHE / "urls"
+MAX_CACHE_BYTES = int(os.getenv("REFERENCE_CACHE_MB", "256")) * 1024 * 1024
+URL_TTL_SEC = int(os.getenv("REFERENCE_URL_TTL_SEC", "3600"))
+
+# nano-banana renders around 1024px, larger references only add upload time
+MAX_REFERENCE_SIDE = 1024
+JPEG_QUALITY = 85
+MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
+FETCH_TIMEOUT = 15
+MAX_REDIRECTS = 5
+MAX_WORKERS = 4
+MAX_SOURCES = 1024
+
+
+_evict_lock = threading.Lock()
+# cached file name -> the URL it was last prepared from, so a file evicted
+# before the generation uses it can be fetched again (see read_reference)
+_sources: OrderedDict[str, str] = OrderedDict()
+_sources_lock = threading.Lock()
+
+
+# -------------------- Fetch + Downscale --------------------
+
+def check_public_url(url: str):
+    """Raises ValueError unless `url` is http(s) on a host with only public addresses."""
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("only http(s) URLs can be used")
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parsed.hostname, parsed.port, proto=socket.IPPROTO_TCP)}
+    except socket.gaierror:
+        raise ValueError("host could not be resolved")
+    for address in addresses:
+        if not ipaddress.ip_address(address.split("%")[0]).is_global:
+            raise ValueError("host is not a public address")
+
+
+def fetch_reference(url: str, headers: dict = None) -> tuple[bytes | None, dict]:
+    """
+    Downloads `url` (at most 20 MB) and returns (body, response headers).
+    The body is None when conditional `headers` got a 304.
+    """
+    target = url
+    for _ in range(MAX_REDIRECTS + 1):
+        check_public_url(target)
+        with requests.get(target, timeout=FETCH_TIMEOUT, stream=True, headers=headers, allow_redirects=False) as response:
+            if response.is_redirect:
+                target = urljoin(target, response.headers.get("location", ""))
+                continue
+            if response.status_code == 304 and headers:
+                return None, response.headers
+            if response.status_code != 200:
+                raise ValueError("could not be downloaded")
+
+            data = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                data.extend(chunk)
+                if len(data) > MAX_DOWNLOAD_BYTES:
+                    raise ValueError("image is larger than 20 MB")
+            return bytes(data), response.headers
+    raise ValueError(f"redirected more than {MAX_REDIRECTS} times")
+
+
+def downscale_reference(raw: bytes) -> Path:
+    """
+    Stores a validated, downscaled JPEG copy of `raw` keyed by the content
+    hash of the original bytes, and returns its path. A reference that was
+    processed before (by any request) is returned straight from the cache.
+    """
+    digest = hashlib.sha256(raw).hexdigest()
+    cached = REFERENCE_CACHE / f"{digest}.jpg"
+    if _touch(cached):
+        return cached
+
+    try:
+        with Image.open(io.BytesIO(raw)) as img:
+            img.load()
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            img.thumbnail((MAX_REFERENCE_SIDE, MAX_REFERENCE_SIDE))
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    except (UnidentifiedImageError, OSError) as e:
+        raise ValueError(f"not a valid image ({e})")
+
+    atomic_write_bytes(cached, out.getvalue())
+    _evict(keep=cached)
+    return cached
+
+
+def _touch(path: Path) -> bool:
+    """Marks a cached file as used; False when it is not (or no longer) cached."""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _evict(keep: Path):
+    with _evict_lock:
+        files = []
+        for path in REFERENCE_CACHE.glob("*.jpg"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files, key=lambda f: f[0]):
+            if total <= MAX_CACHE_BYTES:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+def _url_record_path(url: str) -> Path:
+    return URL_INDEX / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+
+def _prepare_one(url: str) -> Path:
+    record_path = _url_record_path(url)
+    try:
+        record = json.loads(record_path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        record = None
+
+    headers = {}
+    if record:
+        cached = REFERENCE_CACHE / f"{record['digest']}.jpg"
+        if cached.exists():
+            if record.get("etag"):
+                headers["If-None-Match"] = record["etag"]
+            if record.get("last_modified"):
+                headers["If-Modified-Since"] = record["last_modified"]
+            if not headers and time.time() - record["fetched_at"] < URL_TTL_SEC:
+                _touch(cached)
+                return cached
+
+    raw, response_headers = fetch_reference(url, headers or None)
+    if raw is None:
+        # 304: the content we already downscaled is still current
+        if _touch(cached):
+            return cached
+        raw, response_headers = fetch_reference(url)
+
+    path = downscale_reference(raw)
+    with _sources_lock:
+        _sources[path.name] = url
+        _sources.move_to_end(path.name)
+        if len(_sources) > MAX_SOURCES:
+            _sources.popitem(last=False)
+    atomic_write_text(record_path, json.dumps({
+        "url": url,
+        "digest": path.stem,
+        "etag": response_headers.get("ETag"),
+        "last_modified": response_headers.get("Last-Modified"),
+        "fetched_at": time.time(),
+    }))
+    return path
+
+
+def prepare_reference_images(urls: list[str]) -> list[Path]:
+    """
+    Fetches each distinct reference URL once, in parallel, and returns the
+    local downscaled copies in the original order. Raises ValueError naming
+    every URL that could not be fetched or decoded.
+    """
+    unique_urls = list(dict.fromkeys(u for u in urls if u))
+    if not unique_urls:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(unique_urls))) as pool:
+        futures = {url: pool.submit(_prepare_one, url) for url in unique_urls}
+
+    paths, failures = [], []
+    for url, future in futures.items():
+        try:
+            paths.append(future.result())
+        except ValueError as e:
+            failures.append(f"{url}: {e}")
+        except requests.RequestException:
+            failures.append(f"{url}: could not be downloaded")
+
+    if failures:
+        raise ValueError("Reference image(s) unusable: " + "; ".join(failures))
+    return paths
+
+
+# -------------------- Provider Inputs --------------------
+
+def read_reference(path: Path) -> bytes:
+    """
+    Returns a prepared reference's bytes. The cache may have evicted it
+    since prepare_reference_images(); it is then fetched again.
+    """
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        with _sources_lock:
+            url = _sources.get(path.name)
+        if url is None:
+            raise ValueError(f"Reference image {path.name} is no longer cached")
+        return _prepare_one(url).read_bytes()
+
+
+def to_data_uri(data: bytes) -> str:
+    return "data:image/jpeg;base64," + base64.b64encode(data).decode()
+
+
+def upload_reference_images(client, paths: list[Path]) -> tuple[list[str], list[str]]:
+    """
+    Uploads each prepared reference once and returns (inputs, file_ids):
+    URLs that every post's prediction can reuse, and the uploaded file ids
+    to pass to delete_reference_uploads once the predictions are done.
+    Falls back to an inline data URI of the compact JPEG when the upload is
+    rejected.
+    """
+    inputs, file_ids = [], []
+    for path in paths:
+        data = read_reference(path)
+        try:
+            uploaded = client.files.create(io.BytesIO(data), filename=path.name, content_type="image/jpeg")
+            inputs.append(uploaded.urls["get"])
+            file_ids.append(uploaded.id)
+        except Exception as e:
+            print(f"Reference upload failed for {path.name}, sending inline: {e}")
+            inputs.append(to_data_uri(data))
+    return inputs, file_ids
+
+
+def delete_reference_uploads(client, file_ids: list[str]):
+    for file_id in file_ids:
+        try:
+            client.files.delete(file_id)
+        except Exception as e:
+            print(f"Could not delete uploaded reference {file_id}: {e}")
@@ -0,0 +1,195 @@
+import csv
+import json
+import threading
+import uuid
+from pathlib import Path
+from app.utilities.csv_io import atomic_write_text
+
+# -------------------- Paths --------------------
+
+DATA_ROOT = Path("app/Data")
+CLIENT_ROOT = DATA_ROOT / "clients"
+CLIENT_CSV = CLIENT_ROOT / "management.csv"
+CATEGORY_CSV = DATA_ROOT / "categories" / "management.csv"
+TOPIC_CSV = DATA_ROOT / "topics" / "management.csv"
+IMAGE_CSV = DATA_ROOT / "images" / "management.csv"
+
+SNAPSHOT_PATH = DATA_ROOT / "cache" / "reference.json"
+VERSION_PATH = DATA_ROOT / "cache" / "reference.version"
+SNAPSHOT_FORMAT = 3
+
+# A snapshot holds the client index and profiles, the category and topic
+# maps and the image registry. It is plain JSON, so a tampered cache file
+# can at worst hold wrong data, never run code.
+#
+# Every write to clients, categories, topics or images bumps a single
+# version file (refresh_snapshot), and a snapshot records the version it
+# was built at. A lookup only stats the version file; after a bump the
+# first lookup in each process reloads the snapshot, or rebuilds it from
+# source if no process has yet. A cold process also checks the snapshot
+# against the mtimes of its source files once, so hand-edited CSVs are
+# picked up on restart (or right away with refresh_snapshot()).
+
+_lock = threading.Lock()  # serializes snapshot writers and guards _data
+_data: dict | None = None
+_data_key: tuple | None = None  # version file stat _data is current for
+
+
+# -------------------- Build From Source --------------------
+
+def _read_rows(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    with path.open("r", newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def _mtime(path: Path) -> int | None:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _build_from_source(version: str) -> dict:
+    sources = {str(p): _mtime(p) for p in (CLIENT_ROOT, CLIENT_CSV, CATEGORY_CSV, TOPIC_CSV, IMAGE_CSV)}
+
+    profiles = {}
+    if CLIENT_ROOT.exists():
+        for folder in CLIENT_ROOT.iterdir():
+            profile_path = folder / "profile.json"
+            if profile_path.exists():
+                profile = json.loads(profile_path.read_text())
+                sources[str(profile_path)] = _mtime(profile_path)
+                if profile.get("client_id"):
+                    profiles[profile["client_id"]] = {"folder": folder.name, "profile": profile}
+
+    clients = _read_rows(CLIENT_CSV)
+    topics = _read_rows(TOPIC_CSV)
+
+    return {
+        "format": SNAPSHOT_FORMAT,
+        "version": version,
+        "sources": sources,
+        "clients": clients,
+        "client_names": {row["client_id"]: row["client_name"] for row in clients},
+        "profiles": profiles,
+        "categories": _read_rows(CATEGORY_CSV),
+        "topics": topics,
+        "topic_map": {row["topic_id"]: row["title"] for row in topics},
+        "images": _read_rows(IMAGE_CSV),
+    }
+
+
+def _sources_unchanged(data: dict) -> bool:
+    return all(_mtime(Path(path)) == mtime for path, mtime in data["sources"].items())
+
+
+# -------------------- Version File --------------------
+
+def _version_key() -> tuple | None:
+    try:
+        stat = VERSION_PATH.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _read_version() -> str | None:
+    try:
+        return VERSION_PATH.read_text()
+    except FileNotFoundError:
+        return None
+
+
+def _bump_version() -> str:
+    version = uuid.uuid4().hex
+    atomic_write_text(VERSION_PATH, version)
+    return version
+
+
+# -------------------- Snapshot File --------------------
+
+def _read_snapshot() -> dict | None:
+    try:
+        data = json.loads(SNAPSHOT_PATH.read_bytes())
+    except (FileNotFoundError, ValueError):
+        return None
+    return data if isinstance(data, dict) and data.get("format") == SNAPSHOT_FORMAT else None
+
+
+def refresh_snapshot():
+    """
+    Marks the reference data as changed. Called after every write to
+    clients, categories, topics or images; readers rebuild on their next
+    lookup, so a burst of writes costs one rebuild.
+    """
+    _bump_version()
+
+
+def get_reference_data() -> dict:
+    """
+    Returns the current reference data. When this process already holds the
+    latest version it only stats the version file; otherwise it loads the
+    snapshot written for that version, or rebuilds it from source.
+
+    Loading and rebuilding happen outside the lock, so a slow rebuild never
+    blocks readers that still hold usable data, and a snapshot that cannot
+    be written (read-only data dir) only costs the cache, not the request.
+    """
+    global _data, _data_key
+    key = _version_key()
+    data = _data
+    if data is not None and key == _data_key:
+        return data
+
+    # Read the version before the sources: a bump that lands mid-build
+    # changes the key again, so the next lookup rebuilds
+    version = _read_version()
+    snapshot = _read_snapshot()
+    if version is not None and snapshot is not None and snapshot["version"] == version:
+        if data is not None or _sources_unchanged(snapshot):
+            with _lock:
+                _data, _data_key = snapshot, key
+            return snapshot
+        version = None  # hand-edited since: every process must rebuild
+
+    if version is None:
+        try:
+            version = _bump_version()
+        except OSError:
+            version = ""
+        key = _version_key()
+
+    data = _build_from_source(version)
+    try:
+        with _lock:
+            atomic_write_text(SNAPSHOT_PATH, json.dumps(data, separators=(",", ":")))
+            _data, _data_key = data, key
+    except OSError as e:
+        print(f"Reference snapshot not written ({e}); serving from source")
+        with _lock:
+            _data, _data_key = data, key
+    return data
+
+
+# -------------------- Lookups --------------------
+
+def find_client(client_id: str) -> dict | None:
+    """Returns {"folder": <folder name>, "profile": <profile dict>} or None."""
+    return get_reference_data()["profiles"].get(client_id)
+
+
+def get_client_name(client_id: str) -> str | None:
+    return get_reference_data()["client_names"].get(client_id)
+
+
+def get_topic_map() -> dict[str, str]:
+    return get_reference_data()["topic_map"]
+
+
+if __name__ == "__main__":
+    # python -m app.utilities.reference_snapshot
+    refresh_snapshot()
+    snapshot = get_reference_data()
+    print(f"Wrote {SNAPSHOT_PATH} ({len(snapshot['profiles'])} client profiles, {len(snapshot['topics'])} topics)")
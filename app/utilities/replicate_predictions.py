@@ -0,0 +1,173 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import time
+import replicate
+from app.utilities import config
+
+# -------------------- Settings --------------------
+# Predictions are created without blocking on them. When
+# REPLICATE_WEBHOOK_BASE_URL (this server's public URL) is set, Replicate
+# POSTs the finished prediction to /webhooks/replicate and the waiting
+# generation is resolved from there. If no webhook has arrived after
+# REPLICATE_WEBHOOK_GRACE_SEC (e.g. it reached another worker process, or
+# no public URL is configured) the prediction is polled with exponential
+# backoff instead. A waiting generation is a suspended coroutine, not a
+# thread, so thousands of images can be in flight at once.
+#
+# Webhooks are only requested when REPLICATE_WEBHOOK_SECRET is set too:
+# /webhooks/replicate rejects every callback it cannot verify, so without a
+# secret a forged payload could otherwise resolve (or fail) a generation.
+#
+# REPLICATE_BASE_URL points the client at another API host, such as the
+# local fake server in app/utilities/fake_replicate.py.
+
+WEBHOOK_BASE_URL = os.getenv("REPLICATE_WEBHOOK_BASE_URL", "").rstrip("/")
+WEBHOOK_SECRET = os.getenv("REPLICATE_WEBHOOK_SECRET", "")
+WEBHOOK_GRACE_SEC = float(os.getenv("REPLICATE_WEBHOOK_GRACE_SEC", "30"))
+API_BASE_URL = os.getenv("REPLICATE_BASE_URL") or None
+PREDICTION_TIMEOUT_SEC = float(os.getenv("REPLICATE_PREDICTION_TIMEOUT_SEC", "600"))
+
+POLL_INITIAL_SEC = 1.0
+POLL_MAX_SEC = 15.0
+SIGNATURE_TOLERANCE_SEC = 300
+TERMINAL_STATUSES = {"succeeded", "failed", "canceled"}
+
+WEBHOOK_PATH = "/webhooks/replicate"
+
+if WEBHOOK_BASE_URL and not WEBHOOK_SECRET:
+    print("REPLICATE_WEBHOOK_BASE_URL is set without REPLICATE_WEBHOOK_SECRET; webhooks are disabled, predictions will be polled")
+    WEBHOOK_BASE_URL = ""
+
+# prediction id -> future resolved with the finished prediction payload
+_pending: dict[str, asyncio.Future] = {}
+# Webhooks that beat the create() response back to us, by prediction id
+_early: dict[str, tuple[float, dict]] = {}
+
+
+def _new_client() -> replicate.Client:
+    return replicate.Client(api_token=config.get("REPLICATE_API_TOKEN"), base_url=API_BASE_URL)
+
+
+_clients = config.LoopClients("Replicate", _new_client, keys=["REPLICATE_API_TOKEN"])
+
+
+def replicate_client() -> replicate.Client:
+    """The client (and connection pool) for the running event loop, rebuilt when the token rotates."""
+    return _clients.get()
+
+
+# -------------------- Webhook Callbacks --------------------
+
+def verify_signature(headers, body: bytes) -> bool:
+    """
+    Checks Replicate's webhook signature (the Standard Webhooks scheme:
+    HMAC-SHA256 over "<id>.<timestamp>.<body>" with the whsec_ secret).
+    Without a configured secret no callback can be verified, so none is.
+    """
+    if not WEBHOOK_SECRET:
+        return False
+
+    webhook_id = headers.get("webhook-id")
+    timestamp = headers.get("webhook-timestamp")
+    signatures = headers.get("webhook-signature")
+    if not (webhook_id and timestamp and signatures):
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > SIGNATURE_TOLERANCE_SEC:
+            return False
+    except ValueError:
+        return False
+
+    try:
+        key = base64.b64decode(WEBHOOK_SECRET.removeprefix("whsec_"))
+    except ValueError:
+        print("REPLICATE_WEBHOOK_SECRET is not a valid whsec_ secret")
+        return False
+    signed = f"{webhook_id}.{timestamp}.".encode() + body
+    expected = base64.b64encode(hmac.new(key, signed, hashlib.sha256).digest()).decode()
+    return any(
+        hmac.compare_digest(sig.split(",", 1)[-1], expected)
+        for sig in signatures.split()
+    )
+
+
+def resolve_prediction(payload: dict) -> bool:
+    """
+    Hands a finished prediction from a webhook to the generation waiting on
+    it. Returns False when nobody in this process is waiting (yet).
+    """
+    prediction_id = payload.get("id")
+    if payload.get("status") not in TERMINAL_STATUSES or not prediction_id:
+        return False
+
+    future = _pending.get(prediction_id)
+    if future is None:
+        now = time.time()
+        for stale in [k for k, (at, _) in _early.items() if now - at > WEBHOOK_GRACE_SEC * 2]:
+            _early.pop(stale, None)
+        _early[prediction_id] = (now, payload)
+        return False
+    # The webhook may be served on a different event loop than the waiter
+    future.get_loop().call_soon_threadsafe(_set_result, future, payload)
+    return True
+
+
+def _set_result(future: asyncio.Future, payload: dict):
+    if not future.done():
+        future.set_result(payload)
+
+
+# -------------------- Running Predictions --------------------
+
+async def _poll(client: replicate.Client, prediction_id: str, future: asyncio.Future) -> dict:
+    delay = POLL_INITIAL_SEC
+    while True:
+        done, _ = await asyncio.wait({future}, timeout=delay)
+        if done:
+            return future.result()
+
+        prediction = await client.predictions.async_get(prediction_id)
+        if prediction.status in TERMINAL_STATUSES:
+            return {"id": prediction.id, "status": prediction.status, "output": prediction.output, "error": prediction.error}
+        delay = min(delay * 2, POLL_MAX_SEC)
+
+
+async def run_prediction(client: replicate.Client, model: str, input: dict):
+    """
+    Creates a prediction and waits for it without holding a thread: first
+    for its webhook, then by polling with backoff. Returns the raw output
+    (a URL or list of URLs for image models).
+    """
+    params = {}
+    if WEBHOOK_BASE_URL:
+        params = {"webhook": WEBHOOK_BASE_URL + WEBHOOK_PATH, "webhook_events_filter": ["completed"]}
+
+    prediction = await client.predictions.async_create(model=model, input=input, **params)
+    future = asyncio.get_running_loop().create_future()
+    _pending[prediction.id] = future
+
+    try:
+        early = _early.pop(prediction.id, None)
+        if early:
+            future.set_result(early[1])
+
+        async def wait() -> dict:
+            if WEBHOOK_BASE_URL:
+                done, _ = await asyncio.wait({future}, timeout=WEBHOOK_GRACE_SEC)
+                if done:
+                    return future.result()
+                print(f"No webhook for prediction {prediction.id} after {WEBHOOK_GRACE_SEC}s, polling")
+            return await _poll(client, prediction.id, future)
+
+        result = await asyncio.wait_for(wait(), timeout=PREDICTION_TIMEOUT_SEC)
+    except asyncio.TimeoutError:
+        raise RuntimeError(f"Prediction {prediction.id} did not finish within {PREDICTION_TIMEOUT_SEC:.0f}s")
+    finally:
+        _pending.pop(prediction.id, None)
+
+    if result["status"] != "succeeded":
+        raise RuntimeError(f"Prediction {prediction.id} {result['status']}: {result.get('error')}")
+    return result.get("output")
@@ -0,0 +1,86 @@
+import asyncio
+import copy
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+from typing import Callable
+
+# -------------------- Single Flight --------------------
+# Identical calls that overlap in time share one execution: the first
+# caller starts `fn` in its own task, every caller with the same key
+# (the first included) waits for that task, and each gets its own deep copy
+# of the result so none can mutate another's. Because the work is not tied
+# to any one caller, a caller that is cancelled (e.g. its client went away)
+# stops waiting without cancelling the result for the others.
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self.in_flight: dict[str, Future] = {}
+        self.lock = threading.Lock()
+        self.executions = 0
+        self.collapsed = 0
+        self.max_waiters = 0
+        self._waiters: dict[str, int] = {}
+        self._tasks: set[asyncio.Task] = set()  # strong refs until each finishes
+
+    def _join(self, key: str) -> tuple[Future, bool]:
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+                self._waiters[key] = 0
+                self.executions += 1
+            else:
+                self.collapsed += 1
+                self._waiters[key] += 1
+                self.max_waiters = max(self.max_waiters, self._waiters[key])
+            return future, leader
+
+    def _done(self, key: str):
+        with self.lock:
+            self.in_flight.pop(key, None)
+            self._waiters.pop(key, None)
+
+    async def ado(self, key: str, fn: Callable):
+        """Runs the coroutine function `fn` once per overlapping `key` and returns its result."""
+        future, leader = self._join(key)
+        if leader:
+            task = asyncio.create_task(self._run(key, fn, future))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        # Shielded so a caller that goes away does not cancel the shared future
+        return copy.deepcopy(await asyncio.shield(asyncio.wrap_future(future)))
+
+    async def _run(self, key: str, fn: Callable, future: Future):
+        try:
+            future.set_result(await fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            self._done(key)
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.executions + self.collapsed
+            return {
+                "name": self.name,
+                "calls": total,
+                "executions": self.executions,
+                "collapsed": self.collapsed,
+                "collapse_rate": round(self.collapsed / total, 3) if total else 0.0,
+                "max_waiters": self.max_waiters,
+                "in_flight": len(self.in_flight),
+            }
+
+
+def request_key(payload: dict) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+generation_flight = SingleFlight("generate_posts")
@@ -6,6 +6,13 @@ from app.routes.clients_route import router as clients_router
 from app.routes.category_topic_route import router as category_topic_router
 from app.routes.image_route import router as image_router
 from app.routes.post_route import router as post_router
+from app.routes.stats_route import router as stats_router
+from app.routes.profile_route import router as profile_router
+from app.routes.webhook_route import router as webhook_router
+from app.utilities.profiling import ProfilingMiddleware
+from app.utilities.compression import SelectiveGZipMiddleware
+from app.utilities.config import start_watcher
+from app.utilities.post_writer import recover_posts
 from fastapi.middleware.cors import CORSMiddleware
 from mangum import Mangum
 
@@ -13,6 +20,12 @@ from mangum import Mangum
 
 load_dotenv()
 
+# Hot-reload provider keys when .env changes
+start_watcher()
+
+# Replay posts buffered by a process that crashed before writing them
+recover_posts()
+
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 logger = logging.getLogger(__name__)
 
@@ -25,8 +38,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],   # GET, POST, DELETE, etc.
     allow_headers=["*"],   # Allows all headers
+    expose_headers=["ETag", "Idempotent-Replayed", "X-Profile-Id", "X-Run-Id", "Accept-Ranges", "Content-Range"],
 )
 
+# Compress large JSON listings; small bodies are sent as-is. Proxied
+# images and ranged responses are left alone
+app.add_middleware(SelectiveGZipMiddleware, exclude_paths=("/images/proxy",), minimum_size=1024, compresslevel=6)
+
+# Opt-in request profiling (PROFILE_ADMIN_TOKEN / PROFILE_SAMPLE_RATE);
+# passes requests straight through when neither is set
+app.add_middleware(ProfilingMiddleware)
+
 
 # Register routes
 app.include_router(env_router, prefix="/env", tags=["Environment Config"])
@@ -34,6 +56,9 @@ app.include_router(clients_router, prefix="/clients", tags=["Client Management"]
 app.include_router(category_topic_router, tags=["Categories and Topics"])
 app.include_router(image_router, prefix="/images", tags=["Image Management"])
 app.include_router(post_router, prefix="/posts", tags=["Post Creation"])
+app.include_router(stats_router, prefix="/stats", tags=["Statistics"])
+app.include_router(profile_router, prefix="/profiles", tags=["Profiling"])
+app.include_router(webhook_router, prefix="/webhooks", tags=["Webhooks"])
 
 
 @app.get("/")
@@ -0,0 +1,18 @@
+import os
+import pytest
+
+# Settings are read at import time; give the modules under test a harmless
+# environment before any of them is imported.
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("REPLICATE_API_TOKEN", "test")
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Runs the test from an empty directory, so app/Data starts out empty."""
+    from app.utilities import post_store
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(post_store, "_manifest", None)
+    monkeypatch.setattr(post_store, "_manifest_mtime", None)
+    return tmp_path
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from app.utilities import idempotency
+from app.utilities.csv_io import try_lock_path
+from app.utilities.idempotency import IdempotencyConflict, IdempotencyInProgress, arun_idempotent
+
+
+def _run(key: str, fingerprint: str, fn, context: dict = None):
+    return asyncio.run(arun_idempotent(key, fingerprint, fn, context=context))
+
+
+def _returning(result: dict, calls: list):
+    async def fn(context):
+        calls.append(context)
+        return result
+    return fn
+
+
+def test_completed_key_is_replayed(data_dir):
+    calls = []
+    assert _run("key", "fp", _returning({"n": 1}, calls)) == ({"n": 1}, False)
+    assert _run("key", "fp", _returning({"n": 2}, calls)) == ({"n": 1}, True)
+    assert len(calls) == 1
+
+
+def test_key_reused_with_another_request_conflicts(data_dir):
+    _run("key", "fp", _returning({"n": 1}, []))
+    with pytest.raises(IdempotencyConflict):
+        _run("key", "other", _returning({"n": 2}, []))
+
+
+def test_retry_after_failure_gets_first_attempts_context(data_dir):
+    async def fail(context):
+        raise RuntimeError("provider down")
+
+    with pytest.raises(RuntimeError):
+        _run("key", "fp", fail, context={"run_id": "RUN-1"})
+
+    calls = []
+    assert _run("key", "fp", _returning({"n": 1}, calls), context={"run_id": "RUN-2"}) == ({"n": 1}, False)
+    assert calls == [{"run_id": "RUN-1"}]
+
+
+def test_key_running_in_another_process_is_in_progress(data_dir):
+    path = idempotency._record_path("key")
+    idempotency._write(path, {"fingerprint": "fp", "status": "in_progress", "expires_at": 2e9})
+    other_process = try_lock_path(idempotency._lock_path(path))
+    try:
+        with pytest.raises(IdempotencyInProgress):
+            _run("key", "fp", _returning({"n": 1}, []))
+    finally:
+        other_process.close()
+
+    # Its lock is gone (the process died): the key is run again
+    assert _run("key", "fp", _returning({"n": 1}, [])) == ({"n": 1}, False)
+    assert not idempotency._lock_path(path).exists()
+
+
+def test_concurrent_calls_in_one_process_share_the_run(data_dir):
+    calls = []
+
+    async def slow(context):
+        calls.append(context)
+        await asyncio.sleep(0.05)
+        return {"n": 1}
+
+    async def both():
+        return await asyncio.gather(arun_idempotent("key", "fp", slow), arun_idempotent("key", "fp", slow))
+
+    assert sorted(asyncio.run(both()), key=lambda r: r[1]) == [({"n": 1}, False), ({"n": 1}, True)]
+    assert len(calls) == 1
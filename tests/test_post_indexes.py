@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from app.utilities import caption_dedup, hashtag_engine
+from app.utilities.client_indexes import ClientIndexes
+from app.utilities.post_store import POSTS_LOCK, append_rows
+from app.utilities.caption_dedup import split_near_duplicates
+from app.utilities.hashtag_engine import history_size, suggest_hashtags
+
+CAPTION = "Autumn is here and our new pumpkin spice latte is back in every store"
+
+
+@pytest.fixture
+def indexes(data_dir, monkeypatch):
+    monkeypatch.setattr(caption_dedup, "_indexes", ClientIndexes(caption_dedup.ClientCaptionIndex))
+    monkeypatch.setattr(hashtag_engine, "_indexes", ClientIndexes(hashtag_engine.ClientHashtagIndex))
+    return data_dir
+
+
+def _post(post_id: str, caption: str = CAPTION, hashtags: str = "#autumn,#coffee") -> dict:
+    return {"post_id": post_id, "client_id": "CLIENT-1", "caption": caption, "hashtags": hashtags, "topics": "T1", "finalized": "False", "created_at": "2026-10-01T10:00:00"}
+
+
+def _dropped(caption: str) -> list[dict]:
+    return split_near_duplicates("CLIENT-1", [{"caption": caption}])[1]
+
+
+def _hashtags() -> dict[str, int]:
+    return {s["hashtag"]: s["count"] for s in suggest_hashtags("CLIENT-1", ["T1"], limit=10)}
+
+
+def test_indexes_are_built_from_history_and_kept_current(indexes):
+    append_rows([_post("POST-1")])
+    assert _dropped(CAPTION)
+    assert _hashtags() == {"#autumn": 1, "#coffee": 1}
+
+    edited = _post("POST-1", caption="Winter menu launches today with gingerbread", hashtags="#winter")
+    caption_dedup.index_changes(removed=[_post("POST-1")], added=[edited])
+    hashtag_engine.index_changes(removed=[_post("POST-1")], added=[edited])
+    assert not _dropped(CAPTION)
+    assert _hashtags() == {"#winter": 1}
+
+    caption_dedup.index_changes(removed=[edited])
+    hashtag_engine.index_changes(removed=[edited])
+    assert not _dropped(edited["caption"])
+    assert history_size("CLIENT-1") == 0
+
+
+def test_post_seen_by_build_and_by_save_is_counted_once(indexes):
+    append_rows([_post("POST-1")])
+    assert history_size("CLIENT-1") == 1
+
+    hashtag_engine.index_post(_post("POST-1"))
+    assert history_size("CLIENT-1") == 1
+    assert _hashtags() == {"#autumn": 1, "#coffee": 1}
+
+
+def _run_both(first_build, change):
+    """
+    Runs a handler that holds POSTS_LOCK while applying `change` (as the
+    @exclusive_posts routes do) against a first index build, which flushes
+    and scans the shards. Fails instead of hanging if they deadlock.
+    """
+    def handler():
+        with POSTS_LOCK:
+            time.sleep(0.2)  # the build is waiting on POSTS_LOCK by now
+            change()
+
+    results = []
+    threads = [
+        threading.Thread(target=handler, daemon=True),
+        threading.Thread(target=lambda: results.append(first_build()), daemon=True),
+    ]
+    threads[0].start()
+    time.sleep(0.05)
+    threads[1].start()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert not any(thread.is_alive() for thread in threads), "index build deadlocked with a post handler"
+    return results[0]
+
+
+def test_caption_build_does_not_deadlock_with_post_handlers(indexes):
+    append_rows([_post("POST-1")])
+    dropped = _run_both(
+        lambda: _dropped(CAPTION),
+        lambda: caption_dedup.index_changes(removed=[_post("POST-1")]),
+    )
+    # The removal arrived mid-build and was applied before the index was used
+    assert dropped == []
+
+
+def test_hashtag_build_does_not_deadlock_with_post_handlers(indexes):
+    append_rows([_post("POST-1")])
+    size = _run_both(
+        lambda: history_size("CLIENT-1"),
+        lambda: hashtag_engine.index_changes(removed=[_post("POST-1")], added=[_post("POST-2", hashtags="#fall")]),
+    )
+    assert size == 1
+    assert _hashtags() == {"#fall": 1}
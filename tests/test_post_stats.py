@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from app.utilities import post_stats
+from app.utilities.post_stats import STATS_JSON, STATS_LOG, get_client_stats, record_changes, record_finalized, record_post
+
+
+def _fresh_process(monkeypatch):
+    """Forgets what this process has read, as a newly started worker would."""
+    monkeypatch.setattr(post_stats, "_stats", None)
+    monkeypatch.setattr(post_stats, "_snapshot_mtime", None)
+    monkeypatch.setattr(post_stats, "_log_offset", 0)
+    monkeypatch.setattr(post_stats, "_log_lines", 0)
+
+
+@pytest.fixture
+def stats_dir(data_dir, monkeypatch):
+    _fresh_process(monkeypatch)
+    return data_dir
+
+
+def _post(post_id: str, hashtags: str = "#a,#b", topics: str = "T1") -> dict:
+    return {"post_id": post_id, "client_id": "CLIENT-1", "hashtags": hashtags, "topics": topics, "finalized": "False", "created_at": "2026-10-01T10:00:00"}
+
+
+def _log_entries() -> list[dict]:
+    return [json.loads(line) for line in STATS_LOG.read_text().splitlines()]
+
+
+def test_each_write_appends_one_log_line(stats_dir, monkeypatch):
+    record_post(_post("POST-1"))
+    record_post(_post("POST-2", hashtags="#a"))
+    record_changes(removed=[_post("POST-2", hashtags="#a")], added=[_post("POST-2", hashtags="#c")])
+    record_finalized([_post("POST-1")])
+
+    assert len(_log_entries()) == 4
+    assert not STATS_JSON.exists()
+
+    _fresh_process(monkeypatch)
+    stats = get_client_stats("CLIENT-1")
+    assert (stats["total_posts"], stats["finalized_posts"]) == (2, 1)
+    assert {h["hashtag"]: h["count"] for h in stats["top_hashtags"]} == {"#a": 1, "#b": 1, "#c": 1}
+    assert stats["posts_by_month"] == {"2026-10": 2}
+
+
+def test_log_is_compacted_into_snapshot(stats_dir, monkeypatch):
+    monkeypatch.setattr(post_stats, "COMPACT_EVERY", 3)
+    for i in range(4):
+        record_post(_post(f"POST-{i}"))
+
+    snapshot = json.loads(STATS_JSON.read_text())
+    assert snapshot["clients"]["CLIENT-1"]["total"] == 3
+    assert [entry["g"] for entry in _log_entries()] == [snapshot["generation"]]
+
+    _fresh_process(monkeypatch)
+    assert get_client_stats("CLIENT-1")["total_posts"] == 4
+
+
+def test_log_lines_from_an_older_generation_are_ignored(stats_dir, monkeypatch):
+    monkeypatch.setattr(post_stats, "COMPACT_EVERY", 2)
+    record_post(_post("POST-1"))
+    record_post(_post("POST-2"))  # compacts into generation 1
+    generation = json.loads(STATS_JSON.read_text())["generation"]
+
+    # A line from before the compaction, left behind by an interrupted one
+    with open(STATS_LOG, "a") as f:
+        f.write(json.dumps({"g": generation - 1, "ops": [post_stats._row_op(_post("POST-0"), +1)]}) + "\n")
+        f.write('{"g": 1, "ops": [["po')  # torn by a crash
+
+    _fresh_process(monkeypatch)
+    assert get_client_stats("CLIENT-1")["total_posts"] == 2
@@ -0,0 +1,70 @@
+from app.utilities import post_store
+from app.utilities.post_store import append_rows, iter_post_rows, rewrite_posts, shard_files
+
+
+def _post(post_id: str, created_at: str) -> dict:
+    return {"post_id": post_id, "client_id": "CLIENT-1", "caption": post_id, "finalized": "False", "created_at": created_at}
+
+
+def _shard_keys() -> list[str]:
+    return [key for _, key, _ in shard_files("CLIENT-1")]
+
+
+def test_rewrite_finds_posts_written_before_month_sharding(data_dir, monkeypatch):
+    monkeypatch.setattr(post_store, "SHARD_BY_MONTH", False)
+    append_rows([_post("POST-20260901-AAAAAA", "2026-09-01T10:00:00")])
+
+    monkeypatch.setattr(post_store, "SHARD_BY_MONTH", True)
+    append_rows([
+        _post("POST-20261001-BBBBBB", "2026-10-01T10:00:00"),
+        _post("POST-20261001-CCCCCC", "not a date"),
+    ])
+    assert _shard_keys() == ["2026-10", "all", "unknown"]
+
+    changes, found = rewrite_posts(lambda row: None, ["POST-20260901-AAAAAA", "POST-20261001-CCCCCC"], client_id="CLIENT-1")
+
+    assert set(found) == {"POST-20260901-AAAAAA", "POST-20261001-CCCCCC"}
+    assert len(changes) == 2
+    assert [row["post_id"] for row in iter_post_rows(client_id="CLIENT-1")] == ["POST-20261001-BBBBBB"]
+
+
+def test_rewrite_after_month_sharding_is_turned_off(data_dir, monkeypatch):
+    monkeypatch.setattr(post_store, "SHARD_BY_MONTH", True)
+    append_rows([_post("POST-20261001-AAAAAA", "2026-10-01T10:00:00")])
+
+    monkeypatch.setattr(post_store, "SHARD_BY_MONTH", False)
+    append_rows([_post("POST-20261101-BBBBBB", "2026-11-01T10:00:00")])
+
+    def finalize(row):
+        row["finalized"] = "True"
+        return row
+
+    _, found = rewrite_posts(finalize, ["POST-20261001-AAAAAA", "POST-20261101-BBBBBB"], client_id="CLIENT-1")
+
+    assert set(found) == {"POST-20261001-AAAAAA", "POST-20261101-BBBBBB"}
+    assert all(row["finalized"] == "True" for row in iter_post_rows(client_id="CLIENT-1"))
+
+
+def test_date_filters_keep_legacy_shards(data_dir, monkeypatch):
+    from datetime import date
+
+    monkeypatch.setattr(post_store, "SHARD_BY_MONTH", False)
+    append_rows([_post("POST-20260901-AAAAAA", "2026-09-01T10:00:00")])
+    monkeypatch.setattr(post_store, "SHARD_BY_MONTH", True)
+    append_rows([_post("POST-20261001-BBBBBB", "2026-10-01T10:00:00")])
+
+    rows = iter_post_rows(client_id="CLIENT-1", date_from=date(2026, 9, 1), date_to=date(2026, 9, 30))
+    assert [row["post_id"] for row in rows] == ["POST-20260901-AAAAAA"]
+
+
+def test_rewrite_finds_post_saved_in_the_month_after_its_id(data_dir, monkeypatch):
+    # The id is minted at generation time; created_at is set when the post
+    # is saved, which can be just past midnight at the end of the month
+    monkeypatch.setattr(post_store, "SHARD_BY_MONTH", True)
+    append_rows([_post("POST-20261031-AAAAAA", "2026-11-01T00:00:05")])
+    assert _shard_keys() == ["2026-11"]
+
+    _, found = rewrite_posts(lambda row: None, ["POST-20261031-AAAAAA"], client_id="CLIENT-1")
+
+    assert set(found) == {"POST-20261031-AAAAAA"}
+    assert list(iter_post_rows(client_id="CLIENT-1")) == []
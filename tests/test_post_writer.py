@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from app.utilities import post_writer
+from app.utilities.post_store import append_rows, iter_post_rows
+from app.utilities.post_writer import JOURNAL_DIR, PostWriteBuffer
+
+
+@pytest.fixture
+def writer(data_dir, monkeypatch):
+    # Rows stay buffered (journaled only) until flushed explicitly
+    monkeypatch.setattr(post_writer, "BATCH_SIZE", 1000)
+    monkeypatch.setattr(post_writer, "MAX_DELAY", 3600)
+    buffers = []
+
+    def new_buffer() -> PostWriteBuffer:
+        buffer = PostWriteBuffer(JOURNAL_DIR)
+        buffers.append(buffer)
+        return buffer
+
+    yield new_buffer
+    for buffer in buffers:
+        if buffer.timer is not None:
+            buffer.timer.cancel()
+        if buffer.journal is not None:
+            buffer.journal.close()
+
+
+def _post(post_id: str) -> dict:
+    return {"post_id": post_id, "client_id": "CLIENT-1", "caption": post_id, "finalized": "False", "created_at": "2026-10-01T10:00:00"}
+
+
+def _crash(buffer: PostWriteBuffer):
+    """What the OS does when the process dies: the journal lock is dropped, nothing is flushed."""
+    buffer.timer.cancel()
+    buffer.journal.close()
+
+
+def _post_ids() -> list[str]:
+    return [row["post_id"] for row in iter_post_rows(client_id="CLIENT-1")]
+
+
+def test_recover_replays_journal_of_crashed_process(writer):
+    crashed = writer()
+    crashed.append(_post("POST-1"))
+    crashed.append(_post("POST-2"))
+    _crash(crashed)
+    assert _post_ids() == []
+
+    writer().recover()
+
+    assert _post_ids() == ["POST-1", "POST-2"]
+    assert list(JOURNAL_DIR.glob("journal-*.ndjson")) == []
+
+
+def test_recover_skips_rows_already_written_and_torn_lines(writer):
+    crashed = writer()
+    crashed.append(_post("POST-1"))
+    crashed.append(_post("POST-2"))
+    crashed.journal.write('{"post_id": "POST-3", "cli')  # torn by the crash
+    _crash(crashed)
+    append_rows([_post("POST-1")])  # its group was written before the crash
+
+    writer().recover()
+
+    assert _post_ids() == ["POST-1", "POST-2"]
+
+
+def test_recover_leaves_journal_of_running_process_alone(writer):
+    running = writer()
+    running.append(_post("POST-1"))
+
+    writer().recover()
+
+    assert _post_ids() == []
+    assert [json.loads(line)["post_id"] for line in running.journal_path.read_text().splitlines()] == ["POST-1"]
+
+    running.flush()
+    assert _post_ids() == ["POST-1"]
+    assert running.journal_path.read_text() == ""
@@ -0,0 +1,121 @@
+import asyncio
+import base64
+import json
+import time
+
+import httpx
+import pytest
+import replicate
+from fastapi import FastAPI
+
+from app.routes.webhook_route import router as webhook_router
+from app.utilities import fake_replicate, replicate_predictions
+from app.utilities.replicate_predictions import run_prediction, verify_signature
+
+SECRET = "whsec_" + base64.b64encode(b"0123456789abcdef0123456789abcdef").decode()
+MODEL = "google/nano-banana"
+
+
+@pytest.fixture
+def webhooks(monkeypatch):
+    """
+    Wires the backend's webhook route and fake_replicate together in
+    process: predictions go to the fake API, its webhooks come back to
+    /webhooks/replicate. Yields the list of polls that were needed.
+    """
+    backend = FastAPI()
+    backend.include_router(webhook_router, prefix="/webhooks")
+
+    monkeypatch.setattr(replicate_predictions, "WEBHOOK_BASE_URL", "http://backend")
+    monkeypatch.setattr(replicate_predictions, "WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(replicate_predictions, "WEBHOOK_GRACE_SEC", 5.0)
+    monkeypatch.setattr(replicate_predictions, "POLL_INITIAL_SEC", 0.05)
+    monkeypatch.setattr(fake_replicate, "WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(fake_replicate, "DELAY_SEC", 0.05)
+    monkeypatch.setattr(fake_replicate, "_http", httpx.AsyncClient(transport=httpx.ASGITransport(app=backend)))
+
+    polls = []
+    poll = replicate_predictions._poll
+
+    async def counting_poll(client, prediction_id, future):
+        polls.append(prediction_id)
+        return await poll(client, prediction_id, future)
+
+    monkeypatch.setattr(replicate_predictions, "_poll", counting_poll)
+    return polls
+
+
+def _client() -> replicate.Client:
+    return replicate.Client(api_token="test", base_url="http://fake", transport=httpx.ASGITransport(app=fake_replicate.app))
+
+
+def _signed_headers(body: bytes, timestamp: int = None) -> dict:
+    return fake_replicate._signed_headers(body) if timestamp is None else {
+        **fake_replicate._signed_headers(body),
+        "webhook-timestamp": str(timestamp),
+    }
+
+
+# -------------------- Signatures --------------------
+
+def test_signature_accepts_replicate_signed_body(monkeypatch):
+    monkeypatch.setattr(replicate_predictions, "WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(fake_replicate, "WEBHOOK_SECRET", SECRET)
+    body = json.dumps({"id": "p1", "status": "succeeded"}).encode()
+
+    assert verify_signature(_signed_headers(body), body)
+
+
+def test_signature_rejects_tampered_stale_and_unsigned(monkeypatch):
+    monkeypatch.setattr(replicate_predictions, "WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(fake_replicate, "WEBHOOK_SECRET", SECRET)
+    body = json.dumps({"id": "p1", "status": "succeeded"}).encode()
+
+    assert not verify_signature(_signed_headers(body), body.replace(b"p1", b"p2"))
+    assert not verify_signature(_signed_headers(body, timestamp=int(time.time()) - 3600), body)
+    assert not verify_signature({"content-type": "application/json"}, body)
+
+
+def test_signature_rejects_everything_without_a_secret(monkeypatch):
+    monkeypatch.setattr(fake_replicate, "WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(replicate_predictions, "WEBHOOK_SECRET", "")
+    body = b"{}"
+
+    assert not verify_signature(_signed_headers(body), body)
+
+
+# -------------------- Handoff --------------------
+
+def test_webhook_after_create_resolves_the_waiter(webhooks):
+    output = asyncio.run(run_prediction(_client(), MODEL, {"prompt": "p"}))
+
+    assert output.endswith(".jpg")
+    assert webhooks == []
+
+
+def test_webhook_before_create_returns_is_kept_for_the_waiter(webhooks, monkeypatch):
+    client = _client()
+    create = client.predictions.async_create
+
+    async def slow_create(**kwargs):
+        # The webhook is delivered before the create() response is seen
+        prediction = await create(**kwargs)
+        while prediction.id not in replicate_predictions._early:
+            await asyncio.sleep(0.01)
+        return prediction
+
+    monkeypatch.setattr(client.predictions, "async_create", slow_create)
+    output = asyncio.run(run_prediction(client, MODEL, {"prompt": "p"}))
+
+    assert output.endswith(".jpg")
+    assert webhooks == []
+
+
+def test_unverifiable_webhook_is_rejected_and_prediction_polled(webhooks, monkeypatch):
+    monkeypatch.setattr(fake_replicate, "WEBHOOK_SECRET", "whsec_" + base64.b64encode(b"x" * 32).decode())
+    monkeypatch.setattr(replicate_predictions, "WEBHOOK_GRACE_SEC", 0.3)
+
+    output = asyncio.run(run_prediction(_client(), MODEL, {"prompt": "p"}))
+
+    assert output.endswith(".jpg")
+    assert len(webhooks) == 1